@@ -0,0 +1,86 @@
+import os
+import gzip
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+    zstd_available = True
+except ImportError:
+    zstd_available = False
+
+# Extension added to the compressed files of each method
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Large files are cut into pieces of this size, compressed independently and concatenated as
+# gzip members (or zstd frames): the result is still one valid .gz (or .zst) file
+MEMBER_SIZE = 32 * 1024 * 1024
+
+def compress_member(data, method, level):
+    # zlib and zstd release the GIL while compressing, the members are compressed by threads
+    if method == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def default_level(method):
+    return 3 if method == 'zstd' else 9
+
+def compress_files(jobs, method='gzip', level=None, workers=None, member_size=MEMBER_SIZE):
+    """Compress each (source path, target path) of jobs, files and pieces of large files in parallel.
+    Each target is written to a temporary file, renamed when complete.
+    Returns one dict per job, in order: 'source', 'target', 'size', 'compressed_size', 'ratio', 'seconds' and 'mb_per_s'.
+    """
+    if method not in EXTENSIONS:
+        raise ValueError(f"Unknown compression method '{method}'")
+    if method == 'zstd' and not zstd_available:
+        raise ImportError('zstd compression needs the zstandard package (pip install zstandard)')
+    level = default_level(method) if level is None else level
+    workers = workers or os.cpu_count() or 1
+    # At most two pieces per worker are held in memory, whatever the number and size of the files
+    in_flight = threading.BoundedSemaphore(2 * workers)
+
+    def compress_job(job, member_pool):
+        source, target = job
+        start = time.perf_counter()
+        tmp_path = f'{target}.{os.getpid()}.tmp'
+        pending = []
+        members = 0
+        try:
+            with open(source, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+                while True:
+                    data = f_in.read(member_size)
+                    # An empty file still gets one (empty) member
+                    if not data and members:
+                        break
+                    in_flight.acquire()
+                    future = member_pool.submit(compress_member, data, method, level)
+                    future.add_done_callback(lambda _: in_flight.release())
+                    pending.append(future)
+                    members += 1
+                    # Write the members in order, as soon as the first ones are ready
+                    while pending and (pending[0].done() or len(pending) >= workers):
+                        f_out.write(pending.pop(0).result())
+                    if not data:
+                        break
+                for future in pending:
+                    f_out.write(future.result())
+            os.replace(tmp_path, target)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        seconds = time.perf_counter() - start
+        size, compressed_size = os.path.getsize(source), os.path.getsize(target)
+        return {'source': source, 'target': target, 'size': size, 'compressed_size': compressed_size,
+                'ratio': size / compressed_size if compressed_size else 0.0, 'seconds': seconds,
+                'mb_per_s': size / 1e6 / seconds if seconds else 0.0}
+
+    with ThreadPoolExecutor(max_workers=workers) as member_pool, ThreadPoolExecutor(max_workers=workers) as file_pool:
+        return list(file_pool.map(lambda job: compress_job(job, member_pool), jobs))
+
+def print_compression_stats(stats):
+    print(f"{os.path.basename(stats['source'])}: {stats['size'] / 1e6:.1f} MB -> {stats['compressed_size'] / 1e6:.1f} MB "
+          f"(ratio {stats['ratio']:.1f}) in {stats['seconds']:.2f} s, {stats['mb_per_s']:.1f} MB/s")
@@ -0,0 +1,94 @@
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+
+def _local_name(tag):
+    # GraphML elements are namespaced: '{http://graphml.graphdrawing.org/xmlns}edge' -> 'edge'
+    return tag.rpartition('}')[2]
+
+def parse_graphml_edges(graphml_path, attributes):
+    """Read the nodes and the edges of a GraphML file in one iterparse() pass.
+    Returns a dict of NumPy arrays: 'nodes' (the node ids), 'source' and 'target' (the node ids of
+    each edge) and one float array per edge attribute in attributes (NaN where an edge has no value).
+    Edges come in the order and orientation of networkx.read_graphml(...).edges(data=True).
+    """
+    edge_keys = {}
+    defaults = {}
+    nodes = {}
+    sources, targets = [], []
+    values = {name: [] for name in attributes}
+    directed = False
+
+    for event, elem in ET.iterparse(graphml_path, events=('start', 'end')):
+        tag = _local_name(elem.tag)
+        if event == 'start':
+            if tag == 'graph':
+                directed = elem.get('edgedefault') == 'directed'
+            continue
+        if tag == 'key' and elem.get('for') in ('edge', 'all'):
+            edge_keys[elem.get('id')] = elem.get('attr.name')
+            for child in elem:
+                if _local_name(child.tag) == 'default':
+                    defaults[elem.get('attr.name')] = child.text
+        elif tag == 'node':
+            nodes.setdefault(elem.get('id'), len(nodes))
+            elem.clear()
+        elif tag == 'edge':
+            source, target = elem.get('source'), elem.get('target')
+            nodes.setdefault(source, len(nodes))
+            nodes.setdefault(target, len(nodes))
+            data = {edge_keys.get(child.get('key')): child.text for child in elem if _local_name(child.tag) == 'data'}
+            for name in attributes:
+                text = data.get(name, defaults.get(name))
+                values[name].append(np.nan if text is None else float(text))
+            sources.append(source)
+            targets.append(target)
+            elem.clear()
+
+    node_ids = np.array(list(nodes), dtype=str)
+    s_pos = np.array([nodes[source] for source in sources], dtype=np.int64)
+    t_pos = np.array([nodes[target] for target in targets], dtype=np.int64)
+    if not directed:
+        # networkx yields an undirected edge from the node that comes first
+        s_pos, t_pos = np.minimum(s_pos, t_pos), np.maximum(s_pos, t_pos)
+
+    # networkx walks the nodes in order and, for each node, its neighbours in the order they
+    # first appear in the file (parallel edges together)
+    pairs = s_pos * max(len(nodes), 1) + t_pos
+    _, first, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+    order = np.lexsort((np.arange(len(pairs)), first[inverse], s_pos))
+
+    edges = {'nodes': node_ids, 'source': node_ids[s_pos[order]], 'target': node_ids[t_pos[order]]}
+    for name in attributes:
+        edges[name] = np.array(values[name], dtype=float)[order]
+    return edges
+
+def get_graphml_cache_path(graphml_path):
+    return graphml_path + '.edges.npz'
+
+def read_graphml_edges(graphml_path, attributes, cache=False):
+    """Return the edge arrays of parse_graphml_edges().
+    With cache=True they are also saved in a compact .npz next to the GraphML file, and read from
+    there instead of parsing the XML as long as the size and modification time of the file are unchanged.
+    """
+    stat = os.stat(graphml_path)
+    source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    cache_path = get_graphml_cache_path(graphml_path)
+    names = ['nodes', 'source', 'target', *attributes]
+
+    if cache:
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached['graphml_source'], source) and all(name in cached.files for name in names):
+                    return {name: cached[name] for name in names}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    edges = parse_graphml_edges(graphml_path, attributes)
+    if cache:
+        # Stages running at the same time may both write the cache, each through its own temporary file
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, graphml_source=source, **edges)
+        os.replace(tmp_path, cache_path)
+    return edges
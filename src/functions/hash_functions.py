@@ -1,11 +1,15 @@
 import hashlib
+import json
+import os
+import gzip
+from functools import lru_cache
 
-def get_hash(f_path, mode='md5'):
+def get_hash(f_path, mode='md5', chunk_size=1024 * 1024):
+    # Read by chunks, a large graph is never held whole in memory
     h = hashlib.new(mode)
     with open(f_path, 'rb') as file:
-        data = file.read()
-        file.close()
-    h.update(data)
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            h.update(chunk)
     digest = h.hexdigest()
     return digest
 
@@ -13,4 +17,121 @@ def get_data(f_path):
     with open(f_path, 'r') as file:
         data = file.read()
         file.close()
-    return data
\ No newline at end of file
+    return data
+
+def get_fingerprint_path(output_path):
+    return output_path + '.fingerprint'
+
+def load_fingerprint(output_path):
+    try:
+        with open(get_fingerprint_path(output_path), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def save_fingerprint(output_path, fingerprint):
+    fingerprint_path = get_fingerprint_path(output_path)
+    with open(fingerprint_path + '.tmp', 'w') as file:
+        json.dump(fingerprint, file, indent=1, sort_keys=True)
+    os.replace(fingerprint_path + '.tmp', fingerprint_path)
+
+@lru_cache(maxsize=4)
+def _get_functions_hash(functions_dir, files):
+    h = hashlib.md5()
+    for name, _, _ in files:
+        h.update(name.encode('utf-8'))
+        h.update(get_hash(os.path.join(functions_dir, name)).encode('utf-8'))
+    return h.hexdigest()
+
+def get_functions_hash():
+    """md5 of the shared helpers (the .py files of this folder), which the stage outputs also depend on.
+    All of them are hashed, whatever a stage imports, so that the fingerprint of an output does
+    not depend on the other stages run by the same process. It is computed once per process while they are unchanged.
+    """
+    functions_dir = os.path.dirname(os.path.abspath(__file__))
+    files = []
+    with os.scandir(functions_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.py'):
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return _get_functions_hash(functions_dir, tuple(sorted(files)))
+
+def get_fingerprint(output_path, input_paths, script_path, params):
+    """Fingerprint what an output is built from: the md5 of each input file, of the script,
+    of the shared helpers and the script parameters. Input paths are stored relative to the output folder.
+    Inputs whose size and modification time match the recorded fingerprint are not hashed again.
+    """
+    previous_inputs = (load_fingerprint(output_path) or {}).get('inputs', {})
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    inputs = {}
+    for input_path in input_paths:
+        key = os.path.relpath(os.path.abspath(input_path), output_dir)
+        if not os.path.isfile(input_path):
+            inputs[key] = None
+            continue
+        stat = os.stat(input_path)
+        known = previous_inputs.get(key)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            digest = known['md5']
+        else:
+            digest = get_hash(input_path)
+        inputs[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'md5': digest}
+    return {'script': get_hash(script_path), 'functions': get_functions_hash(), 'params': params, 'inputs': inputs}
+
+def same_fingerprint(previous, fingerprint):
+    # Only the content hashes matter, a touched but unchanged input is still up to date
+    if previous is None or fingerprint is None:
+        return False
+    def content(f):
+        inputs = {k: (v['md5'] if v else None) for k, v in f.get('inputs', {}).items()}
+        return f.get('script'), f.get('functions'), f.get('params'), inputs
+    return content(previous) == content(fingerprint)
+
+def is_up_to_date(output_path, fingerprint):
+    return os.path.isfile(output_path) and same_fingerprint(load_fingerprint(output_path), fingerprint)
+
+class HashingWriter:
+    """Write bytes to a temporary file while computing their md5, gzip them on the way if compress.
+    commit() then renames the temporary file to the path built from the md5 of the uncompressed
+    content, so that a hash-named output is written once and never read again to be hashed or compressed.
+    Leaving the with block without commit() removes the temporary file.
+    """
+    def __init__(self, tmp_path, compress=False, compresslevel=9, buffer_size=1024 * 1024):
+        self.tmp_path = tmp_path
+        self.compress = compress
+        self.path = None
+        self._hash = hashlib.md5()
+        self._raw = open(tmp_path, 'wb', buffering=buffer_size)
+        # An empty filename keeps the temporary name out of the gzip header
+        self._file = gzip.GzipFile(filename='', mode='wb', fileobj=self._raw, compresslevel=compresslevel) if compress else self._raw
+
+    def write(self, data):
+        self._hash.update(data)
+        self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def _close(self):
+        if self._file is not self._raw:
+            self._file.close()
+        self._raw.close()
+
+    def commit(self, path_from_hash):
+        """Rename the output to path_from_hash(md5 of the content) and return that path."""
+        self._close()
+        self.path = path_from_hash(self.hexdigest())
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def discard(self):
+        self._close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.path is None:
+            self.discard()
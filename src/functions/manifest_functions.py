@@ -0,0 +1,150 @@
+import os
+import json
+import fnmatch
+import glob
+from functools import lru_cache
+import pandas as pd
+
+# Inputs of the stages, relative to the sample folder
+SAMPLE_INPUTS = {
+    'metadata': 'metadata.tsv',
+    'taxo_metadata': 'taxo_output/{sample}_taxo_metadata.tsv',
+    # Metadata read by the ISDB, module metadata and spec2vec stages, named after the sample
+    'sample_metadata': '{sample}_metadata.tsv',
+}
+
+# Inputs of the stages, relative to a polarity folder (or to the sample folder for Sirius results left at its root)
+POLARITY_INPUTS = {
+    'feature_table': '{sample}-feature_table.csv',
+    'compound_identifications': 'compound_identifications.tsv',
+    'csi_adducts': 'compound_identifications_adducts.tsv',
+    'sirius_params': 'params.yml',
+    'canopus_adducts': 'canopus_formula_summary_adducts.tsv',
+    'tima': 'tima/data/processed/*tima_annotations.tsv',
+    'isdb': 'isdb/{sample}_isdb_reweighted_flat_{ion}.tsv',
+    'mn_graphml': 'molecular_network/{sample}_mn_{ion}.graphml',
+    'mn_metadata': 'molecular_network/{sample}_mn_metadata_{ion}.tsv',
+    'speclib': 'spectral_lib_matching/{sample}_lib_results_final_{ion}.tsv',
+    'features_mgf': '{sample}_features_ms2_{ion}.mgf',
+}
+
+POLARITIES = ['pos', 'neg']
+
+def scan_folder(path):
+    """Return the names of the files and of the folders directly in path, in one os.scandir() call."""
+    files, folders = set(), set()
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    folders.add(entry.name)
+                else:
+                    files.add(entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return files, folders
+
+def scan_sample(sample_path, sample):
+    """Describe one sample folder: its polarity folders, its inputs by polarity and its parsed metadata.tsv.
+    Only the folders holding inputs are listed, each of them once.
+    """
+    found = set()
+    def scan(relative_folder):
+        files, folders = scan_folder(os.path.join(sample_path, relative_folder))
+        found.update(os.path.join(relative_folder, name) for name in files)
+        return folders
+
+    root_folders = scan('')
+    if 'taxo_output' in root_folders:
+        scan('taxo_output')
+    polarities = [polarity for polarity in POLARITIES if polarity in root_folders]
+    # Results left at the root of the sample folder are looked for as in a polarity folder
+    for folder, folders in [('', root_folders)] + [(polarity, scan(polarity)) for polarity in polarities]:
+        for subfolder in ['molecular_network', 'spectral_lib_matching', 'isdb']:
+            if subfolder in folders:
+                scan(os.path.join(folder, subfolder))
+        if 'tima' in folders:
+            scan(os.path.join(folder, 'tima', 'data', 'processed'))
+
+    def match(pattern):
+        matches = sorted(fnmatch.filter(found, pattern))
+        return matches[0] if matches else None
+
+    inputs = {}
+    for polarity in polarities + ['root']:
+        folder = '' if polarity == 'root' else polarity
+        # The polarity of the results at the root is not known yet, their file names may hold either
+        ion = '*' if polarity == 'root' else polarity
+        polarity_inputs = {}
+        for name, template in POLARITY_INPUTS.items():
+            relative_path = match(os.path.join(folder, template.format(sample=glob.escape(sample), ion=ion)))
+            if relative_path is not None:
+                polarity_inputs[name] = relative_path
+        inputs[polarity] = polarity_inputs
+    for name, template in SAMPLE_INPUTS.items():
+        relative_path = match(template.format(sample=glob.escape(sample)))
+        if relative_path is not None:
+            inputs.setdefault('sample', {})[name] = relative_path
+
+    metadata = None
+    if 'metadata' in inputs.get('sample', {}):
+        try:
+            metadata = pd.read_csv(os.path.join(sample_path, 'metadata.tsv'), sep='\t').to_dict('records')
+        except (pd.errors.ParserError, UnicodeDecodeError) as e:
+            # An unreadable metadata.tsv is not an available input
+            print(f"Unable to parse the metadata of '{sample}': {e}")
+            del inputs['sample']['metadata']
+
+    return {'path': sample_path, 'polarities': polarities, 'inputs': inputs, 'metadata': metadata}
+
+def build_manifest(sample_dir_path, samples=None):
+    """List the samples of sample_dir_path (or only the given samples) with os.scandir()."""
+    sample_dir_path = os.path.abspath(sample_dir_path)
+    if samples is None:
+        _, folders = scan_folder(sample_dir_path)
+        samples = sorted(folder for folder in folders if not folder.startswith('.'))
+    manifest = {}
+    for sample in samples:
+        sample_path = os.path.join(sample_dir_path, sample)
+        if os.path.isdir(sample_path):
+            manifest[sample] = scan_sample(sample_path, sample)
+    return manifest
+
+def save_manifest(manifest, manifest_path):
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+@lru_cache(maxsize=4)
+def _read_manifest(manifest_path, mtime_ns):
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def load_manifest(sample_dir_path, manifest_path=None, samples=None):
+    """Return the manifest written by rdf_builder.py at manifest_path, or build it when there is none.
+    A manifest file is parsed once per process, as long as it is not rewritten.
+    """
+    if manifest_path:
+        return _read_manifest(manifest_path, os.stat(manifest_path).st_mtime_ns)
+    return build_manifest(sample_dir_path, samples)
+
+def get_input(sample, polarity, name):
+    """Absolute path of an input of a sample manifest, or None if the sample does not have it."""
+    if polarity in sample['inputs'] and name in sample['inputs'][polarity]:
+        return os.path.join(sample['path'], sample['inputs'][polarity][name])
+    return None
+
+def get_expected_input(sample, polarity, name):
+    """Absolute path where an input of a sample manifest is expected, whether the sample has it or not."""
+    if polarity == 'sample':
+        relative_path = SAMPLE_INPUTS[name].format(sample=os.path.basename(sample['path']))
+    else:
+        folder = '' if polarity == 'root' else polarity
+        relative_path = os.path.join(folder, POLARITY_INPUTS[name].format(sample=os.path.basename(sample['path']), ion=polarity))
+    return os.path.join(sample['path'], relative_path)
+
+def get_metadata(sample):
+    """The metadata.tsv of a sample manifest as a DataFrame, or None if the sample does not have one."""
+    if sample['metadata'] is None:
+        return None
+    return pd.DataFrame.from_records(sample['metadata'])
@@ -0,0 +1,160 @@
+import os
+import shutil
+import json
+import gzip
+from functools import lru_cache
+import pandas as pd
+import rdflib
+from rdflib import Namespace
+
+# Namespaces shared by all the RDF stages
+kg_uri = "https://enpkg.commons-lab.org/kg/"
+ns_kg = rdflib.Namespace(kg_uri)
+prefix_kg = "enpkg"
+
+module_uri = "https://enpkg.commons-lab.org/module/"
+ns_module = rdflib.Namespace(module_uri)
+prefix_module = "enpkgmodule"
+
+WD = Namespace('http://www.wikidata.org/entity/')
+
+@lru_cache(maxsize=None)
+def load_adducts_dic(adducts_path='data/adducts_formatter.json'):
+    """Load the adducts formatter dictionary once per process.
+    The returned dictionary is shared between stages and must not be modified.
+    """
+    with open(os.path.normpath(adducts_path)) as json_file:
+        return json.load(json_file)
+
+def open_rdf(file_path, mode='rt'):
+    """Open a graph file, gzipped or not."""
+    opener = gzip.open if file_path.endswith('.gz') else open
+    if 'b' in mode:
+        return opener(file_path, mode)
+    return opener(file_path, mode, encoding='utf8')
+
+def is_ntriples(file_path):
+    """Tell the N-Triples graphs written by TripleWriter from the Turtle ones by their first statement."""
+    with open_rdf(file_path) as f:
+        for line in f:
+            if line.strip():
+                return line.startswith(('<', '_:'))
+    return True
+
+def iter_triple_lines(file_path):
+    """Yield the triples of a .ttl (or .ttl.gz) file as N-Triples lines.
+    N-Triples files are streamed line by line, Turtle ones are parsed with rdflib and written back as N-Triples.
+    """
+    if is_ntriples(file_path):
+        with open_rdf(file_path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line + '\n'
+    else:
+        graph = rdflib.Graph()
+        if file_path.endswith('.gz'):
+            with open_rdf(file_path, 'rb') as f:
+                graph.parse(f, format='ttl')
+        else:
+            graph.parse(file_path, format='ttl')
+        for triple in graph:
+            yield nt_row(triple)
+
+_nt_escapes = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+def nt_row(triple):
+    """Format a triple of rdflib terms as one N-Triples line.
+    Literals are always written quoted, with their language or datatype: Literal.n3() would
+    shorten numbers and booleans and use long strings for multi-line values, which N-Triples forbids.
+    """
+    subject, predicate, obj = triple
+    if isinstance(obj, rdflib.Literal):
+        value = '"' + str(obj).translate(_nt_escapes) + '"'
+        if obj.language:
+            value += '@' + obj.language
+        elif obj.datatype:
+            value += '^^<' + str(obj.datatype) + '>'
+    else:
+        value = obj.n3()
+    return f'{subject.n3()} {predicate.n3()} {value} .\n'
+
+def nt_uris(values):
+    """Format a pandas Series of IRIs as N-Triples terms, for TripleWriter.add_columns().
+    The IRIs are not validated, they must already be valid (no spaces, quotes or brackets).
+    """
+    return '<' + values.astype(str) + '>'
+
+def nt_literals(values, datatype=None):
+    """Format a pandas Series as N-Triples literals, for TripleWriter.add_columns().
+    The lexical form of each value is its str(), as for a rdflib Literal.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype(str)
+    else:
+        values = values.astype(str)
+        # Most columns have nothing to escape, which is cheaper to check on the joined text
+        text = ''.join(values.tolist())
+        if any(c in text for c in '\\"\n\r'):
+            values = values.str.translate(_nt_escapes)
+    if datatype is None:
+        return '"' + values + '"'
+    return '"' + values + '"^^<' + str(datatype) + '>'
+
+
+class TripleWriter:
+    """Write triples straight to a N-Triples file instead of collecting them in a rdflib Graph.
+    It is used in place of the Graph of a stage: g.add(triple) appends one line to the output.
+    N-Triples is a subset of Turtle, so the output keeps its .ttl name and is read as before.
+    Unlike a Graph, a triple added twice is written twice; parsers drop such duplicates.
+    The triples go to a temporary file that only replaces the output on close(), so a stage
+    failing halfway through never leaves a truncated graph behind. With append=True the
+    temporary file is appended to the existing output on close() instead.
+    """
+    def __init__(self, path, buffer_size=1024 * 1024, append=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.append = append
+        self.count = 0
+        self._file = open(path + '.tmp', 'w', encoding='utf-8', buffering=buffer_size)
+
+    def add(self, triple):
+        self._file.write(nt_row(triple))
+        self.count += 1
+
+    def add_columns(self, subjects, predicate, objects):
+        """Add one triple per row of the subjects and objects columns built with nt_uris()
+        or nt_literals(). A subject or object given as a rdflib term is used for every row.
+        """
+        if isinstance(subjects, rdflib.term.Node):
+            subjects = subjects.n3()
+        if isinstance(objects, rdflib.term.Node):
+            objects = objects.n3()
+        lines = subjects + ' ' + predicate.n3() + ' ' + objects + ' .\n'
+        self._file.write(''.join(lines.tolist()))
+        self.count += len(lines)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._file.close()
+        if self.append and os.path.isfile(self.path):
+            with open(self.path + '.tmp', 'rb') as new_triples, open(self.path, 'ab') as output:
+                shutil.copyfileobj(new_triples, output)
+            os.remove(self.path + '.tmp')
+        else:
+            os.replace(self.path + '.tmp', self.path)
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
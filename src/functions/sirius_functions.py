@@ -0,0 +1,73 @@
+import os
+import json
+import pandas as pd
+from manifest_functions import get_input
+
+def get_polarity_cache_path(sample_path):
+    return os.path.join(sample_path, 'rdf', 'sirius_polarity.json')
+
+def get_adducts_polarity(csi_path, cache_path):
+    """Deduce the polarity of Sirius results from their most frequent adduct.
+    Only the adduct column is read, and the answer is cached in cache_path for as long
+    as the size and modification time of csi_path are unchanged.
+    """
+    stat = os.stat(csi_path)
+    source = {'path': os.path.basename(csi_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    try:
+        with open(cache_path, 'r') as file:
+            cache = json.load(file)
+        if cache['source'] == source:
+            return cache['ionization_mode']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    adduct_counts = pd.read_csv(csi_path, sep='\t', usecols=['adduct'])['adduct'].value_counts()
+    most_frequent_adduct = adduct_counts.idxmax()
+    if ']+' in most_frequent_adduct:
+        ionization_mode = 'pos'
+    elif ']-' in most_frequent_adduct:
+        ionization_mode = 'neg'
+    else:
+        raise ValueError('Cannot deduce polarity from the most frequent adduct.')
+
+    # Stages running at the same time may both write the cache, each through its own temporary file
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'ionization_mode': ionization_mode, 'source': source}, file, indent=1)
+    os.replace(tmp_path, cache_path)
+    return ionization_mode
+
+def detect_sirius_polarity(sample):
+    """Find the Sirius results of a sample manifest and their polarity.
+    Returns (ionization_mode, sirius_inputs), sirius_inputs being the key of the results in the
+    inputs of the sample manifest, or (None, None) if the sample has no Sirius results.
+    Results left at the root of the sample folder are used in place, their polarity being
+    deduced from the adducts. Otherwise they are looked for in the pos and neg folders.
+    """
+    root_csi_path = get_input(sample, 'root', 'compound_identifications')
+    if root_csi_path is not None:
+        return get_adducts_polarity(root_csi_path, get_polarity_cache_path(sample['path'])), 'root'
+
+    for polarity in sample['polarities']:
+        if get_input(sample, polarity, 'compound_identifications') is not None:
+            return polarity, polarity
+    if sample['polarities']:
+        polarity = sample['polarities'][0]
+        return polarity, polarity
+    return None, None
+
+def get_polarity_input(sample, polarity, name):
+    """Absolute path of an input of a polarity of a sample manifest, or None if the sample does not have it.
+    Results left at the root of the sample folder stand for those of the polarity deduced from
+    their Sirius adducts, as they were once moved to that polarity folder.
+    """
+    path = get_input(sample, polarity, name)
+    if path is None and get_input(sample, 'root', name) is not None:
+        try:
+            ionization_mode, sirius_inputs = detect_sirius_polarity(sample)
+        except ValueError:
+            return None
+        if sirius_inputs == 'root' and ionization_mode == polarity:
+            return get_input(sample, 'root', name)
+    return path
@@ -0,0 +1,264 @@
+import os
+import sys
+import argparse
+import textwrap
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.join(Path(__file__).parents[0], 'functions'))
+from manifest_functions import scan_folder, scan_sample
+
+# Column holding the feature id of each table input, as a function of its value
+FEATURE_ID_COLUMNS = {
+    'feature_table': 'row ID',
+    'compound_identifications': 'id',
+    'csi_adducts': 'id',
+    'canopus_adducts': 'id',
+    'tima': 'feature_id',
+    'isdb': 'feature_id',
+    'mn_metadata': 'feature_id',
+    'speclib': 'feature_id',
+}
+# Sirius ids look like '115_2211_115', the feature id being the last part
+SIRIUS_INPUTS = ['compound_identifications', 'csi_adducts', 'canopus_adducts']
+
+# Columns shifted together for each copy of a feature, so that the tables of a sample stay consistent
+MZ_COLUMNS = ['row m/z', 'precursor_mz', 'feature_mz', 'mz']
+RT_COLUMNS = ['row retention time', 'feature_rt']
+
+# The keys and edge data of the template MN are written back with the default GraphML namespace
+GRAPHML_NS = 'http://graphml.graphdrawing.org/xmlns'
+ET.register_namespace('', GRAPHML_NS)
+
+# Templates loaded by this process, {template path: template}
+_templates = {}
+
+def read_table(path):
+    # Everything is kept as text, so that the values which are not regenerated are written back unchanged
+    sep = ',' if path.endswith('.csv') else '\t'
+    return pd.read_csv(path, sep=sep, dtype=str, keep_default_na=False)
+
+def write_table(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table.to_csv(path, sep=',' if path.endswith('.csv') else '\t', index=False)
+
+def table_feature_ids(table, name):
+    values = table[FEATURE_ID_COLUMNS[name]]
+    if name in SIRIUS_INPUTS:
+        return values.str.rsplit('_', n=1).str[-1]
+    return values
+
+def read_graphml(path):
+    root = ET.parse(path).getroot()
+    graph = next(child for child in root if child.tag.endswith('graph'))
+    keys = [ET.tostring(child, encoding='unicode').strip() for child in root if child.tag.endswith('key')]
+    nodes = [child.get('id') for child in graph if child.tag.endswith('node')]
+    edges = [(child.get('source'), child.get('target'), ''.join(ET.tostring(data, encoding='unicode').strip() for data in child))
+             for child in graph if child.tag.endswith('edge')]
+    return {'keys': keys, 'edgedefault': graph.get('edgedefault', 'undirected'), 'nodes': nodes, 'edges': edges}
+
+def load_template(template_path):
+    """Read the inputs of a template sample folder once per process."""
+    if template_path not in _templates:
+        name = os.path.basename(template_path)
+        sample = scan_sample(template_path, name)
+        inputs = {}
+        for polarity, polarity_inputs in sample['inputs'].items():
+            for input_name, relative_path in polarity_inputs.items():
+                path = os.path.join(template_path, relative_path)
+                if input_name == 'mn_graphml':
+                    data = read_graphml(path)
+                elif input_name in FEATURE_ID_COLUMNS or input_name == 'metadata':
+                    data = read_table(path)
+                else:
+                    with open(path, 'rb') as file:
+                        data = file.read()
+                inputs[polarity, input_name] = (relative_path, data)
+        _templates[template_path] = {'name': name, 'sample': sample, 'inputs': inputs}
+    return _templates[template_path]
+
+def get_copies(feature_ids, factor, rng):
+    """Draw the features of a synthetic sample from the features of its template.
+    Each template feature is copied int(factor) times, plus once more with probability factor - int(factor).
+    Returns {template feature id: [synthetic feature ids]}, the synthetic ids being numbered from 1.
+    """
+    counts = np.full(len(feature_ids), int(factor)) + (rng.random(len(feature_ids)) < factor - int(factor))
+    copies, next_id = {}, 1
+    for feature_id, count in zip(feature_ids, counts):
+        copies[feature_id] = [str(i) for i in range(next_id, next_id + count)]
+        next_id += count
+    return copies
+
+def expand_table(table, name, copies, shifts):
+    """Repeat the rows of a table once per copy of their feature, with the id and the m/z and RT shifts of the copy."""
+    template_ids = table_feature_ids(table, name)
+    new_ids = [new_id for feature_id in template_ids for new_id in copies.get(feature_id, ())]
+    counts = [len(copies.get(feature_id, ())) for feature_id in template_ids]
+    expanded = table.iloc[np.repeat(np.arange(len(table)), counts)].reset_index(drop=True)
+
+    column = FEATURE_ID_COLUMNS[name]
+    if name in SIRIUS_INPUTS:
+        parts = expanded[column].str.split('_')
+        expanded[column] = [f'{new_id}_' + '_'.join(p[1:-1]) + f'_{new_id}' if len(p) > 2 else new_id
+                            for new_id, p in zip(new_ids, parts)]
+    else:
+        expanded[column] = new_ids
+
+    positions = np.array(new_ids, dtype=np.int64) - 1
+    for columns, shift in [(MZ_COLUMNS, shifts['mz']), (RT_COLUMNS, shifts['rt'])]:
+        for col in columns:
+            if col in expanded.columns:
+                values = pd.to_numeric(expanded[col], errors='coerce')
+                shifted = values * (1 + shift[positions]) if columns is MZ_COLUMNS else values + shift[positions]
+                expanded[col] = shifted.astype(str).where(values.notna(), expanded[col])
+    if name == 'feature_table':
+        # The areas vary from sample to sample, log-normally
+        for col in expanded.columns:
+            if col.endswith(' Peak area'):
+                values = pd.to_numeric(expanded[col], errors='coerce')
+                areas = values * shifts['area'][positions]
+                expanded[col] = areas.astype(str).where(values.notna(), expanded[col])
+    return expanded
+
+def write_graphml(graphml, copies, path):
+    """Write the MN of the template with each node replaced by its copies.
+    The i-th copy of an edge joins the i-th copy of its source to a copy of its target.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        file.write(f'<graphml xmlns="{GRAPHML_NS}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                   f'xsi:schemaLocation="{GRAPHML_NS} {GRAPHML_NS}/1.0/graphml.xsd">')
+        for key in graphml['keys']:
+            file.write(key + '\n')
+        file.write(f'<graph edgedefault={quoteattr(graphml["edgedefault"])}>')
+        for node in graphml['nodes']:
+            for new_id in copies.get(node, ()):
+                file.write(f'<node id={quoteattr(new_id)}/>\n')
+        for source, target, data in graphml['edges']:
+            sources, targets = copies.get(source, ()), copies.get(target, ())
+            if not targets:
+                continue
+            for i, new_source in enumerate(sources):
+                file.write(f'<edge source={quoteattr(new_source)} target={quoteattr(targets[i % len(targets)])}>{data}</edge>\n')
+        file.write('</graph></graphml>')
+
+def generate_sample(template_path, output_path, index, factor, seed):
+    """Write the synthetic sample number index from a template sample folder, with about factor times its features.
+    Returns (sample folder name, number of features).
+    """
+    template = load_template(template_path)
+    rng = np.random.default_rng([seed, index])
+    sample_id = f'SYN{index:06d}'
+    polarities = template['sample']['polarities']
+    name = f'{sample_id}_1_{"_".join(polarities)}_SIRIUS_PREPROCESS'
+    sample_path = os.path.join(output_path, name)
+
+    # The features of each polarity are drawn from the feature table of the template
+    # Sirius results left at the root of the folder follow the first polarity
+    copies, shifts = {}, {}
+    for polarity in polarities + ['root']:
+        feature_table = template['inputs'].get((polarity, 'feature_table'))
+        if feature_table is None:
+            continue
+        feature_ids = table_feature_ids(feature_table[1], 'feature_table').tolist()
+        copies[polarity] = get_copies(feature_ids, factor, rng)
+        n = sum(len(c) for c in copies[polarity].values())
+        shifts[polarity] = {'mz': rng.normal(0, 2e-6, n), 'rt': rng.normal(0, 0.02, n), 'area': rng.lognormal(0, 0.5, n)}
+    if polarities and polarities[0] in copies:
+        copies.setdefault('root', copies[polarities[0]])
+        shifts.setdefault('root', shifts[polarities[0]])
+
+    for (polarity, input_name), (relative_path, data) in template['inputs'].items():
+        path = os.path.join(sample_path, relative_path.replace(template['name'], name))
+        if input_name == 'metadata':
+            metadata = data.copy()
+            for polarity_name in polarities:
+                if f'sample_filename_{polarity_name}' in metadata.columns:
+                    metadata[f'sample_filename_{polarity_name}'] = f'{sample_id}_1_{polarity_name}_mzML'
+            metadata['sample_id'] = sample_id
+            if 'source_id' in metadata.columns:
+                metadata['source_id'] = sample_id
+            if 'folder' in metadata.columns:
+                metadata['folder'] = name
+            write_table(metadata, path)
+        elif input_name == 'mn_graphml':
+            if polarity in copies:
+                write_graphml(data, copies[polarity], path)
+        elif input_name in FEATURE_ID_COLUMNS:
+            if polarity in copies:
+                write_table(expand_table(data, input_name, copies[polarity], shifts[polarity]), path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(data)
+    return name, sum(sum(len(c) for c in polarity_copies.values()) for polarity, polarity_copies in copies.items() if polarity != 'root')
+
+def generate_task(task):
+    # Pool.imap() passes a single argument
+    return generate_sample(*task)
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generates synthetic sample folders from real ones, to measure the pipeline at scale.
+            Each synthetic sample copies the inputs of a template sample, with its features resampled
+            (and their m/z, retention times and areas varied) and the tables, MN and metadata renumbered accordingly.
+             --------------------------------
+                Arguments:
+                - Path to the directory where the template samples folders are located (default = input)
+                - Path to the directory where the synthetic samples folders are written
+                - Number of synthetic samples
+                - Scale factor of the number of features per sample, and its log-normal spread between samples
+            '''))
+
+    parser.add_argument('-t', '--templates_path', default='input',
+                        help='The path to the directory where the template samples folders are located (default: input)')
+    parser.add_argument('-o', '--output_path', required=True,
+                        help='The path to the directory where the synthetic samples folders are written')
+    parser.add_argument('-n', '--number', type=int, required=True,
+                        help='The number of synthetic samples to generate')
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+                        help='The number of features of a synthetic sample, relative to its template (default: 1.0)')
+    parser.add_argument('--spread', type=float, default=0.3,
+                        help='The log-normal spread of the scale between samples, 0 for the same scale everywhere (default: 0.3)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the generator, a sample only depends on the seed and its number (default: 0)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='The number of samples generated in parallel (default: number of CPUs)')
+
+    args = parser.parse_args(argv)
+    if args.number < 1:
+        parser.error('The number of synthetic samples must be at least 1')
+    templates_path = os.path.normpath(args.templates_path)
+    output_path = os.path.normpath(args.output_path)
+    templates = [os.path.join(templates_path, folder)
+                 for folder in sorted(scan_folder(templates_path)[1]) if not folder.startswith('.')]
+    if not templates:
+        parser.error(f'No template sample folder in {templates_path}')
+    os.makedirs(output_path, exist_ok=True)
+
+    # The templates are used in turn, the scale of each sample is drawn around --scale
+    factors = args.scale * np.random.default_rng(args.seed).lognormal(-args.spread ** 2 / 2, args.spread, args.number)
+    tasks = [(templates[i % len(templates)], output_path, i + 1, factor, args.seed) for i, factor in enumerate(factors)]
+
+    workers = min(args.workers or cpu_count(), len(tasks))
+    if workers <= 1:
+        results = [generate_task(task) for task in tqdm(tasks)]
+    else:
+        with Pool(workers) as pool:
+            results = list(tqdm(pool.imap(generate_task, tasks, chunksize=max(1, len(tasks) // (workers * 8))), total=len(tasks)))
+
+    features = [count for _, count in results]
+    print(f'{len(results)} samples written in {output_path}, {sum(features)} features '
+          f'(min {min(features)}, median {int(np.median(features))}, max {max(features)} per sample)')
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import os
+import sys
 import pandas as pd
+import numpy as np
 import rdflib
 from rdflib import Graph
 from rdflib.namespace import RDF, XSD, RDFS
-import networkx as nx
 import argparse
 import textwrap
 from pathlib import Path
@@ -12,6 +13,9 @@ from tqdm import tqdm
 p = Path(__file__).parents[2]
 os.chdir(p)
 
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from graphml_functions import read_graphml_edges
+
 """ Argument parser """
 parser = argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -50,27 +54,48 @@ for directory in tqdm(samples_dir):
     graph_metadata_path = os.path.join(path, directory, ionization_mode, 'molecular_network', directory + '_mn_metadata_' + ionization_mode + '.tsv')
     metadata_path = os.path.join(path, directory, directory + '_metadata.tsv')
     try:
-        graph = nx.read_graphml(graph_path)
+        edges = read_graphml_edges(graph_path, ['weight'])
         metadata = pd.read_csv(metadata_path, sep='\t')
         graph_metadata = pd.read_csv(graph_metadata_path, sep='\t')
     except FileNotFoundError:
         continue
     except NotADirectoryError:
         continue
-    for node in graph.edges(data=True):
-        s = node[0]
-        t = node[1]
-        cosine = node[2]['weight']
-        
-        mass_diff = abs(float(graph_metadata[graph_metadata.feature_id == int(s)]['precursor_mz'].values[0] - graph_metadata[graph_metadata.feature_id == int(t)]['precursor_mz'].values[0]))
-        component_index = graph_metadata[graph_metadata.feature_id == int(s)]['component_id'].values[0]
 
-        usi_s = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode + '.mgf:scan:' + str(s) 
+    if not len(edges['source']):
+        continue
+
+    # Index the node attributes once by feature_id (the first row of a feature_id is the one used),
+    # then look up both ends of all the edges at once
+    graph_metadata = graph_metadata.drop_duplicates('feature_id').set_index('feature_id')
+    s_pos = graph_metadata.index.get_indexer(edges['source'].astype(np.int64))
+    t_pos = graph_metadata.index.get_indexer(edges['target'].astype(np.int64))
+    # Edges with a node missing from the metadata are skipped, before their nodes are looked up
+    known = (s_pos >= 0) & (t_pos >= 0)
+    edges = {name: edges[name][known] for name in ['source', 'target', 'weight']}
+    s_pos, t_pos = s_pos[known], t_pos[known]
+    if not len(s_pos):
+        continue
+
+    precursor_mz = graph_metadata['precursor_mz'].to_numpy()
+    s_mz = precursor_mz[s_pos]
+    t_mz = precursor_mz[t_pos]
+    mass_diffs = np.abs(s_mz - t_mz).astype(float).tolist()
+    component_indices = graph_metadata['component_id'].to_numpy()[s_pos].tolist()
+    s_first = (s_mz > t_mz).tolist()
+
+    usi_prefix = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode + '.mgf:scan:'
+    ci_prefix = kg_uri + metadata.sample_id[0]+ '_fbmn_' + ionization_mode + '_componentindex_'
+
+    for s, t, cosine, mass_diff, component_index, s_is_member_1 in zip(
+            edges['source'].tolist(), edges['target'].tolist(), edges['weight'].tolist(),
+            mass_diffs, component_indices, s_first):
+        usi_s = usi_prefix + str(s)
         s_feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi_s)
-        usi_t = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode + '.mgf:scan:' + str(t) 
+        usi_t = usi_prefix + str(t)
         t_feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi_t)
         
-        ci_node = rdflib.term.URIRef(kg_uri + metadata.sample_id[0]+ '_fbmn_' + ionization_mode + '_componentindex_' + str(component_index))
+        ci_node = rdflib.term.URIRef(ci_prefix + str(component_index))
         g.add((s_feature_id, ns_kg.has_fbmn_ci, ci_node))
         g.add((t_feature_id, ns_kg.has_fbmn_ci, ci_node))
         
@@ -79,7 +104,7 @@ for directory in tqdm(samples_dir):
         g.add((link_node, ns_kg.has_cosine, rdflib.term.Literal(cosine, datatype=XSD.float)))
         g.add((link_node, ns_kg.has_mass_difference, rdflib.term.Literal(mass_diff, datatype=XSD.float)))
 
-        if graph_metadata[graph_metadata.feature_id == int(s)]['precursor_mz'].values[0] > graph_metadata[graph_metadata.feature_id == int(t)]['precursor_mz'].values[0]:
+        if s_is_member_1:
             g.add((link_node, ns_kg.has_member_1, s_feature_id))
             g.add((link_node, ns_kg.has_member_2, t_feature_id))
         else:
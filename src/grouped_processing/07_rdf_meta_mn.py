@@ -1,9 +1,9 @@
 import os
+import sys
 import pandas as pd
 import rdflib
 from rdflib import Graph
 from rdflib.namespace import RDF, RDFS, XSD
-import networkx as nx
 import argparse
 import textwrap
 from pathlib import Path
@@ -12,6 +12,9 @@ from tqdm import tqdm
 p = Path(__file__).parents[2]
 os.chdir(p)
 
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from graphml_functions import read_graphml_edges
+
 """ Argument parser """
 parser = argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -70,7 +73,7 @@ prefix = "enpkg"
 nm.bind(prefix, ns_kg)
 
 # Load data
-nx_graph = nx.read_graphml(mn_graphml_path)
+mn_edges = read_graphml_edges(mn_graphml_path, ['cosine_score', 'mass_difference'])
 
 feature_key = pd.read_csv(feature_key_path)
 dic_feature_id_to_original_feature_id = pd.Series(feature_key.original_feature_id.values, index=feature_key.feature_id).to_dict()
@@ -87,38 +90,43 @@ dic_library_id_to_ik2D = pd.Series(annotation_summary['InChIKey-Planar'].values,
 # Add consensus spectrum nodes
 # mask = cluster_id['#ClusterIdx'].duplicated(keep=False)
 # cluster_id_dup = cluster_id[mask]
-for _, row in tqdm(cluster_id.iterrows(), total=len(cluster_id)):
-    feature = rdflib.term.URIRef(kg_uri + dic_feature_id_to_original_feature_id[row['#Scan']])
-    usi = 'mzspec:MassIVE:TASK-' + job_id + '-spectra/specs_ms.mgf:scan:' + str(row['#ClusterIdx'])
+# Each spectrum gets the link-outs and component index of its cluster (the first summary row of a cluster index)
+# through one join, rows whose cluster is missing from the summary are dropped
+cluster_columns = ['cluster index', 'GNPSLinkout_Cluster', 'GNPSLinkout_Network', 'componentindex']
+consensus_spectra = cluster_id[['#Scan', '#ClusterIdx']].merge(
+    cluster_summary[cluster_columns].drop_duplicates('cluster index'),
+    left_on='#ClusterIdx', right_on='cluster index', how='inner')
+for scan, cluster_index, cluster_link, network_link, component_index in tqdm(
+        zip(*(consensus_spectra[col].tolist() for col in ['#Scan', '#ClusterIdx', 'GNPSLinkout_Cluster', 'GNPSLinkout_Network', 'componentindex'])),
+        total=len(consensus_spectra)):
+    feature = rdflib.term.URIRef(kg_uri + dic_feature_id_to_original_feature_id[scan])
+    usi = 'mzspec:MassIVE:TASK-' + job_id + '-spectra/specs_ms.mgf:scan:' + str(cluster_index)
     consensus = rdflib.term.URIRef(kg_uri + 'GNPS_consensus_spectrum_' + usi)
     link_spectrum = 'https://metabolomics-usi.ucsd.edu/dashinterface/?usi1=' + usi
     
     g.add((feature, ns_kg.has_consensus_spectrum, consensus))
-    cluster_link = cluster_summary[cluster_summary['cluster index']==row['#ClusterIdx']]['GNPSLinkout_Cluster'].values[0]
     g.add((consensus, ns_kg.gnps_spectrum_link, rdflib.term.Literal(cluster_link)))
-    network_link = cluster_summary[cluster_summary['cluster index']==row['#ClusterIdx']]['GNPSLinkout_Network'].values[0]
     g.add((consensus, ns_kg.gnps_component_link, rdflib.term.Literal(network_link)))
     g.add((consensus, ns_kg.has_usi, rdflib.term.Literal(usi)))
     g.add((consensus, ns_kg.gnps_dashboard_view, rdflib.term.Literal(link_spectrum)))
     
-    component_index = cluster_summary[cluster_summary['cluster index']==row['#ClusterIdx']]['componentindex'].values[0]
     ci_node = rdflib.term.URIRef(kg_uri + 'metamn_' + job_id + '_componentindex_' + str(component_index))
        
     g.add((consensus, ns_kg.has_metamn_ci, ci_node))
     g.add((consensus, RDF.type, ns_kg.GNPSConsensusSpectrum))
 
 # create triples for features link in MN         
-for node in nx_graph.edges(data=True):
-    if node[0] != node[1]:
-        s_ci = int(node[0])
-        t_ci = int(node[1])
+for s, t, cosine, mass_diff in zip(mn_edges['source'].tolist(), mn_edges['target'].tolist(),
+                                   mn_edges['cosine_score'].tolist(), mn_edges['mass_difference'].tolist()):
+    if s != t:
+        s_ci = int(s)
+        t_ci = int(t)
         s_usi = 'mzspec:MassIVE:TASK-' + job_id + '-spectra/specs_ms.mgf:scan:' + str(s_ci)
         s_consensus = rdflib.term.URIRef(kg_uri + 'GNPS_consensus_spectrum_' + s_usi)
         t_usi = 'mzspec:MassIVE:TASK-' + job_id + '-spectra/specs_ms.mgf:scan:' + str(t_ci)
         t_consensus = rdflib.term.URIRef(kg_uri + 'GNPS_consensus_spectrum_' + t_usi)
         
-        cosine = node[2]['cosine_score']
-        mass_diff = abs(float(node[2]['mass_difference']))
+        mass_diff = abs(mass_diff)
         
         link_node = rdflib.term.URIRef(kg_uri + 'consensus_pair_' + s_usi + '_' + t_usi)
         g.add((link_node, RDF.type, ns_kg.CSpair))
@@ -1,8 +1,11 @@
-import gzip
-import shutil
 import os
+import sys
 import argparse
 import textwrap
+from pathlib import Path
+
+sys.path.append(os.path.join(Path(__file__).parents[0], 'functions'))
+from compression_functions import compress_files, print_compression_stats, EXTENSIONS, MEMBER_SIZE, zstd_available
 
 
 """ Argument parser """
@@ -14,6 +17,8 @@ parser = argparse.ArgumentParser(
             Arguments:
             - Path to the directory where samples folders are located
             - Minimal size in Mb to compress (default = 200 Mb)
+            - Compression method, gzip or zstd (default = gzip)
+            - Number of files, and of pieces of large files, compressed in parallel (default = number of CPUs)
         '''))
 
 parser.add_argument('-p', '--sample_dir_path', required=True,
@@ -21,26 +26,41 @@ parser.add_argument('-p', '--sample_dir_path', required=True,
 
 parser.add_argument('-s', '--size', required=False, default=200,
                     help='The minimal size in Mb of the .ttl files to compress (default = 200 Mb)')
+parser.add_argument('-m', '--method', default='gzip', choices=list(EXTENSIONS),
+                    help='The compression method, zstd needs the zstandard package (default = gzip)')
+parser.add_argument('-l', '--level', type=int, default=None,
+                    help='The compression level (default = 9 for gzip, 3 for zstd)')
+parser.add_argument('-w', '--workers', type=int, default=None,
+                    help='The number of files, and of pieces of large files, compressed in parallel (default = number of CPUs)')
+parser.add_argument('--member_size', type=float, default=MEMBER_SIZE / 1024 ** 2,
+                    help=f'Large files are compressed as independent pieces of this size in Mb (default = {MEMBER_SIZE // 1024 ** 2} Mb)')
 
 args = parser.parse_args()
+if args.method == 'zstd' and not zstd_available:
+    parser.error('zstd compression needs the zstandard package (pip install zstandard)')
 sample_dir_path = os.path.normpath(args.sample_dir_path)
 size = float(args.size)
 path = os.path.join(sample_dir_path, '004_rdf')
 
-for file in os.listdir(path):
+extension = EXTENSIONS[args.method]
+jobs = []
+for file in sorted(os.listdir(path)):
+    if file.endswith(tuple(EXTENSIONS.values())) or not os.path.isfile(os.path.join(path, file)):
+        continue
     size_mo = os.path.getsize(os.path.join(path, file))/1e+6
     if size_mo >= size:
-        with open(os.path.join(path, file), 'rb') as f_in:
-            file_out = os.path.join(path, file) + '.gz'
-            if not os.path.isfile(file_out):
-                print(f'Compressing {f_in}')
-                with gzip.open(file_out, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-                print(f'{f_in} done')
-            else:
-                print(f'{file_out} already exists')
+        file_out = os.path.join(path, file) + extension
+        if not os.path.isfile(file_out):
+            print(f'Compressing {file}')
+            jobs.append((os.path.join(path, file), file_out))
+        else:
+            print(f'{file_out} already exists')
     elif size_mo < size:
         print(f'Not an heavy file ! You are OK to go.')
         continue
-        
+
+for stats in compress_files(jobs, method=args.method, level=args.level, workers=args.workers,
+                            member_size=int(args.member_size * 1024 ** 2)):
+    print_compression_stats(stats)
+
     
\ No newline at end of file
@@ -1,156 +1,170 @@
 import os
+import sys
 from pathlib import Path
 import argparse
 import textwrap
 import pandas as pd
 import rdflib
-from rdflib import Graph, Namespace
 from rdflib.namespace import RDF, RDFS, FOAF
 from tqdm import tqdm
 
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, WD, TripleWriter
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input, get_expected_input, get_metadata
+
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from samples' metadata 
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-        '''))
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from samples' metadata 
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+            '''))
 
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
 
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
 
-WD = Namespace('http://www.wikidata.org/entity/')
-enpkg_uri = "https://enpkg.commons-lab.org/kg/"
-ns_kg = rdflib.Namespace(enpkg_uri)
-prefix = "enpkg"
+    path = os.path.normpath(sample_dir_path)
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
 
-path = os.path.normpath(sample_dir_path)
-samples_dir = [directory for directory in os.listdir(path)]
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is None:
+            continue
+        #metadata_path = os.path.join(path, directory, directory + '_metadata.tsv')
+        metadata_path = get_input(sample_manifest, 'sample', 'metadata')
+        metadata_taxo_path = get_expected_input(sample_manifest, 'sample', 'taxo_metadata')
+        metadata = get_metadata(sample_manifest)
+        if metadata is None:
+            continue
 
-for directory in tqdm(samples_dir):
-    g = Graph()
-    nm = g.namespace_manager
-    nm.bind('wd', WD)
-    nm.bind(prefix, ns_kg)
-    
-    #metadata_path = os.path.join(path, directory, directory + '_metadata.tsv')
-    metadata_path = os.path.join(path, directory, 'metadata.tsv')
+        pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", 'metadata_enpkg.ttl'))
+        fingerprint = get_fingerprint(pathout, [metadata_path, metadata_taxo_path], __file__, {})
+        if not args.recompute and is_up_to_date(pathout, fingerprint):
+            print(f'{pathout} is up to date, skipping')
+            continue
 
-    try:
-        metadata = pd.read_csv(metadata_path, sep='\t')
-    except FileNotFoundError:
-        continue
-    except NotADirectoryError:
-        continue
-    sample = rdflib.term.URIRef(enpkg_uri + str(metadata.sample_id[0]))
+        g = TripleWriter(pathout)
+        sample = rdflib.term.URIRef(kg_uri + str(metadata.sample_id[0]))
 
-    if metadata.sample_type[0] == 'sample':
-        material_id = rdflib.term.URIRef(enpkg_uri + str(metadata['source_id'][0]))
-        g.add((material_id, RDF.type, ns_kg.RawMaterial))
-        g.add((material_id, ns_kg.submitted_taxon, rdflib.term.Literal(metadata['source_taxon'][0])))
-        g.add((material_id, ns_kg.has_lab_process, sample))
-        g.add((sample, RDF.type, ns_kg.LabExtract))
-        g.add((sample, RDFS.label, rdflib.term.Literal(f"Sample {metadata.sample_id[0]}")))
+        if metadata.sample_type[0] == 'sample':
+            material_id = rdflib.term.URIRef(kg_uri + str(metadata['source_id'][0]))
+            g.add((material_id, RDF.type, ns_kg.RawMaterial))
+            g.add((material_id, ns_kg.submitted_taxon, rdflib.term.Literal(metadata['source_taxon'][0])))
+            g.add((material_id, ns_kg.has_lab_process, sample))
+            g.add((sample, RDF.type, ns_kg.LabExtract))
+            g.add((sample, RDFS.label, rdflib.term.Literal(f"Sample {metadata.sample_id[0]}")))
         
-        # Add GNPS Dashborad link for pos & neg: only if sample_filename_pos column exists and is not NaN and MassIVE id is present
-        if set(['sample_filename_pos', 'massive_id']).issubset(metadata.columns):
-            if not pd.isna(metadata['sample_filename_pos'][0]):
-                sample_filename_pos = metadata['sample_filename_pos'][0]
-                massive_id = metadata['massive_id'][0]    
-                gnps_dashboard_link = f'https://gnps-lcms.ucsd.edu/?usi=mzspec:{massive_id}:{sample_filename_pos}'
-                gnps_tic_pic = f'https://gnps-lcms.ucsd.edu/mspreview?usi=mzspec:{massive_id}:{sample_filename_pos}'
-                link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
-                g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0])))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), RDF.type, ns_kg.LCMSAnalysisPos))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_gnpslcms_link, rdflib.URIRef(gnps_dashboard_link)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), FOAF.depiction, rdflib.URIRef(gnps_tic_pic))) 
+            # Add GNPS Dashborad link for pos & neg: only if sample_filename_pos column exists and is not NaN and MassIVE id is present
+            if set(['sample_filename_pos', 'massive_id']).issubset(metadata.columns):
+                if not pd.isna(metadata['sample_filename_pos'][0]):
+                    sample_filename_pos = metadata['sample_filename_pos'][0]
+                    massive_id = metadata['massive_id'][0]    
+                    gnps_dashboard_link = f'https://gnps-lcms.ucsd.edu/?usi=mzspec:{massive_id}:{sample_filename_pos}'
+                    gnps_tic_pic = f'https://gnps-lcms.ucsd.edu/mspreview?usi=mzspec:{massive_id}:{sample_filename_pos}'
+                    link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
+                    g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0])))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), RDF.type, ns_kg.LCMSAnalysisPos))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_gnpslcms_link, rdflib.URIRef(gnps_dashboard_link)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), FOAF.depiction, rdflib.URIRef(gnps_tic_pic))) 
                 
-        if set(['sample_filename_neg', 'massive_id']).issubset(metadata.columns):
-            if not pd.isna(metadata['sample_filename_neg'][0]):
-                sample_filename_neg = metadata['sample_filename_neg'][0]
-                massive_id = metadata['massive_id'][0]    
-                gnps_dashboard_link = f'https://gnps-lcms.ucsd.edu/?usi=mzspec:{massive_id}:{sample_filename_neg}'
-                gnps_tic_pic = f'https://gnps-lcms.ucsd.edu/mspreview?usi=mzspec:{massive_id}:{sample_filename_neg}'
-                link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
-                g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0])))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), RDF.type, ns_kg.LCMSAnalysisNeg))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_gnpslcms_link, rdflib.URIRef(gnps_dashboard_link)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), FOAF.depiction, rdflib.URIRef(gnps_tic_pic))) 
+            if set(['sample_filename_neg', 'massive_id']).issubset(metadata.columns):
+                if not pd.isna(metadata['sample_filename_neg'][0]):
+                    sample_filename_neg = metadata['sample_filename_neg'][0]
+                    massive_id = metadata['massive_id'][0]    
+                    gnps_dashboard_link = f'https://gnps-lcms.ucsd.edu/?usi=mzspec:{massive_id}:{sample_filename_neg}'
+                    gnps_tic_pic = f'https://gnps-lcms.ucsd.edu/mspreview?usi=mzspec:{massive_id}:{sample_filename_neg}'
+                    link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
+                    g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0])))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), RDF.type, ns_kg.LCMSAnalysisNeg))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_gnpslcms_link, rdflib.URIRef(gnps_dashboard_link)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), FOAF.depiction, rdflib.URIRef(gnps_tic_pic))) 
            
-        # Add WD taxonomy link to substance
-        metadata_taxo_path = os.path.join(path, directory, 'taxo_output', directory + '_taxo_metadata.tsv')
-        try:
-            metadata_taxo = pd.read_csv(metadata_taxo_path, sep='\t')
-            if not pd.isna(metadata_taxo['wd.value'][0]):
-                wd_id = rdflib.term.URIRef(WD + metadata_taxo['wd.value'][0][31:])
-                g.add((material_id, ns_kg.has_wd_id, wd_id))
-                g.add((wd_id, RDF.type, ns_kg.WDTaxon))
+            # Add WD taxonomy link to substance
+            if get_input(sample_manifest, 'sample', 'taxo_metadata') is not None:
+                metadata_taxo = pd.read_csv(metadata_taxo_path, sep='\t')
+                if not pd.isna(metadata_taxo['wd.value'][0]):
+                    wd_id = rdflib.term.URIRef(WD + metadata_taxo['wd.value'][0][31:])
+                    g.add((material_id, ns_kg.has_wd_id, wd_id))
+                    g.add((wd_id, RDF.type, ns_kg.WDTaxon))
+                else:
+                    g.add((material_id, ns_kg.has_unresolved_taxon, rdflib.term.URIRef(kg_uri + 'unresolved_taxon')))              
             else:
-                g.add((material_id, ns_kg.has_unresolved_taxon, rdflib.term.URIRef(enpkg_uri + 'unresolved_taxon')))              
-        except FileNotFoundError:
-            g.add((material_id, ns_kg.has_unresolved_taxon, rdflib.term.URIRef(enpkg_uri + 'unresolved_taxon')))
+                g.add((material_id, ns_kg.has_unresolved_taxon, rdflib.term.URIRef(kg_uri + 'unresolved_taxon')))
               
-    elif metadata.sample_type[0].lower() == 'blank':
-        g.add((sample, RDF.type, ns_kg.LabBlank))
-        g.add((sample, RDFS.label, rdflib.term.Literal(f"Blank {metadata.sample_id[0]}")))
+        elif metadata.sample_type[0].lower() == 'blank':
+            g.add((sample, RDF.type, ns_kg.LabBlank))
+            g.add((sample, RDFS.label, rdflib.term.Literal(f"Blank {metadata.sample_id[0]}")))
+
+            if set(['sample_filename_pos', 'massive_id']).issubset(metadata.columns):
+                if not pd.isna(metadata['sample_filename_pos'][0]):
+                    sample_filename_pos = metadata['sample_filename_pos'][0]
+                    massive_id = metadata['massive_id'][0]
+                    link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
+                    g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0])))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), RDF.type, ns_kg.LCMSAnalysisPos))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
+            if set(['sample_filename_neg', 'massive_id']).issubset(metadata.columns):
+                if not pd.isna(metadata['sample_filename_neg'][0]):
+                    sample_filename_neg = metadata['sample_filename_neg'][0]
+                    massive_id = metadata['massive_id'][0]
+                    link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
+                    g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0])))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), RDF.type, ns_kg.LCMSAnalysisNeg))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
 
-        if set(['sample_filename_pos', 'massive_id']).issubset(metadata.columns):
-            if not pd.isna(metadata['sample_filename_pos'][0]):
-                sample_filename_pos = metadata['sample_filename_pos'][0]
-                massive_id = metadata['massive_id'][0]
-                link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
-                g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0])))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), RDF.type, ns_kg.LCMSAnalysisPos))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
-        if set(['sample_filename_neg', 'massive_id']).issubset(metadata.columns):
-            if not pd.isna(metadata['sample_filename_neg'][0]):
-                sample_filename_neg = metadata['sample_filename_neg'][0]
-                massive_id = metadata['massive_id'][0]
-                link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
-                g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0])))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), RDF.type, ns_kg.LCMSAnalysisNeg))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
 
+        elif metadata.sample_type[0].lower() == 'qc':
+            g.add((sample, RDF.type, ns_kg.LabQc))
+            g.add((sample, RDFS.label, rdflib.term.Literal(f"QC {metadata.sample_id[0]}")))
+            if set(['sample_filename_pos', 'massive_id']).issubset(metadata.columns):
+                if not pd.isna(metadata['sample_filename_pos'][0]):
+                    sample_filename_pos = metadata['sample_filename_pos'][0]
+                    massive_id = metadata['massive_id'][0]
+                    link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
+                    g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0])))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), RDF.type, ns_kg.LCMSAnalysisPos))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
+            if set(['sample_filename_neg', 'massive_id']).issubset(metadata.columns):
+                if not pd.isna(metadata['sample_filename_neg'][0]):
+                    sample_filename_neg = metadata['sample_filename_neg'][0]
+                    massive_id = metadata['massive_id'][0]
+                    link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
+                    g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0])))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), RDF.type, ns_kg.LCMSAnalysisNeg))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
+                    g.add((rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
 
-    elif metadata.sample_type[0].lower() == 'qc':
-        g.add((sample, RDF.type, ns_kg.LabQc))
-        g.add((sample, RDFS.label, rdflib.term.Literal(f"QC {metadata.sample_id[0]}")))
-        if set(['sample_filename_pos', 'massive_id']).issubset(metadata.columns):
-            if not pd.isna(metadata['sample_filename_pos'][0]):
-                sample_filename_pos = metadata['sample_filename_pos'][0]
-                massive_id = metadata['massive_id'][0]
-                link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
-                g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0])))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), RDF.type, ns_kg.LCMSAnalysisPos))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_pos'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
-        if set(['sample_filename_neg', 'massive_id']).issubset(metadata.columns):
-            if not pd.isna(metadata['sample_filename_neg'][0]):
-                sample_filename_neg = metadata['sample_filename_neg'][0]
-                massive_id = metadata['massive_id'][0]
-                link_to_massive = f'https://massive.ucsd.edu/ProteoSAFe/dataset.jsp?accession={massive_id}'
-                g.add((sample, ns_kg.has_LCMS, rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0])))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), RDF.type, ns_kg.LCMSAnalysisNeg))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_doi, rdflib.URIRef(link_to_massive)))
-                g.add((rdflib.term.URIRef(enpkg_uri + metadata['sample_filename_neg'][0]), ns_kg.has_massive_license, rdflib.URIRef("https://creativecommons.org/publicdomain/zero/1.0/")))
+        g.close()
+        save_fingerprint(pathout, fingerprint)
+        print(f'Results are in : {pathout}')
 
-    pathout = os.path.join(sample_dir_path, directory, "rdf/")
-    os.makedirs(pathout, exist_ok=True)
-    pathout = os.path.normpath(os.path.join(pathout, 'metadata_enpkg.ttl'))
-    print(pathout)
-    g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-    print(f'Results are in : {pathout}')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,106 @@
 import os
+import sys
 import argparse
 import textwrap
 import pandas as pd
 import rdflib
-from rdflib import Graph, Namespace
 from rdflib.namespace import RDF, RDFS, XSD
 from pathlib import Path
 from tqdm import tqdm
 
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, module_uri, ns_module, TripleWriter
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input
+
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from samples' metadata 
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-        '''))
-
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from samples' metadata 
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+            '''))
 
-WD = Namespace('http://www.wikidata.org/entity/')
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
 
-# Create enpkg namespace
-kg_uri = "https://enpkg.commons-lab.org/kg/"
-ns_kg = rdflib.Namespace(kg_uri)
-prefix_kg = "enpkg"
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
 
-# Create enpkgmodule namespace
-module_uri = "https://enpkg.commons-lab.org/module/"
-ns_module = rdflib.Namespace(module_uri)
-prefix_module = "enpkgmodule"
+    target_chembl_url = 'https://www.ebi.ac.uk/chembl/target_report_card/'
 
-target_chembl_url = 'https://www.ebi.ac.uk/chembl/target_report_card/'
+    path = os.path.normpath(sample_dir_path)
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
 
-path = os.path.normpath(sample_dir_path)
-samples_dir = [directory for directory in os.listdir(path)]
 
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is None:
+            continue
+        metadata_path = get_input(sample_manifest, 'sample', 'sample_metadata')
+        if metadata_path is None:
+            continue
 
-for directory in tqdm(samples_dir):
-    g = Graph()
-    nm = g.namespace_manager
-    nm.bind('wd', WD)
-    nm.bind(prefix_kg, ns_kg)
-    nm.bind(prefix_module, ns_module)
+        pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", 'metadata_module_enpkg.ttl'))
+        fingerprint = get_fingerprint(pathout, [metadata_path], __file__, {})
+        if not args.recompute and is_up_to_date(pathout, fingerprint):
+            print(f'{pathout} is up to date, skipping')
+            continue
 
-    metadata_path = os.path.join(path, directory, directory + '_metadata.tsv')
-    try:
         metadata = pd.read_csv(metadata_path, sep='\t')
-    except FileNotFoundError:
-        continue
-    except NotADirectoryError:
-        continue
-        
-    sample = rdflib.term.URIRef(kg_uri + metadata.sample_id[0])
+        g = TripleWriter(pathout)
+        sample = rdflib.term.URIRef(kg_uri + metadata.sample_id[0])
     
-    if metadata.sample_type[0] == 'sample':
-        material_id = rdflib.term.URIRef(kg_uri + metadata.sample_substance_name[0])
-        plant_parts = metadata[['organism_organe', 'organism_broad_organe', 'organism_tissue', 'organism_subsystem']].copy()
-        plant_parts.fillna('unkown', inplace=True)
-        plant_parts.replace(' ', '_', regex=True, inplace=True)
+        if metadata.sample_type[0] == 'sample':
+            material_id = rdflib.term.URIRef(kg_uri + metadata.sample_substance_name[0])
+            plant_parts = metadata[['organism_organe', 'organism_broad_organe', 'organism_tissue', 'organism_subsystem']].copy()
+            plant_parts.fillna('unkown', inplace=True)
+            plant_parts.replace(' ', '_', regex=True, inplace=True)
         
-        g.add((material_id, ns_module.has_organe, rdflib.term.URIRef(module_uri + plant_parts['organism_organe'][0])))
-        g.add((material_id, ns_module.has_broad_organe, rdflib.term.URIRef(module_uri + plant_parts['organism_broad_organe'][0])))
-        g.add((material_id, ns_module.has_tissue, rdflib.term.URIRef(module_uri + plant_parts['organism_tissue'][0])))
-        g.add((material_id, ns_module.has_subsystem, rdflib.term.URIRef(module_uri + plant_parts['organism_subsystem'][0])))
+            g.add((material_id, ns_module.has_organe, rdflib.term.URIRef(module_uri + plant_parts['organism_organe'][0])))
+            g.add((material_id, ns_module.has_broad_organe, rdflib.term.URIRef(module_uri + plant_parts['organism_broad_organe'][0])))
+            g.add((material_id, ns_module.has_tissue, rdflib.term.URIRef(module_uri + plant_parts['organism_tissue'][0])))
+            g.add((material_id, ns_module.has_subsystem, rdflib.term.URIRef(module_uri + plant_parts['organism_subsystem'][0])))
                 
         
-        for assay_id, target, chembl_id, rdfclass in zip(
-            ['bio_leish_donovani_10ugml_inhibition', 'bio_leish_donovani_2ugml_inhibition', 'bio_tryp_brucei_rhodesiense_10ugml_inhibition', \
-            'bio_tryp_brucei_rhodesiense_2ugml_inhibition', 'bio_tryp_cruzi_10ugml_inhibition', 'bio_l6_cytotoxicity_10ugml_inhibition'], 
-            ['Ldonovani_10ugml', 'Ldonovani_2ugml', 'Tbruceirhod_10ugml', 'Tbruceirhod_2ugml', 'Tcruzi_10ugml', 'L6_10ugml'],
-            ['CHEMBL367', 'CHEMBL367', 'CHEMBL612348', 'CHEMBL612348', 'CHEMBL368', None],
-            [ns_module.Ldono10ugml, ns_module.Ldono2ugml, ns_module.Tbrucei10ugml, ns_module.Tbrucei2ugml, ns_module.Tcruzi10ugml, ns_module.L610ugml]):    
+            for assay_id, target, chembl_id, rdfclass in zip(
+                ['bio_leish_donovani_10ugml_inhibition', 'bio_leish_donovani_2ugml_inhibition', 'bio_tryp_brucei_rhodesiense_10ugml_inhibition', \
+                'bio_tryp_brucei_rhodesiense_2ugml_inhibition', 'bio_tryp_cruzi_10ugml_inhibition', 'bio_l6_cytotoxicity_10ugml_inhibition'], 
+                ['Ldonovani_10ugml', 'Ldonovani_2ugml', 'Tbruceirhod_10ugml', 'Tbruceirhod_2ugml', 'Tcruzi_10ugml', 'L6_10ugml'],
+                ['CHEMBL367', 'CHEMBL367', 'CHEMBL612348', 'CHEMBL612348', 'CHEMBL368', None],
+                [ns_module.Ldono10ugml, ns_module.Ldono2ugml, ns_module.Tbrucei10ugml, ns_module.Tbrucei2ugml, ns_module.Tcruzi10ugml, ns_module.L610ugml]):    
                    
-                assay = rdflib.term.URIRef(module_uri + metadata.sample_id[0] + "_" + target)
-                type = rdflib.term.URIRef(module_uri + target)
-                g.add((sample, ns_module.has_bioassay_results, assay))
-                g.add((assay, RDFS.label, rdflib.term.Literal(f"{target} assay of {metadata.sample_id[0]}")))
-                g.add((assay, ns_module.inhibition_percentage, rdflib.term.Literal(metadata[assay_id][0], datatype=XSD.float)))
-                g.add((assay, RDF.type, rdfclass))
-                if chembl_id is not None:
-                    target_id_uri = rdflib.term.URIRef(target_chembl_url + chembl_id)
-                    g.add((assay, ns_module.target_id, target_id_uri))
-                    g.add((target_id_uri, RDF.type, ns_module.ChEMBLTarget))
+                    assay = rdflib.term.URIRef(module_uri + metadata.sample_id[0] + "_" + target)
+                    type = rdflib.term.URIRef(module_uri + target)
+                    g.add((sample, ns_module.has_bioassay_results, assay))
+                    g.add((assay, RDFS.label, rdflib.term.Literal(f"{target} assay of {metadata.sample_id[0]}")))
+                    g.add((assay, ns_module.inhibition_percentage, rdflib.term.Literal(metadata[assay_id][0], datatype=XSD.float)))
+                    g.add((assay, RDF.type, rdfclass))
+                    if chembl_id is not None:
+                        target_id_uri = rdflib.term.URIRef(target_chembl_url + chembl_id)
+                        g.add((assay, ns_module.target_id, target_id_uri))
+                        g.add((target_id_uri, RDF.type, ns_module.ChEMBLTarget))
 
-    pathout = os.path.join(sample_dir_path, directory, "rdf/")
-    os.makedirs(pathout, exist_ok=True)
-    pathout = os.path.normpath(os.path.join(pathout, 'metadata_module_enpkg.ttl'))
-    g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-    print(f'Results are in : {pathout}')          
-        
+        g.close()
+        save_fingerprint(pathout, fingerprint)
+        print(f'Results are in : {pathout}')
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 import os
+import sys
 import argparse
 import textwrap
 import pandas as pd
 import rdflib
-from rdflib import Graph
 from rdflib.namespace import RDF, RDFS, XSD, FOAF
 from tqdm import tqdm
 
@@ -11,93 +11,107 @@ from pathlib import Path
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from samples' individual features files 
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-            - Ionization mode to process
-        '''))
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, TripleWriter, nt_uris, nt_literals
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input, get_metadata
+from sirius_functions import get_polarity_input
 
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-ion', '--ionization_mode', required=True,
-                    help='The ionization mode to process')
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from samples' individual features files 
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - Ionization mode to process
+            '''))
 
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
-ionization_mode = args.ionization_mode
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-ion', '--ionization_mode', required=True,
+                        help='The ionization mode to process')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
 
-g = Graph()
-nm = g.namespace_manager
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    ionization_mode = args.ionization_mode
 
-kg_uri = "https://enpkg.commons-lab.org/kg/"
-ns_kg = rdflib.Namespace(kg_uri)
-prefix = "enpkg"
-
-path = os.path.normpath(sample_dir_path)
-samples_dir = [directory for directory in os.listdir(path) if not directory.startswith('.DS_Store')]
-for directory in tqdm(samples_dir):
+    path = os.path.normpath(sample_dir_path)
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is None:
+            continue
         
-    quant_path = os.path.join(path, directory, ionization_mode, directory + '-feature_table.csv')
-    #quant_path = os.path.join(path, directory, ionization_mode, directory + '_features_quant_' + ionization_mode + '.csv')  # this is to accomodate to the SINERGIA preprocessing
-    metadata_path = os.path.join(path, directory, 'metadata.tsv')
+        quant_path = get_polarity_input(sample_manifest, ionization_mode, 'feature_table')
+        #quant_path = os.path.join(path, directory, ionization_mode, directory + '_features_quant_' + ionization_mode + '.csv')  # this is to accomodate to the SINERGIA preprocessing
+        metadata_path = get_input(sample_manifest, 'sample', 'metadata')
+        if quant_path is None or metadata_path is None:
+            continue
+
+        pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", f'features_{ionization_mode}.ttl'))
+        fingerprint = get_fingerprint(pathout, [quant_path, metadata_path], __file__, {'ionization_mode': ionization_mode})
+        if not args.recompute and is_up_to_date(pathout, fingerprint):
+            print(f'{pathout} is up to date, skipping')
+            continue
 
-    try:
         quant_table = pd.read_csv(quant_path, sep=',')
-        metadata = pd.read_csv(metadata_path, sep='\t')
-    except FileNotFoundError:
-        continue
-    except NotADirectoryError:
-        continue
+        metadata = get_metadata(sample_manifest)
     
-    if metadata.sample_type[0] == 'sample':
-        g = Graph()
-        nm = g.namespace_manager
-        nm.bind(prefix, ns_kg)
+        if metadata.sample_type[0] == 'sample':
+            g = TripleWriter(pathout)
 
-        sample = rdflib.term.URIRef(kg_uri + str(metadata.sample_id[0]))
-        area_col = [col for col in quant_table.columns if col.endswith(' Peak area')][0]
-        max_area = quant_table[area_col].max()
+            sample = rdflib.term.URIRef(kg_uri + str(metadata.sample_id[0]))
+            area_col = [col for col in quant_table.columns if col.endswith(' Peak area')][0]
+            max_area = quant_table[area_col].max()
             
-        # Add feature list object to samples
-        feature_list = rdflib.term.URIRef(kg_uri + str(metadata.sample_id[0]) + "_lcms_feature_list_" + ionization_mode)
+            # Add feature list object to samples
+            feature_list = rdflib.term.URIRef(kg_uri + str(metadata.sample_id[0]) + "_lcms_feature_list_" + ionization_mode)
 
-        if ionization_mode == 'pos':
-            lc_ms = rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0])
-        elif ionization_mode == 'neg':
-            lc_ms = rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0])
+            if ionization_mode == 'pos':
+                lc_ms = rdflib.term.URIRef(kg_uri + metadata['sample_filename_pos'][0])
+            elif ionization_mode == 'neg':
+                lc_ms = rdflib.term.URIRef(kg_uri + metadata['sample_filename_neg'][0])
         
-        g.add((lc_ms, ns_kg.has_lcms_feature_list, feature_list))
+            g.add((lc_ms, ns_kg.has_lcms_feature_list, feature_list))
 
-        g.add((feature_list, RDF.type, ns_kg.LCMSFeatureList))
-        g.add((feature_list, ns_kg.has_ionization, rdflib.term.Literal(ionization_mode)))
-        g.add((feature_list, RDFS.comment, rdflib.term.Literal(f"LCMS feature list in {ionization_mode} ionization mode of {str(metadata.sample_id[0])}")))
-        # Add feature and their metadat to feature list
-        for _, row in quant_table.iterrows():
-            usi = 'mzspec:' + metadata['massive_id'][0] + ':' + str(metadata.sample_id[0]) + '_features_ms2_'+ ionization_mode+ '.mgf:scan:' + str(int(row['row ID']))
-            feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi)
-            g.add((feature_list, ns_kg.has_lcms_feature, feature_id))
-            g.add((feature_id, RDF.type, ns_kg.LCMSFeature))
-            g.add((feature_id, RDFS.label, rdflib.term.Literal(f"lcms_feature {usi}")))
-            g.add((feature_id, ns_kg.has_ionization, rdflib.term.Literal(ionization_mode)))
-            g.add((feature_id, ns_kg.has_row_id, rdflib.term.Literal(row['row ID'], datatype=XSD.integer)))
-            g.add((feature_id, ns_kg.has_parent_mass, rdflib.term.Literal(row['row m/z'], datatype=XSD.float)))
-            g.add((feature_id, ns_kg.has_retention_time, rdflib.term.Literal(row['row retention time'], datatype=XSD.float)))
-            g.add((feature_id, ns_kg.has_feature_area, rdflib.term.Literal(row[area_col], datatype=XSD.float)))
-            g.add((feature_id, ns_kg.has_relative_feature_area, rdflib.term.Literal(row[area_col]/max_area, datatype=XSD.float)))
-            
-            g.add((feature_id, ns_kg.has_usi, rdflib.term.Literal(usi)))
-            link_spectrum = 'https://metabolomics-usi.ucsd.edu/dashinterface/?usi1=' + usi
-            g.add((feature_id, ns_kg.gnps_dashboard_view, rdflib.URIRef(link_spectrum)))
-            link_png = 'https://metabolomics-usi.ucsd.edu/png/?usi1=' + usi
-            g.add((feature_id, FOAF.depiction, rdflib.URIRef(link_png))) 
-            
-        pathout = os.path.join(sample_dir_path, directory, "rdf/")
-        os.makedirs(pathout, exist_ok=True)
-        pathout = os.path.normpath(os.path.join(pathout, f'features_{ionization_mode}.ttl'))
-        g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-        print(f'Results are in : {pathout}')
\ No newline at end of file
+            g.add((feature_list, RDF.type, ns_kg.LCMSFeatureList))
+            g.add((feature_list, ns_kg.has_ionization, rdflib.term.Literal(ionization_mode)))
+            g.add((feature_list, RDFS.comment, rdflib.term.Literal(f"LCMS feature list in {ionization_mode} ionization mode of {str(metadata.sample_id[0])}")))
+            # Add feature and their metadat to feature list, built column by column
+            row_id = quant_table['row ID'].astype(int).astype(str)
+            usi = 'mzspec:' + metadata['massive_id'][0] + ':' + str(metadata.sample_id[0]) + '_features_ms2_'+ ionization_mode+ '.mgf:scan:' + row_id
+            feature_id = nt_uris(kg_uri + 'lcms_feature_' + usi)
+            g.add_columns(feature_list, ns_kg.has_lcms_feature, feature_id)
+            g.add_columns(feature_id, RDF.type, ns_kg.LCMSFeature)
+            g.add_columns(feature_id, RDFS.label, nt_literals('lcms_feature ' + usi))
+            g.add_columns(feature_id, ns_kg.has_ionization, rdflib.term.Literal(ionization_mode))
+            g.add_columns(feature_id, ns_kg.has_row_id, nt_literals(row_id, XSD.integer))
+            g.add_columns(feature_id, ns_kg.has_parent_mass, nt_literals(quant_table['row m/z'], XSD.float))
+            g.add_columns(feature_id, ns_kg.has_retention_time, nt_literals(quant_table['row retention time'], XSD.float))
+            g.add_columns(feature_id, ns_kg.has_feature_area, nt_literals(quant_table[area_col], XSD.float))
+            g.add_columns(feature_id, ns_kg.has_relative_feature_area, nt_literals(quant_table[area_col]/max_area, XSD.float))
+
+            g.add_columns(feature_id, ns_kg.has_usi, nt_literals(usi))
+            g.add_columns(feature_id, ns_kg.gnps_dashboard_view, nt_uris('https://metabolomics-usi.ucsd.edu/dashinterface/?usi1=' + usi))
+            g.add_columns(feature_id, FOAF.depiction, nt_uris('https://metabolomics-usi.ucsd.edu/png/?usi1=' + usi))
+
+            g.close()
+            save_fingerprint(pathout, fingerprint)
+            print(f'Results are in : {pathout}')
+
+if __name__ == "__main__":
+    main()
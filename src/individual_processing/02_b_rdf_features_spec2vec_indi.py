@@ -1,9 +1,9 @@
 import os
+import sys
 import argparse
 import textwrap
 import pandas as pd
 import rdflib
-from rdflib import Graph
 from rdflib.namespace import RDF, RDFS, XSD, FOAF
 from tqdm import tqdm
 from matchms.importing import load_from_mgf
@@ -17,26 +17,11 @@ from spec2vec import SpectrumDocument
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from the features' MS/MS spectra using spec2vec
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-            - Ionization mode to process
-        '''))
-
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-ion', '--ionization_mode', required=True,
-                    help='The ionization mode to process')
-
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
-ionization_mode = args.ionization_mode
-
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, TripleWriter
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input
 
 # Define function
 def load_and_filter_from_mgf(path) -> list:
@@ -54,62 +39,89 @@ def load_and_filter_from_mgf(path) -> list:
 
     spectra_list = [apply_filters(s) for s in load_from_mgf(path)]
     spectra_list = [s for s in spectra_list if s is not None]
-    return spectra_list 
+    return spectra_list
 
-path = os.path.normpath(sample_dir_path)
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from the features' MS/MS spectra using spec2vec
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - Ionization mode to process
+            '''))
 
-kg_uri = "https://enpkg.commons-lab.org/kg/"
-ns_kg = rdflib.Namespace(kg_uri)
-prefix = "enpkg"
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-ion', '--ionization_mode', required=True,
+                        help='The ionization mode to process')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
 
-i=1
-samples_dir = [directory for directory in os.listdir(path)]
-for directory in tqdm(samples_dir):
-    
-    #ignoring .DS_store and hidden folders
-    if not directory.startswith('.') :
-        
-        mgf_path = os.path.join(path, directory, ionization_mode, directory + '_features_ms2_' + ionization_mode + '.mgf')
-        metadata_path = os.path.join(path, directory, directory + '_metadata.tsv')
-        try:
-            metadata = pd.read_csv(metadata_path, sep='\t')
-            os.path.isfile(mgf_path)
-        except FileNotFoundError:
-            continue
-        except NotADirectoryError:
-            continue
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    ionization_mode = args.ionization_mode
+
+    path = os.path.normpath(sample_dir_path)
 
-        if metadata.sample_type[0] == 'sample':
-            g = Graph()
-            nm = g.namespace_manager
-            nm.bind(prefix, ns_kg)
+    # The manifest leaves out .DS_store and hidden folders
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is not None:
 
-            spectra_list = load_and_filter_from_mgf(mgf_path)
-            reference_documents = [SpectrumDocument(s, n_decimals=2) for s in spectra_list]
-            list_peaks_losses = list(doc.words for doc in reference_documents)
-            sample = rdflib.term.URIRef(kg_uri + metadata.sample_id[0])
-            for spectrum, document in zip(spectra_list, list_peaks_losses):
-                usi = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode+ '.mgf:scan:' + str(int(spectrum.metadata['feature_id']))
-                feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi)
-                document_id = rdflib.term.URIRef(kg_uri + 'spec2vec_doc_' + usi)
+            mgf_path = get_input(sample_manifest, ionization_mode, 'features_mgf')
+            metadata_path = get_input(sample_manifest, 'sample', 'sample_metadata')
+            if mgf_path is None or metadata_path is None:
+                continue
+
+            pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", f'features_spec2vec_{ionization_mode}.ttl'))
+            fingerprint = get_fingerprint(pathout, [mgf_path, metadata_path], __file__, {'ionization_mode': ionization_mode})
+            if not args.recompute and is_up_to_date(pathout, fingerprint):
+                print(f'{pathout} is up to date, skipping')
+                continue
+
+            metadata = pd.read_csv(metadata_path, sep='\t')
+            if metadata.sample_type[0] == 'sample':
+                g = TripleWriter(pathout)
+
+                spectra_list = load_and_filter_from_mgf(mgf_path)
+                reference_documents = [SpectrumDocument(s, n_decimals=2) for s in spectra_list]
+                list_peaks_losses = list(doc.words for doc in reference_documents)
+                sample = rdflib.term.URIRef(kg_uri + metadata.sample_id[0])
+                for spectrum, document in zip(spectra_list, list_peaks_losses):
+                    usi = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode+ '.mgf:scan:' + str(int(spectrum.metadata['feature_id']))
+                    feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi)
+                    document_id = rdflib.term.URIRef(kg_uri + 'spec2vec_doc_' + usi)
                 
-                g.add((feature_id, ns_kg.has_spec2vec_doc, document_id))
-                g.add((document_id, RDF.type, ns_kg.Spec2VecDoc))
-                g.add((document_id, RDFS.label, rdflib.term.Literal(f"Spec2vec document {usi}")))
+                    g.add((feature_id, ns_kg.has_spec2vec_doc, document_id))
+                    g.add((document_id, RDF.type, ns_kg.Spec2VecDoc))
+                    g.add((document_id, RDFS.label, rdflib.term.Literal(f"Spec2vec document {usi}")))
                 
-                for word in document:
-                    word = word.replace('@', '_')
-                    if word.startswith('peak'):
-                        peak = rdflib.term.URIRef(kg_uri + word)
-                        g.add((document_id, ns_kg.has_spec2vec_peak, peak))
-                        g.add((peak, RDF.type, ns_kg.Spec2VecPeak))
-                    elif word.startswith('loss'):
-                        loss = rdflib.term.URIRef(kg_uri + word)
-                        g.add((document_id, ns_kg.has_spec2vec_loss, loss))
-                        g.add((loss, RDF.type, ns_kg.Spec2VecLoss))
+                    for word in document:
+                        word = word.replace('@', '_')
+                        if word.startswith('peak'):
+                            peak = rdflib.term.URIRef(kg_uri + word)
+                            g.add((document_id, ns_kg.has_spec2vec_peak, peak))
+                            g.add((peak, RDF.type, ns_kg.Spec2VecPeak))
+                        elif word.startswith('loss'):
+                            loss = rdflib.term.URIRef(kg_uri + word)
+                            g.add((document_id, ns_kg.has_spec2vec_loss, loss))
+                            g.add((loss, RDF.type, ns_kg.Spec2VecLoss))
         
-            pathout = os.path.join(sample_dir_path, directory, "rdf/")
-            os.makedirs(pathout, exist_ok=True)
-            pathout = os.path.normpath(os.path.join(pathout, f'features_spec2vec_{ionization_mode}.ttl'))
-            g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-            print(f'Results are in : {pathout}')
\ No newline at end of file
+                g.close()
+                save_fingerprint(pathout, fingerprint)
+                print(f'Results are in : {pathout}')
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,9 @@
 import os
+import sys
 import pandas as pd
 import argparse
 import textwrap
 import rdflib
-import json
-from rdflib import Graph
 from rdflib.namespace import RDF, RDFS, XSD
 from tqdm import tqdm
 
@@ -16,81 +15,98 @@ from pathlib import Path
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from samples' individual ISDB annotations 
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-            - Ionization mode to process
-        '''))
-
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-ion', '--ionization_mode', required=True,
-                    help='The ionization mode to process')
-
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
-ionization_mode = args.ionization_mode
-
-
-
-with open(os.path.normpath('data/adducts_formatter.json')) as json_file:
-    adducts_dic = json.load(json_file)
-
-path = os.path.normpath(sample_dir_path)
-samples_dir = [directory for directory in os.listdir(path)]
-df_list = []
-for directory in tqdm(samples_dir):
-    
-    g = Graph()
-    nm = g.namespace_manager
-
-    # Create jlw namespace
-    kg_uri = "https://enpkg.commons-lab.org/kg/"
-    ns_kg = rdflib.Namespace(kg_uri)
-    prefix = "enpkg"
-    nm.bind(prefix, ns_kg)
-
-    isdb_path = os.path.join(path, directory, ionization_mode, 'isdb', directory + '_isdb_reweighted_flat_' + ionization_mode + '.tsv')
-    metadata_path = os.path.join(path, directory, directory + '_metadata.tsv')
-    try:
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, load_adducts_dic, TripleWriter
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input
+from sirius_functions import get_polarity_input
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from samples' individual ISDB annotations 
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - Ionization mode to process
+            '''))
+
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-ion', '--ionization_mode', required=True,
+                        help='The ionization mode to process')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    ionization_mode = args.ionization_mode
+
+
+
+    adducts_dic = load_adducts_dic()
+
+    path = os.path.normpath(sample_dir_path)
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is None:
+            continue
+
+        isdb_path = get_polarity_input(sample_manifest, ionization_mode, 'isdb')
+        metadata_path = get_input(sample_manifest, 'sample', 'sample_metadata')
+        if isdb_path is None or metadata_path is None:
+            continue
+
+        pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", f'isdb_{ionization_mode}.ttl'))
+        fingerprint = get_fingerprint(pathout, [isdb_path, metadata_path], __file__, {'ionization_mode': ionization_mode})
+        if not args.recompute and is_up_to_date(pathout, fingerprint):
+            print(f'{pathout} is up to date, skipping')
+            continue
+
         isdb_annotations = pd.read_csv(isdb_path, sep='\t')
         metadata = pd.read_csv(metadata_path, sep='\t')
         isdb_annotations.adduct.fillna('[M+H]+', inplace=True)
         isdb_annotations.replace({"adduct": adducts_dic},inplace=True)
-    except FileNotFoundError:
-        continue
-    except NotADirectoryError:
-        continue
-    feature_count = []
-    for _, row in isdb_annotations.iterrows():
-        feature_count.append(row['feature_id'])
-        count = feature_count.count(row['feature_id'])
-        #feature_id = rdflib.term.URIRef(kg_uri + metadata.sample_id[0] + "_feature_" + str(row['feature_id']) + '_' + ionization_mode)
-        InChIkey2D = rdflib.term.URIRef(kg_uri + row['short_inchikey'])
-        #isdb_annotation_id = rdflib.term.URIRef(kg_uri + metadata.sample_id[0] + "_isdb_annotation_" + str(row['feature_id']) + '_' + ionization_mode + '_' + str(count))
+
+        g = TripleWriter(pathout)
+        feature_count = []
+        for _, row in isdb_annotations.iterrows():
+            feature_count.append(row['feature_id'])
+            count = feature_count.count(row['feature_id'])
+            #feature_id = rdflib.term.URIRef(kg_uri + metadata.sample_id[0] + "_feature_" + str(row['feature_id']) + '_' + ionization_mode)
+            InChIkey2D = rdflib.term.URIRef(kg_uri + row['short_inchikey'])
+            #isdb_annotation_id = rdflib.term.URIRef(kg_uri + metadata.sample_id[0] + "_isdb_annotation_" + str(row['feature_id']) + '_' + ionization_mode + '_' + str(count))
         
-        usi = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode+ '.mgf:scan:' + str(row['feature_id']) 
-        feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi)        
-        isdb_annotation_id = rdflib.term.URIRef(kg_uri + "isdb_" + usi)
+            usi = 'mzspec:' + metadata['massive_id'][0] + ':' + metadata.sample_id[0] + '_features_ms2_'+ ionization_mode+ '.mgf:scan:' + str(row['feature_id']) 
+            feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi)        
+            isdb_annotation_id = rdflib.term.URIRef(kg_uri + "isdb_" + usi)
         
-        g.add((feature_id, ns_kg.has_isdb_annotation, isdb_annotation_id))
-        g.add((isdb_annotation_id, RDFS.label, rdflib.term.Literal(f"isdb annotation of {usi}")))
-        g.add((isdb_annotation_id, ns_kg.has_InChIkey2D, InChIkey2D))
-        g.add((isdb_annotation_id, ns_kg.has_spectral_score, rdflib.term.Literal(row['score_input'], datatype=XSD.float)))
-        g.add((isdb_annotation_id, ns_kg.has_taxo_score, rdflib.term.Literal(row['score_taxo'], datatype=XSD.float)))
-        g.add((isdb_annotation_id, ns_kg.has_consistency_score, rdflib.term.Literal(row['score_max_consistency'], datatype=XSD.float)))
-        g.add((isdb_annotation_id, ns_kg.has_final_score, rdflib.term.Literal(row['final_score'], datatype=XSD.float)))        
-        g.add((isdb_annotation_id, ns_kg.has_adduct, rdflib.term.Literal(row['adduct'])))
-        g.add((InChIkey2D, RDF.type, ns_kg.InChIkey2D))
-        g.add((isdb_annotation_id, RDF.type, ns_kg.IsdbAnnotation))
+            g.add((feature_id, ns_kg.has_isdb_annotation, isdb_annotation_id))
+            g.add((isdb_annotation_id, RDFS.label, rdflib.term.Literal(f"isdb annotation of {usi}")))
+            g.add((isdb_annotation_id, ns_kg.has_InChIkey2D, InChIkey2D))
+            g.add((isdb_annotation_id, ns_kg.has_spectral_score, rdflib.term.Literal(row['score_input'], datatype=XSD.float)))
+            g.add((isdb_annotation_id, ns_kg.has_taxo_score, rdflib.term.Literal(row['score_taxo'], datatype=XSD.float)))
+            g.add((isdb_annotation_id, ns_kg.has_consistency_score, rdflib.term.Literal(row['score_max_consistency'], datatype=XSD.float)))
+            g.add((isdb_annotation_id, ns_kg.has_final_score, rdflib.term.Literal(row['final_score'], datatype=XSD.float)))        
+            g.add((isdb_annotation_id, ns_kg.has_adduct, rdflib.term.Literal(row['adduct'])))
+            g.add((InChIkey2D, RDF.type, ns_kg.InChIkey2D))
+            g.add((isdb_annotation_id, RDF.type, ns_kg.IsdbAnnotation))
                  
-    pathout = os.path.join(sample_dir_path, directory, "rdf/")
-    os.makedirs(pathout, exist_ok=True)
-    pathout = os.path.normpath(os.path.join(pathout, f'isdb_{ionization_mode}.ttl'))
-    g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-    print(f'Results are in : {pathout}')     
+        g.close()
+        save_fingerprint(pathout, fingerprint)
+        print(f'Results are in : {pathout}')
+
+if __name__ == "__main__":
+    main()
@@ -1,279 +1,224 @@
 import os
+import sys
 import pandas as pd
 import argparse
 import textwrap
 import rdflib
-import json
-from rdflib import Graph
 from rdflib.namespace import RDF, RDFS, XSD
 from tqdm import tqdm
 from pathlib import Path
-import shutil
 import numpy as np
-import warnings
 
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from samples' individual ISDB annotations 
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-            - Ionization mode to process
-            - The maximum number of tima-r annotation to consider
-        '''))
-
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-ion', '--ionization_mode', required=True,
-                    choices=['pos', 'neg', 'auto'],
-                    help='The ionization mode to process')
-parser.add_argument('-topn', '--max_topn', required=False, type=int, default=5,
-                    help='The maximum number of tima-r annotation to consider')
-
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
-ionization_mode = args.ionization_mode
-max_top_n = args.max_topn
-
-with open(os.path.normpath('data/adducts_formatter.json')) as json_file:
-    adducts_dic = json.load(json_file)
-
-path = os.path.normpath(sample_dir_path)
-samples_dir = [directory for directory in os.listdir(path)
-               if os.path.isdir(os.path.join(path, directory))]
-
-df_list = []
-
-samples_dir = [os.path.join(sample_dir) 
-               for sample_dir in os.listdir(path)
-               if os.path.isdir(os.path.join(path, sample_dir))]
-
-def find_tima_r_files(root_folder, current_directory, ionization_mode):
-    root_path = Path(root_folder)
-    current_dir_path = root_path / current_directory
-    pattern = f'{ionization_mode}/tima/data/processed/*tima_annotations.tsv'
-
-    tima_r_paths = [str(file_path) for file_path in current_dir_path.rglob(pattern)]
-
-    if not tima_r_paths:
-        warnings.warn(f"No '*tima_annotations.tsv' files were found in '{current_directory}/{ionization_mode}/tima/data/processed/' subfolders.")
-        
-    return tima_r_paths
-
-for directory in tqdm(samples_dir):
-    if directory != ".DS_Store":
-        # Your processing logic here
-
-        g = Graph()
-        nm = g.namespace_manager
-
-        kg_uri = "https://enpkg.commons-lab.org/kg/"
-        ns_kg = rdflib.Namespace(kg_uri)
-        prefix = "enpkg"
-        nm.bind(prefix, ns_kg)
-
-        # Example usage: This will return a list of all 'tima-r_annotations.tsv' file paths in the sub-folders of '../tima-r_RESULTS'.
-        tima_r_file_paths = find_tima_r_files(sample_dir_path, directory, ionization_mode)
-
-        # Check if the list of file paths is empty
-        if not tima_r_file_paths:
-            print(f"No TIMA annotation files found for {directory} in {ionization_mode} mode.")
-            # Optionally, continue to the next directory or perform other actions
-            continue  # Skip the current iteration if no files are found
-
-        metadata_path = os.path.join(sample_dir_path, directory, 'metadata.tsv')
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, load_adducts_dic, TripleWriter, nt_uris, nt_literals
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input, get_metadata
+from sirius_functions import get_polarity_input
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from samples' individual ISDB annotations 
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - Ionization mode to process
+                - The maximum number of tima-r annotation to consider
+            '''))
+
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-ion', '--ionization_mode', required=True,
+                        choices=['pos', 'neg', 'auto'],
+                        help='The ionization mode to process')
+    parser.add_argument('-topn', '--max_topn', required=False, type=int, default=5,
+                        help='The maximum number of tima-r annotation to consider')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    ionization_mode = args.ionization_mode
+    max_top_n = args.max_topn
+
+    adducts_dic = load_adducts_dic()
+
+    path = os.path.normpath(sample_dir_path)
+    df_list = []
+
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
+
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is not None:
+            # The tima-r annotations are looked for in <ionization_mode>/tima/data/processed/ by the manifest
+            tima_r_path = get_polarity_input(sample_manifest, ionization_mode, 'tima')
+
+            # Skip the sample if it has no annotation file
+            if tima_r_path is None:
+                print(f"No TIMA annotation files found for {directory} in {ionization_mode} mode.")
+                continue
+
+            metadata_path = get_input(sample_manifest, 'sample', 'metadata')
+            if metadata_path is None:
+                print(f"The metadata file of '{directory}' was not found.")
+                continue
+
+            pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", f'tima-r_{ionization_mode}.ttl'))
+            fingerprint = get_fingerprint(pathout, [tima_r_path, metadata_path], __file__,
+                                          {'ionization_mode': ionization_mode, 'max_topn': max_top_n})
+            if not args.recompute and is_up_to_date(pathout, fingerprint):
+                print(f'{pathout} is up to date, skipping')
+                continue
         
-        try:
-            timar_annotations = pd.read_csv(tima_r_file_paths[0], sep='\t')
-            def select_top_n_annotations(group):
-                return group.sort_values(by=['rank_final'], ascending=True).head(max_top_n)
-
-            # Group by 'feature_id', apply the function, and concatenate the results
-            timar_annotations = timar_annotations.groupby('feature_id', group_keys=False).apply(select_top_n_annotations)
-
-            # Reset the index of the resulting DataFrame
-            timar_annotations.reset_index(drop=True, inplace=True)
-
-            metadata = pd.read_csv(metadata_path, sep='\t')
-        except FileNotFoundError:
-            raise
-        except NotADirectoryError:
-            raise
-
-        # Define all the column names directly without suffixes
-        feature_col = 'feature_id'
-        structure_col = 'candidate_structure_inchikey_no_stereo'
-        structure_smiles_col = 'candidate_structure_smiles_no_stereo'
-        structure_confidence_score = 'candidate_score_sirius_confidence'
-        structure_similarity_peaks_matched = 'candidate_count_similarity_peaks_matched'
-        structure_similarity_score = 'candidate_score_similarity'
-        structure_error_mz = 'candidate_structure_error_mz'
-        structure_xlogp = 'candidate_structure_xlogp'
-        score_biological_col = 'score_biological'
-        score_chemical_col = 'score_chemical'
-        score_initial_col = 'score_initial'
-        score_final_col = 'score_final'
-        MF_col = 'candidate_structure_molecular_formula'
-        reference_col = 'candidate_structure_organism_occurrence_reference'
-        best_cand_organism_col = 'candidate_structure_organism_occurrence_closest'
-        library_col = 'candidate_library'
-        rank_initial_col = 'rank_initial'
-        rank_final_col = 'rank_final'
-        spectrum_entropy_col = 'candidate_spectrum_entropy'
-        structure_classyfire_chemontid = 'candidate_structure_tax_cla_chemontid'  
-        structure_classyfire_01kin = 'candidate_structure_tax_cla_01kin'  
-        structure_classyfire_02sup = 'candidate_structure_tax_cla_02sup'  
-        structure_classyfire_03cla = 'candidate_structure_tax_cla_03cla'  
-        structure_classyfire_04dirpar = 'candidate_structure_tax_cla_04dirpar'  
-        structure_NPClassifier_01pat = 'candidate_structure_tax_npc_01pat'  
-        structure_NPClassifier_02sup = 'candidate_structure_tax_npc_02sup'
-        structure_NPClassifier_03class = 'candidate_structure_tax_npc_03cla'  
-
-        def is_valid(value):
-            if pd.isna(value):
-                return False
-            if isinstance(value, float):
-                return value.is_integer()
-            return True
-    
-        def has_annotation_data(row, columns):
-            return any(is_valid(row[col]) for col in columns)
-
-        annotation_columns = [
-            structure_smiles_col, MF_col, reference_col, library_col, 
-            best_cand_organism_col, structure_similarity_score, 
-            score_biological_col, score_chemical_col, score_final_col,
-            rank_initial_col, rank_final_col, structure_confidence_score,
-            structure_similarity_peaks_matched, structure_error_mz,
-            structure_xlogp, spectrum_entropy_col, structure_classyfire_chemontid,
-            structure_classyfire_01kin, structure_classyfire_02sup,
-            structure_classyfire_03cla, structure_classyfire_04dirpar,
-            structure_NPClassifier_01pat, structure_NPClassifier_02sup, structure_NPClassifier_03class
-        ]
-
-        feature_count = {}
-        for _, row in timar_annotations.iterrows():
-            feature_id = 'mzspec:' + str(metadata['massive_id'][0]) + ':' + str(metadata.sample_id[0]) + '_features_ms2_' + str(ionization_mode) + '.mgf:scan:' + str(row[feature_col])
-            if has_annotation_data(row, annotation_columns):
-                # Check if essential columns exist in DataFrame
-                if feature_id not in feature_count:
-                    feature_count[feature_id] = 0
-
-                # Increment the count for this feature ID
-                feature_count[feature_id] += 1
-
-                missing_columns = [col for col in annotation_columns if col not in timar_annotations.columns]
-                if missing_columns:
-                    print(f"Missing columns in the DataFrame: {', '.join(missing_columns)}")
-                    continue
-
-                InChIkey2D = rdflib.term.URIRef(kg_uri + str(row[structure_col]))
-                usi = 'mzspec:' + str(metadata['massive_id'][0]) + ':' + str(metadata.sample_id[0]) + '_features_ms2_'+ str(ionization_mode)+ '.mgf:scan:' + str(row[feature_col])
-                
-                # Calculate the count based on the current feature
-                count = feature_count[feature_id]
-
-                feature_id = 'mzspec:' + str(metadata['massive_id'][0]) + ':' + str(metadata.sample_id[0]) + '_features_ms2_' + str(ionization_mode) + '.mgf:scan:' + str(row[feature_col])
-                feature_uri = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + feature_id)
-
-                annotation_uri = rdflib.term.URIRef(kg_uri + f'tima_{feature_id}/TimaAnnotation/{count}')
-
-                g.add((feature_uri, ns_kg.has_tima_annotation, annotation_uri))
-                g.add((annotation_uri, RDF.type, ns_kg.TimaAnnotation))
-                g.add((annotation_uri, RDFS.label, rdflib.term.Literal(f"TIMA annotation {feature_count[feature_id]} of {feature_id}")))
-                g.add((annotation_uri, RDF.type, ns_kg.timaAnnotation))
-                g.add((InChIkey2D, RDF.type, ns_kg.InChIkey2D))
-
-                # Define a function to check for 'NaN' values
-                def is_valid(value):
-                    return pd.notna(value) and value != 'NaN' and value != 'nan'
-
-                if is_valid(row[structure_smiles_col]):
-                    g.add((annotation_uri, ns_kg.has_SMILES, rdflib.term.Literal(row[structure_smiles_col], datatype=XSD.string)))
-
-                if is_valid(row[MF_col]):
-                    g.add((annotation_uri, ns_kg.has_molecular_formula, rdflib.term.Literal(row[MF_col], datatype=XSD.string)))
-
-                if is_valid(row[reference_col]):
-                    g.add((annotation_uri, ns_kg.has_reference, rdflib.term.Literal(row[reference_col], datatype=XSD.string)))
-
-                if is_valid(row[library_col]):
-                    g.add((annotation_uri, ns_kg.has_reference, rdflib.term.Literal(row[library_col], datatype=XSD.string)))
-
-                if is_valid(row[best_cand_organism_col]):
-                    g.add((annotation_uri, ns_kg.has_best_candidate_organism, rdflib.term.Literal(row[best_cand_organism_col], datatype=XSD.string)))
-
-                if is_valid(row[structure_similarity_score]):
-                    g.add((annotation_uri, ns_kg.has_spectral_score, rdflib.term.Literal(row[structure_similarity_score], datatype=XSD.float)))
-
-                if is_valid(row[score_biological_col]):
-                    g.add((annotation_uri, ns_kg.has_taxo_score, rdflib.term.Literal(row[score_biological_col], datatype=XSD.float)))
-
-                if is_valid(row[score_chemical_col]):
-                    g.add((annotation_uri, ns_kg.has_consistency_score, rdflib.term.Literal(row[score_chemical_col], datatype=XSD.float)))
-
-                if is_valid(row[score_final_col]):
-                    g.add((annotation_uri, ns_kg.has_final_score, rdflib.term.Literal(row[score_final_col], datatype=XSD.float)))
-
-                if is_valid(row[rank_initial_col]):
-                    initial_rank = int(row[rank_initial_col])
-                    g.add((annotation_uri, ns_kg.has_rank_initial, rdflib.term.Literal(initial_rank, datatype=XSD.integer)))
-
-                if is_valid(row[rank_final_col]):
-                    final_rank = int(row[rank_final_col])
-                    g.add((annotation_uri, ns_kg.has_rank_final, rdflib.term.Literal(final_rank, datatype=XSD.integer)))
-
-                if is_valid(row[structure_confidence_score]):
-                    g.add((annotation_uri, ns_kg.has_structure_confidence_score, rdflib.term.Literal(row[structure_confidence_score], datatype=XSD.float)))
-
-                if is_valid(row[structure_similarity_peaks_matched]):
-                    g.add((annotation_uri, ns_kg.has_structure_similarity_peaks_matched, rdflib.term.Literal(row[structure_similarity_peaks_matched], datatype=XSD.integer)))
-
-                if is_valid(row[structure_error_mz]):
-                    g.add((annotation_uri, ns_kg.has_structure_error_mz, rdflib.term.Literal(row[structure_error_mz], datatype=XSD.float)))
-
-                if is_valid(row[structure_xlogp]):
-                    g.add((annotation_uri, ns_kg.has_logp, rdflib.term.Literal(row[structure_xlogp], datatype=XSD.float)))
-
-                if is_valid(row[spectrum_entropy_col]):
-                    g.add((annotation_uri, ns_kg.has_spectrum_entropy, rdflib.term.Literal(row[spectrum_entropy_col], datatype=XSD.float)))
-
-                if is_valid(row[structure_classyfire_chemontid]):
-                    g.add((annotation_uri, ns_kg.has_classyfire_chemontid, rdflib.term.Literal(row[structure_classyfire_chemontid], datatype=XSD.string)))
-
-                if is_valid(row[structure_classyfire_01kin]):
-                    g.add((annotation_uri, ns_kg.has_classyfire_01kin, rdflib.term.Literal(row[structure_classyfire_01kin], datatype=XSD.string)))
-
-                if is_valid(row[structure_classyfire_02sup]):
-                    g.add((annotation_uri, ns_kg.has_classyfire_superclass, rdflib.term.Literal(row[structure_classyfire_02sup], datatype=XSD.string)))
-
-                if is_valid(row[structure_classyfire_03cla]):
-                    g.add((annotation_uri, ns_kg.has_classyfire_class, rdflib.term.Literal(row[structure_classyfire_03cla], datatype=XSD.string)))
-
-                if is_valid(row[structure_classyfire_04dirpar]):
-                    g.add((annotation_uri, ns_kg.has_classyfire_level_5, rdflib.term.Literal(row[structure_classyfire_04dirpar], datatype=XSD.string)))
-
-                if is_valid(row[structure_NPClassifier_01pat]):
-                    g.add((annotation_uri, ns_kg.has_npc_pathway, rdflib.term.Literal(row[structure_NPClassifier_01pat], datatype=XSD.string)))
-
-                if is_valid(row[structure_NPClassifier_02sup]):
-                    g.add((annotation_uri, ns_kg.has_npc_superclass, rdflib.term.Literal(row[structure_NPClassifier_02sup], datatype=XSD.string)))
-
-                if is_valid(row[structure_NPClassifier_03class]):
-                    g.add((annotation_uri, ns_kg.has_npc_class, rdflib.term.Literal(row[structure_NPClassifier_03class], datatype=XSD.string)))
-
-        pathout = os.path.join(sample_dir_path, directory,  "rdf/")
-        os.makedirs(pathout, exist_ok=True)
-        pathout = os.path.normpath(os.path.join(pathout, f'tima-r_{ionization_mode}.ttl'))
-
-        # Serialize and check if the graph is not empty
-        if len(g) > 0:
-            g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-        else:
-            print("The RDF graph is empty, no triples to serialize.")
-        print(f'Results are in : {pathout}')
+            # Define all the column names directly without suffixes
+            feature_col = 'feature_id'
+            structure_col = 'candidate_structure_inchikey_no_stereo'
+            structure_smiles_col = 'candidate_structure_smiles_no_stereo'
+            structure_confidence_score = 'candidate_score_sirius_confidence'
+            structure_similarity_peaks_matched = 'candidate_count_similarity_peaks_matched'
+            structure_similarity_score = 'candidate_score_similarity'
+            structure_error_mz = 'candidate_structure_error_mz'
+            structure_xlogp = 'candidate_structure_xlogp'
+            score_biological_col = 'score_biological'
+            score_chemical_col = 'score_chemical'
+            score_initial_col = 'score_initial'
+            score_final_col = 'score_final'
+            MF_col = 'candidate_structure_molecular_formula'
+            reference_col = 'candidate_structure_organism_occurrence_reference'
+            best_cand_organism_col = 'candidate_structure_organism_occurrence_closest'
+            library_col = 'candidate_library'
+            rank_initial_col = 'rank_initial'
+            rank_final_col = 'rank_final'
+            spectrum_entropy_col = 'candidate_spectrum_entropy'
+            structure_classyfire_chemontid = 'candidate_structure_tax_cla_chemontid'  
+            structure_classyfire_01kin = 'candidate_structure_tax_cla_01kin'  
+            structure_classyfire_02sup = 'candidate_structure_tax_cla_02sup'  
+            structure_classyfire_03cla = 'candidate_structure_tax_cla_03cla'  
+            structure_classyfire_04dirpar = 'candidate_structure_tax_cla_04dirpar'  
+            structure_NPClassifier_01pat = 'candidate_structure_tax_npc_01pat'  
+            structure_NPClassifier_02sup = 'candidate_structure_tax_npc_02sup'
+            structure_NPClassifier_03class = 'candidate_structure_tax_npc_03cla'  
+
+            annotation_columns = [
+                structure_smiles_col, MF_col, reference_col, library_col, 
+                best_cand_organism_col, structure_similarity_score, 
+                score_biological_col, score_chemical_col, score_final_col,
+                rank_initial_col, rank_final_col, structure_confidence_score,
+                structure_similarity_peaks_matched, structure_error_mz,
+                structure_xlogp, spectrum_entropy_col, structure_classyfire_chemontid,
+                structure_classyfire_01kin, structure_classyfire_02sup,
+                structure_classyfire_03cla, structure_classyfire_04dirpar,
+                structure_NPClassifier_01pat, structure_NPClassifier_02sup, structure_NPClassifier_03class
+            ]
+
+            try:
+                # Only parse the columns that end up in the graph
+                used_columns = {feature_col, structure_col, *annotation_columns}
+                timar_annotations = pd.read_csv(tima_r_path, sep='\t', usecols=lambda col: col in used_columns)
+
+                # Keep the top n annotations of each feature: one stable sort on (feature, rank), then the
+                # first max_top_n rows of each feature
+                timar_annotations = timar_annotations[timar_annotations[feature_col].notna()]
+                timar_annotations = timar_annotations.sort_values(by=[feature_col, rank_final_col], kind='stable')
+                timar_annotations = timar_annotations[timar_annotations.groupby(feature_col, sort=False).cumcount() < max_top_n]
+
+                # Reset the index of the resulting DataFrame
+                timar_annotations.reset_index(drop=True, inplace=True)
+
+                metadata = get_metadata(sample_manifest)
+            except FileNotFoundError:
+                raise
+            except NotADirectoryError:
+                raise
+
+            # Literal triples of an annotation: column, predicate and datatype
+            annotation_literals = [
+                (structure_smiles_col, ns_kg.has_SMILES, XSD.string),
+                (MF_col, ns_kg.has_molecular_formula, XSD.string),
+                (reference_col, ns_kg.has_reference, XSD.string),
+                (library_col, ns_kg.has_reference, XSD.string),
+                (best_cand_organism_col, ns_kg.has_best_candidate_organism, XSD.string),
+                (structure_similarity_score, ns_kg.has_spectral_score, XSD.float),
+                (score_biological_col, ns_kg.has_taxo_score, XSD.float),
+                (score_chemical_col, ns_kg.has_consistency_score, XSD.float),
+                (score_final_col, ns_kg.has_final_score, XSD.float),
+                (rank_initial_col, ns_kg.has_rank_initial, XSD.integer),
+                (rank_final_col, ns_kg.has_rank_final, XSD.integer),
+                (structure_confidence_score, ns_kg.has_structure_confidence_score, XSD.float),
+                (structure_similarity_peaks_matched, ns_kg.has_structure_similarity_peaks_matched, XSD.integer),
+                (structure_error_mz, ns_kg.has_structure_error_mz, XSD.float),
+                (structure_xlogp, ns_kg.has_logp, XSD.float),
+                (spectrum_entropy_col, ns_kg.has_spectrum_entropy, XSD.float),
+                (structure_classyfire_chemontid, ns_kg.has_classyfire_chemontid, XSD.string),
+                (structure_classyfire_01kin, ns_kg.has_classyfire_01kin, XSD.string),
+                (structure_classyfire_02sup, ns_kg.has_classyfire_superclass, XSD.string),
+                (structure_classyfire_03cla, ns_kg.has_classyfire_class, XSD.string),
+                (structure_classyfire_04dirpar, ns_kg.has_classyfire_level_5, XSD.string),
+                (structure_NPClassifier_01pat, ns_kg.has_npc_pathway, XSD.string),
+                (structure_NPClassifier_02sup, ns_kg.has_npc_superclass, XSD.string),
+                (structure_NPClassifier_03class, ns_kg.has_npc_class, XSD.string),
+            ]
+
+            g = TripleWriter(pathout)
+
+            missing_columns = [col for col in annotation_columns if col not in timar_annotations.columns]
+            if missing_columns:
+                print(f"Missing columns in the DataFrame: {', '.join(missing_columns)}")
+                g.discard()
+                continue
+
+            # A value is valid if it is not missing nor a 'NaN' string, the masks are computed once per column
+            valid = pd.DataFrame({col: timar_annotations[col].notna() & (timar_annotations[col] != 'NaN') & (timar_annotations[col] != 'nan')
+                                  for col in annotation_columns})
+
+            # Only the rows with some annotation data are kept, they are numbered per feature in their order
+            annotated = valid.any(axis=1)
+            timar_annotations = timar_annotations[annotated]
+            valid = valid[annotated]
+            count = timar_annotations.groupby(feature_col, sort=False).cumcount() + 1
+
+            feature_id = 'mzspec:' + str(metadata['massive_id'][0]) + ':' + str(metadata.sample_id[0]) + '_features_ms2_' + str(ionization_mode) + '.mgf:scan:' + timar_annotations[feature_col].astype(str)
+            feature_uri = nt_uris(kg_uri + 'lcms_feature_' + feature_id)
+            annotation_uri = nt_uris(kg_uri + 'tima_' + feature_id + '/TimaAnnotation/' + count.astype(str))
+            InChIkey2D = nt_uris(kg_uri + timar_annotations[structure_col].astype(str))
+
+            g.add_columns(feature_uri, ns_kg.has_tima_annotation, annotation_uri)
+            g.add_columns(annotation_uri, RDF.type, ns_kg.TimaAnnotation)
+            g.add_columns(annotation_uri, RDFS.label, nt_literals('TIMA annotation ' + count.astype(str) + ' of ' + feature_id))
+            g.add_columns(annotation_uri, RDF.type, ns_kg.timaAnnotation)
+            g.add_columns(InChIkey2D, RDF.type, ns_kg.InChIkey2D)
+
+            for col, predicate, datatype in annotation_literals:
+                mask = valid[col]
+                values = timar_annotations.loc[mask, col]
+                # Integer columns are read as floats when they have missing values
+                if datatype == XSD.integer:
+                    values = values.astype(float).astype('int64')
+                g.add_columns(annotation_uri[mask], predicate, nt_literals(values, datatype))
+
+            # Keep the output only if the graph is not empty
+            if len(g) > 0:
+                g.close()
+                save_fingerprint(pathout, fingerprint)
+            else:
+                g.discard()
+                print("The RDF graph is empty, no triples to serialize.")
+            print(f'Results are in : {pathout}')
+
+if __name__ == "__main__":
+    main()
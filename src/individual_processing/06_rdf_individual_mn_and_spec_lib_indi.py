@@ -1,81 +1,77 @@
 import os
+import sys
 import pandas as pd
+import numpy as np
 import rdflib
-from rdflib import Graph
 from rdflib.namespace import RDF, XSD, RDFS
-import networkx as nx
 import argparse
 import textwrap
 from pathlib import Path
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
-from collections import defaultdict
 import time
 
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from samples' individual MNs 
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-            - Ionization mode to process
-        '''))
-
-parser.add_argument('-p', '--sample_dir_path', required=True, type=str,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-ion', '--ionization_mode', required=True, type=str,
-                    help='The ionization mode to process')
-parser.add_argument('-top', '--top_hits', required=False, type=int, default=3,
-                    help='The top spectral matches to considered. Redundant structures are filtered out before.')
-
-args = parser.parse_args()
-ionization_mode = args.ionization_mode
-top_hits = args.top_hits
-
-sample_dir_path = os.path.normpath(args.sample_dir_path)
-sample_dir = [directory for directory in os.listdir(sample_dir_path) 
-              if os.path.isdir(os.path.join(sample_dir_path, directory))]
-
-df_list = []
-
-def process_directory(directory):
-
-    if ionization_mode in directory:
-        g = Graph()
-        nm = g.namespace_manager
-        kg_uri = "https://enpkg.commons-lab.org/kg/"
-        ns_kg = rdflib.Namespace(kg_uri)
-        prefix = "enpkg"
-        nm.bind(prefix, ns_kg)
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, TripleWriter
+from hash_functions import get_fingerprint, is_up_to_date, save_fingerprint
+from manifest_functions import load_manifest, get_input, get_metadata
+from sirius_functions import get_polarity_input
+from graphml_functions import read_graphml_edges
+
+# Columns of the spectral library matches that end up in the graph
+SPECLIB_COLUMNS = ['inchikey', 'smiles', 'compound_name', 'inchi', 'Spectral_library_ID', 'Spectral_library', 'msms_score', 'matched_peaks']
+
+def load_spectral_lib_hits(spectral_lib_path, top_hits):
+    """Read the spectral library matches of a sample, sorted once by feature_id then by decreasing
+    msms_score, and keep the top_hits first matches of each feature with their rank.
+    Returns (hits, positions, offsets): hits maps each column and 'rank' to a list, and the matches
+    of a feature are the rows offsets[i]:offsets[i + 1] of these lists, i being positions[feature_id].
+    """
+    hits = pd.read_csv(spectral_lib_path, sep='\t', usecols=['feature_id', *SPECLIB_COLUMNS])
+    hits = hits[hits['feature_id'].notna()]
+    hits = hits.sort_values(['feature_id', 'msms_score'], ascending=[True, False], kind='stable')
+    ranks = hits.groupby('feature_id', sort=False).cumcount() + 1
+    hits = hits[ranks <= top_hits]
+
+    feature_ids, starts = np.unique(hits['feature_id'].to_numpy(), return_index=True)
+    positions = dict(zip(feature_ids.tolist(), range(len(feature_ids))))
+    offsets = np.append(starts, len(hits)).tolist()
+    columns = {col: hits[col].tolist() for col in SPECLIB_COLUMNS}
+    columns['rank'] = ranks[ranks <= top_hits].tolist()
+    return columns, positions, offsets
+
+def process_directory(directory, sample_dir_path, ionization_mode, top_hits=3, recompute=False, sample_manifest=None, graphml_cache=False):
+    """Build the MN graph of one sample and return its stats (status, nodes, edges, triples, seconds),
+    or None if the sample is not of this ionization mode.
+    """
+    start = time.perf_counter()
+    stats = {'sample': directory, 'status': 'written', 'nodes': 0, 'edges': 0, 'triples': 0, 'seconds': 0.0}
+
+    if ionization_mode in directory and sample_manifest is not None:
+        graph_path = get_polarity_input(sample_manifest, ionization_mode, 'mn_graphml')
+        graph_metadata_path = get_polarity_input(sample_manifest, ionization_mode, 'mn_metadata')
+        spectral_lib_path = get_polarity_input(sample_manifest, ionization_mode, 'speclib')
+        metadata_path = get_input(sample_manifest, 'sample', 'metadata')
+        if None in (graph_path, graph_metadata_path, spectral_lib_path, metadata_path):
+            stats['status'] = 'missing molecular network, spectral library matching or metadata files'
+            return stats
+
+        pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", f'individual_mn_{ionization_mode}.ttl'))
+        fingerprint = get_fingerprint(pathout, [graph_path, graph_metadata_path, spectral_lib_path, metadata_path], __file__,
+                                      {'ionization_mode': ionization_mode, 'top_hits': top_hits})
+        if not recompute and is_up_to_date(pathout, fingerprint):
+            stats['status'] = 'up to date'
+            return stats
 
         try:
-            graph_path = os.path.join(sample_dir_path, directory, ionization_mode, 'molecular_network', directory + '_mn_' + ionization_mode + '.graphml')
-            graph_metadata_path = os.path.join(sample_dir_path, directory, ionization_mode, 'molecular_network', directory + '_mn_metadata_' + ionization_mode + '.tsv')
-            spectral_lib_path = os.path.join(sample_dir_path, directory, ionization_mode, 'spectral_lib_matching', directory + '_lib_results_final_' + ionization_mode + '.tsv')
-            metadata_path = os.path.join(sample_dir_path, directory, 'metadata.tsv')
-            graph = nx.read_graphml(graph_path)
-            metadata = pd.read_csv(metadata_path, sep='\t')
+            graph = read_graphml_edges(graph_path, ['weight'], cache=graphml_cache)
+            metadata = get_metadata(sample_manifest)
             graph_metadata = pd.read_csv(graph_metadata_path, sep='\t')
-            spectral_lib_metadata = pd.read_csv(spectral_lib_path, sep='\t')
-
-            spectral_lib_dict = defaultdict(list)
-            for _, row in spectral_lib_metadata.iterrows():
-                spectral_lib_dict[row['feature_id']].append(row)
-            # Sort and keep top annotations for each feature_id
-            for feature_id in spectral_lib_dict:
-                annotations = spectral_lib_dict[feature_id]
-                annotations.sort(key=lambda x: x['msms_score'], reverse=True)
-                # Calculate the maximum rank based on top_hits
-                max_rank = min(len(annotations), top_hits)
-
-                for rank, annotation in enumerate(annotations, start=1):
-                    annotation['rank'] = min(rank, max_rank)  # Assign rank
-
+            speclib, speclib_positions, speclib_offsets = load_spectral_lib_hits(spectral_lib_path, top_hits)
         except FileNotFoundError:
             print(f"File not found error occurred for directory {directory}")
             raise
@@ -88,115 +84,154 @@ def process_directory(directory):
         sample_id = metadata['sample_id'].iloc[0]
         massive_id = metadata['massive_id'].iloc[0]
 
-        for node in graph.edges(data=True):
-            s, t, data = node
-            cosine = data['weight']
-            
-            s_data = feature_data.get(int(s))
-            t_data = feature_data.get(int(t))
-
-            if s_data is not None and t_data is not None:
-                # Construct URIs using s_metadata and t_metadata
-                usi_s = f'mzspec:{massive_id}:{sample_id}_features_ms2_{ionization_mode}.mgf:scan:{s}'
-                usi_t = f'mzspec:{massive_id}:{sample_id}_features_ms2_{ionization_mode}.mgf:scan:{t}'
-                s_feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi_s)
-                t_feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi_t)
-                mass_diff = abs(s_data['precursor_mz'] - t_data['precursor_mz'])
-
-                # Assuming component_index is an integer or can be cast to an integer
-                component_index_s = int(s_data['component_id'])
-                component_index_t = int(t_data['component_id'])
-
-                # Construct URIs for component indices
-                ci_node_s = rdflib.term.URIRef(kg_uri + sample_id + '_fbmn_' + ionization_mode + '_componentindex_' + str(component_index_s))
-                ci_node_t = rdflib.term.URIRef(kg_uri + sample_id + '_fbmn_' + ionization_mode + '_componentindex_' + str(component_index_t))
-
-                # Add RDF triples linking features to their component indices and assigning types
-                if component_index_s == -1:
-                    g.add((s_feature_id, RDF.type, ns_kg.SingleNode))
-                else:
-                    g.add((s_feature_id, RDF.type, ns_kg.InNetwork))
-
-                if component_index_t == -1:
-                    g.add((t_feature_id, RDF.type, ns_kg.SingleNode))
-                else:
-                    g.add((t_feature_id, RDF.type, ns_kg.InNetwork))
-
-                g.add((s_feature_id, ns_kg.has_fbmn_ci, ci_node_s))
-                g.add((t_feature_id, ns_kg.has_fbmn_ci, ci_node_t))
-
-                link_node = rdflib.term.URIRef(kg_uri + 'lcms_feature_pair_' + usi_s + '_' + usi_t)
-                g.add((link_node, RDF.type, ns_kg.LFpair))
-                g.add((link_node, ns_kg.has_cosine, rdflib.term.Literal(cosine, datatype=XSD.float)))
-                g.add((link_node, ns_kg.has_mass_difference, rdflib.term.Literal(mass_diff, datatype=XSD.float)))
-
-                if s_data['precursor_mz'] > t_data['precursor_mz']:
-                    g.add((link_node, ns_kg.has_member_1, s_feature_id))
-                    g.add((link_node, ns_kg.has_member_2, t_feature_id))
-                else:
-                    g.add((link_node, ns_kg.has_member_1, t_feature_id))
-                    g.add((link_node, ns_kg.has_member_2, s_feature_id))
-
-                # Process spectral library metadata for node 's'
-                if int(s) in spectral_lib_dict:
-                    annotations = spectral_lib_dict[int(s)][:top_hits]  # Limit to top_hits
-                    for annotation in annotations:
-                        rank = annotation['rank']
-                        annotation_uri = usi_s + f"/SpecLibAnnotation/{rank}"
-                        speclib_annotation_id_s = rdflib.term.URIRef(kg_uri + 'speclib_' + annotation_uri)
-
-                        # Add RDF triples for this annotation
-                        g.add((speclib_annotation_id_s, RDF.type, ns_kg.SpecLibAnnotation))
-                        g.add((speclib_annotation_id_s, ns_kg.has_rank, rdflib.term.Literal(annotation['rank'], datatype=XSD.integer)))
-                        inchikey_str = str(annotation['inchikey']) if pd.notna(annotation['inchikey']) else ''
-                        g.add((s_feature_id, ns_kg.has_speclib_annotation, speclib_annotation_id_s))
-                        g.add((speclib_annotation_id_s, RDFS.label, rdflib.term.Literal(f"Spectral library annotation of feature_ID={s}")))
-                        g.add((speclib_annotation_id_s, ns_kg.has_InChIkey, rdflib.term.URIRef(kg_uri + inchikey_str)))
-                        g.add((speclib_annotation_id_s, ns_kg.has_SMILES, rdflib.term.Literal(annotation['smiles'])))
-                        g.add((speclib_annotation_id_s, ns_kg.has_structure_name, rdflib.term.Literal(annotation['compound_name'])))
-                        g.add((speclib_annotation_id_s, ns_kg.has_inchi, rdflib.term.Literal(annotation['inchi'])))
-                        g.add((speclib_annotation_id_s, ns_kg.has_spectral_library_id, rdflib.term.Literal(annotation['Spectral_library_ID'])))
-                        g.add((speclib_annotation_id_s, ns_kg.has_spectral_library, rdflib.term.Literal(annotation['Spectral_library'])))
-                        g.add((speclib_annotation_id_s, ns_kg.has_msms_score, rdflib.term.Literal(annotation['msms_score'], datatype=XSD.float)))
-                        g.add((speclib_annotation_id_s, ns_kg.has_matched_peaks, rdflib.term.Literal(annotation['matched_peaks'], datatype=XSD.integer)))
-
-                # Process spectral library metadata for node 't'
-                if int(t) in spectral_lib_dict:
-                    annotations = spectral_lib_dict[int(t)][:top_hits]  # Limit to top_hits
-                    for annotation in annotations:
-                        rank = annotation['rank']
-                        annotation_uri = usi_t + f"/SpecLibAnnotation/{rank}"
-                        speclib_annotation_id_t = rdflib.term.URIRef(kg_uri + 'speclib_' + annotation_uri)
-
-                        # Add RDF triples for this annotation
-                        g.add((speclib_annotation_id_t, RDF.type, ns_kg.SpecLibAnnotation))
-                        g.add((speclib_annotation_id_t, ns_kg.has_rank, rdflib.term.Literal(annotation['rank'], datatype=XSD.integer)))
-                        inchikey_str = str(annotation['inchikey']) if pd.notna(annotation['inchikey']) else ''
-                        g.add((t_feature_id, ns_kg.has_speclib_annotation, speclib_annotation_id_t))
-                        g.add((speclib_annotation_id_t, RDFS.label, rdflib.term.Literal(f"Spectral library annotation of feature_ID={t}")))
-                        g.add((speclib_annotation_id_t, ns_kg.has_InChIkey, rdflib.term.URIRef(kg_uri + inchikey_str)))
-                        g.add((speclib_annotation_id_t, ns_kg.has_SMILES, rdflib.term.Literal(annotation['smiles'])))
-                        g.add((speclib_annotation_id_t, ns_kg.has_structure_name, rdflib.term.Literal(annotation['compound_name'])))
-                        g.add((speclib_annotation_id_t, ns_kg.has_inchi, rdflib.term.Literal(annotation['inchi'])))
-                        g.add((speclib_annotation_id_t, ns_kg.has_spectral_library_id, rdflib.term.Literal(annotation['Spectral_library_ID'])))
-                        g.add((speclib_annotation_id_t, ns_kg.has_spectral_library, rdflib.term.Literal(annotation['Spectral_library'])))
-                        g.add((speclib_annotation_id_t, ns_kg.has_msms_score, rdflib.term.Literal(annotation['msms_score'], datatype=XSD.float)))
-                        g.add((speclib_annotation_id_t, ns_kg.has_matched_peaks, rdflib.term.Literal(annotation['matched_peaks'], datatype=XSD.integer)))
-
-        # If you want to get general info about your graph like number of nodes, edges etc.
-        print("\nGeneral info about the graph:")
-        num_nodes = graph.number_of_nodes()
-        num_edges = graph.number_of_edges()
-        print(f"Graph with {num_nodes} nodes and {num_edges} edges")
-    
-        pathout = os.path.join(sample_dir_path, directory, "rdf/")
-        os.makedirs(pathout, exist_ok=True)
-        pathout = os.path.normpath(os.path.join(pathout, f'individual_mn_{ionization_mode}.ttl'))
-        g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-        print(f'Results are in : {pathout}') 
-
-    return directory  # or return whatever result you want from each directory
+        usi_prefix = f'mzspec:{massive_id}:{sample_id}_features_ms2_{ionization_mode}.mgf:scan:'
+        g = TripleWriter(pathout)
+
+        # Only the edges whose two nodes have metadata are described, and so are only the nodes they link
+        edges = [(s, t, cosine) for s, t, cosine in zip(graph['source'].tolist(), graph['target'].tolist(), graph['weight'].tolist())
+                 if feature_data.get(int(s)) is not None and feature_data.get(int(t)) is not None]
+        nodes = list(dict.fromkeys(node for s, t, _ in edges for node in (s, t)))
+
+        # Node pass: the typing, component index and spectral library annotations of each feature, once
+        for node in nodes:
+            node_data = feature_data[int(node)]
+            usi = usi_prefix + str(node)
+            feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi)
+
+            # Assuming component_index is an integer or can be cast to an integer
+            component_index = int(node_data['component_id'])
+            ci_node = rdflib.term.URIRef(kg_uri + sample_id + '_fbmn_' + ionization_mode + '_componentindex_' + str(component_index))
+
+            # Add RDF triples linking features to their component indices and assigning types
+            if component_index == -1:
+                g.add((feature_id, RDF.type, ns_kg.SingleNode))
+            else:
+                g.add((feature_id, RDF.type, ns_kg.InNetwork))
+            g.add((feature_id, ns_kg.has_fbmn_ci, ci_node))
+
+            # Process spectral library metadata for the node
+            position = speclib_positions.get(int(node))
+            if position is not None:
+                # The top_hits matches of the feature, already sorted and ranked
+                for i in range(speclib_offsets[position], speclib_offsets[position + 1]):
+                    rank = speclib['rank'][i]
+                    annotation_uri = usi + f"/SpecLibAnnotation/{rank}"
+                    speclib_annotation_id = rdflib.term.URIRef(kg_uri + 'speclib_' + annotation_uri)
+
+                    # Add RDF triples for this annotation
+                    g.add((speclib_annotation_id, RDF.type, ns_kg.SpecLibAnnotation))
+                    g.add((speclib_annotation_id, ns_kg.has_rank, rdflib.term.Literal(rank, datatype=XSD.integer)))
+                    inchikey_str = str(speclib['inchikey'][i]) if pd.notna(speclib['inchikey'][i]) else ''
+                    g.add((feature_id, ns_kg.has_speclib_annotation, speclib_annotation_id))
+                    g.add((speclib_annotation_id, RDFS.label, rdflib.term.Literal(f"Spectral library annotation of feature_ID={node}")))
+                    g.add((speclib_annotation_id, ns_kg.has_InChIkey, rdflib.term.URIRef(kg_uri + inchikey_str)))
+                    g.add((speclib_annotation_id, ns_kg.has_SMILES, rdflib.term.Literal(speclib['smiles'][i])))
+                    g.add((speclib_annotation_id, ns_kg.has_structure_name, rdflib.term.Literal(speclib['compound_name'][i])))
+                    g.add((speclib_annotation_id, ns_kg.has_inchi, rdflib.term.Literal(speclib['inchi'][i])))
+                    g.add((speclib_annotation_id, ns_kg.has_spectral_library_id, rdflib.term.Literal(speclib['Spectral_library_ID'][i])))
+                    g.add((speclib_annotation_id, ns_kg.has_spectral_library, rdflib.term.Literal(speclib['Spectral_library'][i])))
+                    g.add((speclib_annotation_id, ns_kg.has_msms_score, rdflib.term.Literal(speclib['msms_score'][i], datatype=XSD.float)))
+                    g.add((speclib_annotation_id, ns_kg.has_matched_peaks, rdflib.term.Literal(speclib['matched_peaks'][i], datatype=XSD.integer)))
+
+        # Edge pass: the feature pair of each edge
+        for s, t, cosine in edges:
+            s_data = feature_data[int(s)]
+            t_data = feature_data[int(t)]
+
+            usi_s = usi_prefix + str(s)
+            usi_t = usi_prefix + str(t)
+            s_feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi_s)
+            t_feature_id = rdflib.term.URIRef(kg_uri + 'lcms_feature_' + usi_t)
+            mass_diff = abs(s_data['precursor_mz'] - t_data['precursor_mz'])
+
+            link_node = rdflib.term.URIRef(kg_uri + 'lcms_feature_pair_' + usi_s + '_' + usi_t)
+            g.add((link_node, RDF.type, ns_kg.LFpair))
+            g.add((link_node, ns_kg.has_cosine, rdflib.term.Literal(cosine, datatype=XSD.float)))
+            g.add((link_node, ns_kg.has_mass_difference, rdflib.term.Literal(mass_diff, datatype=XSD.float)))
+
+            if s_data['precursor_mz'] > t_data['precursor_mz']:
+                g.add((link_node, ns_kg.has_member_1, s_feature_id))
+                g.add((link_node, ns_kg.has_member_2, t_feature_id))
+            else:
+                g.add((link_node, ns_kg.has_member_1, t_feature_id))
+                g.add((link_node, ns_kg.has_member_2, s_feature_id))
+
+        stats['nodes'] = len(graph['nodes'])
+        stats['edges'] = len(graph['source'])
+        stats['triples'] = len(g)
+        g.close()
+        save_fingerprint(pathout, fingerprint)
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    return None
+
+def process_task(task):
+    # Pool.imap() passes a single argument
+    return process_directory(*task)
+
+def print_stats(stats):
+    """Report the samples once they are all processed, then the totals of the graphs written."""
+    written = [sample_stats for sample_stats in stats if sample_stats['status'] == 'written']
+    for sample_stats in stats:
+        if sample_stats['status'] == 'written':
+            print(f"{sample_stats['sample']}: {sample_stats['nodes']} nodes, {sample_stats['edges']} edges, "
+                  f"{sample_stats['triples']} triples in {sample_stats['seconds']:.2f} s")
+        else:
+            print(f"{sample_stats['sample']}: {sample_stats['status']}")
+    print(f"{len(written)} graphs written out of {len(stats)} samples: "
+          f"{sum(s['nodes'] for s in written)} nodes, {sum(s['edges'] for s in written)} edges, "
+          f"{sum(s['triples'] for s in written)} triples in {sum(s['seconds'] for s in written):.2f} s of processing")
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from samples' individual MNs 
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - Ionization mode to process
+            '''))
+
+    parser.add_argument('-p', '--sample_dir_path', required=True, type=str,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-ion', '--ionization_mode', required=True, type=str,
+                        help='The ionization mode to process')
+    parser.add_argument('-top', '--top_hits', required=False, type=int, default=3,
+                        help='The top spectral matches to considered. Redundant structures are filtered out before.')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Recompute even if the output is up to date with its inputs')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='The number of samples processed in parallel (default: 1, 0 to use all the CPUs)')
+    parser.add_argument('--graphml_cache', action='store_true',
+                        help='Keep the edges of each .graphml in a .npz next to it, so that re-runs do not parse the XML again')
+
+    args = parser.parse_args(argv)
+    ionization_mode = args.ionization_mode
+    top_hits = args.top_hits
+
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    manifest = load_manifest(sample_dir_path, args.manifest, args.samples)
+    if args.samples:
+        sample_dir = args.samples
+    else:
+        sample_dir = list(manifest)
+
+    tasks = [(directory, sample_dir_path, ionization_mode, top_hits, args.recompute, manifest.get(directory), args.graphml_cache)
+             for directory in sample_dir]
+    workers = min(args.workers or cpu_count(), len(tasks))
+    if workers > 1:
+        with Pool(workers) as pool:
+            stats = list(tqdm(pool.imap(process_task, tasks), total=len(tasks)))
+    else:
+        stats = [process_task(task) for task in tqdm(tasks)]
+    print_stats([sample_stats for sample_stats in stats if sample_stats is not None])
 
 if __name__ == "__main__":
-    for directory in tqdm(sample_dir):
-        process_directory(directory)
+    main()
@@ -1,13 +1,12 @@
-from rdflib import Graph, Namespace
 import pandas as pd
 from pathlib import Path
 import os
-import shutil
 from tqdm import tqdm
-import rdflib
 import argparse
+import hashlib
+import time
+from multiprocessing import Pool, cpu_count
 import textwrap
-import gzip
 import glob
 
 try:
@@ -21,13 +20,137 @@ import sys
 
 # These lines allows to make sure that we are placed at the repo directory level 
 sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
-from hash_functions import get_hash
+from hash_functions import get_fingerprint, load_fingerprint, save_fingerprint, same_fingerprint, HashingWriter
+from manifest_functions import load_manifest, get_metadata
+from rdf_functions import iter_triple_lines
 
 # These lines allows to make sure that we are placed at the repo directory level 
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-def main():
+def list_rdf_files(rdf_dir, ionization_mode):
+    """The sample .ttl files to merge, sorted so that the merged graph and its hash are reproducible."""
+    return sorted(f for f in os.listdir(rdf_dir)
+                  if f.endswith('.ttl')
+                  and 'merged_graph' not in f
+                  and (ionization_mode is None or ionization_mode in f))
+
+def write_merged_graph(file_paths, out):
+    """Stream the triples of file_paths into out as N-Triples, each distinct triple once.
+    Duplicates are found by the md5 of their line. Returns (triples written, duplicates dropped).
+    A file that cannot be read raises an error: a merged graph missing part of a sample is never kept.
+    """
+    seen = set()
+    written = duplicates = 0
+    for file_path in file_paths:
+        try:
+            for line in iter_triple_lines(file_path):
+                data = line.encode('utf-8')
+                key = hashlib.md5(data).digest()
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                out.write(data)
+                written += 1
+        except Exception as e:
+            raise ValueError(f"Error reading file {file_path}: {e}") from e
+    return written, duplicates
+
+def merge_directory(directory, sample_dir_path, sample_manifest, args):
+    """Merge the .ttl files of one sample and return its stats (status, triples, duplicates, path, seconds)."""
+    start = time.perf_counter()
+    stats = {'sample': directory, 'status': 'written', 'triples': 0, 'duplicates': 0, 'path': None, 'seconds': 0.0}
+    rdf_dir = os.path.join(sample_dir_path, directory, "rdf")
+
+    metadata = get_metadata(sample_manifest) if sample_manifest is not None else None
+    if metadata is None:
+        metadata_path = os.path.join(sample_dir_path, directory, directory+'_metadata.tsv')
+        metadata = pd.read_csv(metadata_path, sep='\t')
+
+    massive_id = metadata['massive_id'][0]
+
+    # Skip the samples whose merged graph was built from the same .ttl files
+    fingerprint_key = os.path.join(rdf_dir, f'{massive_id}_{directory}_merged_graph.ttl')
+    if os.path.isdir(rdf_dir):
+        input_files = [os.path.join(rdf_dir, f) for f in list_rdf_files(rdf_dir, args.ionization_mode)]
+        fingerprint = get_fingerprint(fingerprint_key, input_files, __file__,
+                                      {'ionization_mode': args.ionization_mode, 'compress': args.compress, 'gzip_size': args.gzip_size})
+        merged_outputs = [f for f in glob.glob(os.path.join(glob.escape(rdf_dir), f'{glob.escape(str(massive_id))}_{glob.escape(directory)}_merged_graph_*'))
+                          if f.endswith(('.ttl', '.ttl.gz'))]
+        if not args.recompute and merged_outputs and same_fingerprint(load_fingerprint(fingerprint_key), fingerprint):
+            stats['status'] = 'up to date'
+            return stats
+
+    # Check if delete_merged is enabled and delete merged_graph files if present
+    if args.delete_merged:
+        merged_files = glob.glob(os.path.join(rdf_dir, '*_merged_graph*.ttl*'))
+        for file in merged_files:
+            os.remove(file)
+            print(f"Deleted existing merged graph file: {file}")
+
+    if not os.path.isdir(rdf_dir):
+        stats['status'] = 'RDF directory not found'
+        return stats
+
+    all_rdf_files = list_rdf_files(rdf_dir, args.ionization_mode)
+    if not all_rdf_files:
+        stats['status'] = f"no RDF files found with polarity '{args.ionization_mode}'"
+        return stats
+
+    for file in os.listdir(rdf_dir):
+        if file.startswith(massive_id):
+            os.remove(os.path.join(rdf_dir, file))
+
+    # The merged graph is hashed and, if large, gzipped while it is written: its size is known
+    # beforehand from the sample files, of which it is the union
+    rdf_file_paths = [os.path.join(rdf_dir, file_name) for file_name in all_rdf_files]
+    file_size_mb = sum(os.path.getsize(file_path) for file_path in rdf_file_paths) / 1e6  # Size in MB
+    compress = args.compress and file_size_mb >= args.gzip_size
+    extension = '.ttl.gz' if compress else '.ttl'
+    tmp_path = os.path.join(rdf_dir, f'{massive_id}_{directory}_merged_graph{extension}.tmp')
+    try:
+        with HashingWriter(tmp_path, compress=compress) as out:
+            stats['triples'], stats['duplicates'] = write_merged_graph(rdf_file_paths, out)
+            pathout_graph_hash = out.commit(lambda hash_merged: os.path.normpath(
+                os.path.join(rdf_dir, f'{massive_id}_{directory}_merged_graph_{hash_merged}{extension}')))
+    except ValueError as e:
+        # The partial merged graph is removed by HashingWriter and no fingerprint is saved
+        stats['status'] = 'failed'
+        stats['error'] = str(e)
+        return stats
+
+    save_fingerprint(fingerprint_key, fingerprint)
+
+    # Save parameters:
+    params_path = os.path.join(rdf_dir, "graph_params.yaml")
+    if os.path.isfile(params_path):
+        with open(params_path, encoding='UTF-8') as file:    
+            params_list = yaml.load(file, Loader=yaml.FullLoader) 
+    else:
+        params_list = {}  
+            
+    # Save Git-related parameters only if --use_git is specified
+    if args.use_git:
+        try:
+            git_commit = git.Repo(search_parent_directories=True).head.object.hexsha
+            git_commit_link = f'https://github.com/enpkg/enpkg_graph_builder/tree/{git_commit}'
+            params_list.update({f'{directory}_merged_graph':[{'git_commit': git_commit}, {'git_commit_link': git_commit_link}]})
+        except Exception as e:
+            print(f"Git information could not be retrieved: {e}")
+
+    with open(params_path, 'w', encoding='UTF-8') as file:
+        yaml.dump(params_list, file)
+
+    stats['path'] = pathout_graph_hash
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def merge_task(task):
+    # Pool.imap() passes a single argument
+    return merge_directory(*task)
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Run scripts in parallel.')
         
     """ Argument parser """
@@ -50,146 +173,46 @@ def main():
                         help='Use only')
     parser.add_argument('--delete-merged', action='store_true',
                         help='Delete existing merged_graph ttl or ttl.gz files in each sample folder')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Merge again even if the merged graph is up to date with the sample .ttl files')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='The number of samples merged in parallel (default: 1, 0 to use all the CPUs)')
 
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     sample_dir_path = os.path.normpath(args.sample_dir_path)
-    gzip_enabled = args.compress
-    gzip_size_threshold = args.gzip_size
-    merged_graph_only = args.merged_graph_only
-
-    # Create enpkg namespace
-    kg_uri = "https://enpkg.commons-lab.org/kg/"
-    ns_kg = rdflib.Namespace(kg_uri)
-    prefix_kg = "enpkg"
-
-    # Create enpkgmodule namespace
-    module_uri = "https://enpkg.commons-lab.org/module/"
-    ns_module = rdflib.Namespace(module_uri)
-    prefix_module = "enpkgmodule"
-    WD = Namespace('http://www.wikidata.org/entity/')
 
     path = os.path.normpath(sample_dir_path)
-    samples_dir = [directory for directory in os.listdir(path) 
-                if os.path.isdir(os.path.join(path, directory))]
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
     
-    for directory in tqdm(samples_dir):
-        rdf_dir = os.path.join(sample_dir_path, directory, "rdf")
-
-        # Check if delete_merged is enabled and delete merged_graph files if present
-        if args.delete_merged:
-            merged_files = glob.glob(os.path.join(rdf_dir, '*_merged_graph*.ttl*'))
-            for file in merged_files:
-                os.remove(file)
-                print(f"Deleted existing merged graph file: {file}")
-            merged_files = glob.glob(os.path.join(rdf_dir, '*_merged_graph*.ttl'))
-            for file in merged_files:
-                os.remove(file)
-                print(f"Deleted existing merged graph file: {file}")
-
-        if os.path.isdir(rdf_dir):
-            if merged_graph_only:
-                # Filter to include only files with 'merged_graph' in the name
-                all_rdf_files = [f for f in os.listdir(rdf_dir) 
-                                if f.endswith('.ttl') and 'merged_graph' in f]
-            else:
-               all_rdf_files = [f for f in os.listdir(rdf_dir) 
-                                
-                                if f.endswith('.ttl')]
-        print(f"Processing directory: {directory}")  # Debugging print statement
-        try:
-            metadata_path = os.path.join(path, directory, 'metadata.tsv')
-            metadata = pd.read_csv(metadata_path, sep='\t')
-        except FileNotFoundError:
-            metadata_path = os.path.join(path, directory, directory+'_metadata.tsv')
-            metadata = pd.read_csv(metadata_path, sep='\t')
-        except NotADirectoryError:
-            raise
-
-        massive_id = metadata['massive_id'][0]
-        
-        #print(f"Checking RDF directory: {rdf_dir}")  # Debugging print statement
-
-        if os.path.isdir(rdf_dir):
-            all_rdf_files = [f for f in os.listdir(rdf_dir) 
-                            if f.endswith('.ttl') 
-                            and 'merged_graph' not in f 
-                            and (args.ionization_mode is None or args.ionization_mode in f)]
-
-            #print(f"Found RDF files: {all_rdf_files}")  # Debugging print statement
-            if all_rdf_files:
-                merged_graph = Graph()
-                nm = merged_graph.namespace_manager
-                nm.bind(prefix_kg, ns_kg)
-                nm.bind(prefix_module, ns_module)
-                nm.bind("wd", WD)
-
-                for file_name in all_rdf_files:
-                    file_path = os.path.join(rdf_dir, file_name)
-                    #print(f"Reading file: {file_path}")  # Debugging print statement
-            
-                    try:
-                        with open(file_path, "r", encoding="utf8") as f:
-                            file_content = f.read()
-                            merged_graph.parse(data=file_content, format="ttl")
-                    except Exception as e:
-                        print(f"Error reading file {file_path}: {e}")
-
-            else:
-                print(f"No RDF files found for {directory} with polarity '{args.polarity}'")
-                continue
-
-            for file in os.listdir(os.path.join(os.path.join(sample_dir_path, directory, 'rdf'))):
-                if file.startswith(massive_id):
-                    os.remove(os.path.join(sample_dir_path, directory, 'rdf', file))
-                    
-            pathout = os.path.join(sample_dir_path, directory, "rdf/")
-            os.makedirs(pathout, exist_ok=True)
-            pathout_graph = os.path.normpath(os.path.join(pathout, f'{massive_id}_{directory}_merged_graph.ttl'))
-            merged_graph.serialize(destination=pathout_graph, format="ttl", encoding="utf-8")
-
-            hash_merged = get_hash(pathout_graph)
-            pathout_graph_hash = os.path.normpath(os.path.join(pathout, f'{massive_id}_{directory}_merged_graph_{hash_merged}.ttl'))
-            if os.path.isfile(pathout_graph_hash):
-                os.remove(pathout_graph_hash)
-            os.rename(pathout_graph, pathout_graph_hash)
-            print(f"Graph file renamed to: {pathout_graph_hash}")  # Print path of renamed graph
-
-            if gzip_enabled:
-                file_size_mb = os.path.getsize(pathout_graph_hash) / 1e6  # Size in MB
-                if file_size_mb >= gzip_size_threshold:
-                    gzip_path = pathout_graph_hash + '.gz'
-                    with open(pathout_graph_hash, 'rb') as f_in, gzip.open(gzip_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                    print(f"Compressed file created at: {gzip_path}")
-                    os.remove(pathout_graph_hash)
-
-
-            # Save parameters:
-            params_path = os.path.join(sample_dir_path, directory, "rdf", "graph_params.yaml")
-            if os.path.isfile(params_path):
-                with open(params_path, encoding='UTF-8') as file:    
-                    params_list = yaml.load(file, Loader=yaml.FullLoader) 
-            else:
-                params_list = {}  
-                    
-            # Save Git-related parameters only if --use_git is specified
-            if args.use_git:
-                try:
-                    git_commit = git.Repo(search_parent_directories=True).head.object.hexsha
-                    git_commit_link = f'https://github.com/enpkg/enpkg_graph_builder/tree/{git_commit}'
-                    params_list.update({f'{directory}_merged_graph':[{'git_commit': git_commit}, {'git_commit_link': git_commit_link}]})
-                except Exception as e:
-                    print(f"Git information could not be retrieved: {e}")
-
-            with open(os.path.join(params_path), 'w', encoding='UTF-8') as file:
-                yaml.dump(params_list, file)
-            
-            print(f'Results are in : {pathout_graph_hash}')
-        
+    tasks = [(directory, sample_dir_path, manifest.get(directory), args) for directory in samples_dir]
+    workers = min(args.workers or cpu_count(), len(tasks))
+    if workers > 1:
+        with Pool(workers) as pool:
+            stats = list(tqdm(pool.imap(merge_task, tasks), total=len(tasks)))
+    else:
+        stats = [merge_task(task) for task in tqdm(tasks)]
+
+    for sample_stats in stats:
+        if sample_stats['status'] == 'written':
+            print(f"{sample_stats['sample']}: {sample_stats['triples']} triples ({sample_stats['duplicates']} duplicates dropped) "
+                  f"in {sample_stats['seconds']:.2f} s, results are in : {sample_stats['path']}")
+        elif sample_stats['status'] == 'failed':
+            print(f"{sample_stats['sample']}: failed, {sample_stats['error']}")
         else:
-            print(f"RDF directory not found for {directory}")
-            continue
+            print(f"{sample_stats['sample']}: {sample_stats['status']}")
+
+    failed = [sample_stats['sample'] for sample_stats in stats if sample_stats['status'] == 'failed']
+    if failed:
+        sys.exit(f"{len(failed)} samples could not be merged: {', '.join(failed)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
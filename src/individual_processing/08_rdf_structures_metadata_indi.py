@@ -1,7 +1,7 @@
 import os
+import sys
+import json
 import pandas as pd
-import rdflib
-from rdflib import Graph
 from rdflib.namespace import RDF, RDFS
 import sqlite3
 import argparse
@@ -13,129 +13,203 @@ from tqdm import tqdm
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script generate a RDF graph (.ttl format) from chemical structures metadata
-         --------------------------------
-            Arguments:
-            - Path to the directory where samples folders are located
-            - Path to the SQL metadata DB with compounds' metadata
-        '''))
-
-parser.add_argument('-p', '--sample_dir_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-db', '--metadata_path', required=True,
-                    help='The path to the structures metadata SQL DB')
-
-
-args = parser.parse_args()
-sample_dir_path = os.path.normpath(args.sample_dir_path)
-metadata_path = os.path.normpath(args.metadata_path)
-
-# Connect to structures DB
-dat = sqlite3.connect(metadata_path)
-query = dat.execute("SELECT * From structures_metadata")
-cols = [column[0] for column in query.description]
-df_metadata = pd.DataFrame.from_records(data = query.fetchall(), columns = cols)
-
-kg_uri = "https://enpkg.commons-lab.org/kg/"
-ns_kg = rdflib.Namespace(kg_uri)
-prefix = "enpkg"
-
-path = os.path.normpath(sample_dir_path)
-samples_dir = [directory for directory in os.listdir(path)]
-df_list = []
-for directory in tqdm(samples_dir):    
-    
-    paths = []
-    isdb_pos_path = os.path.join(path, directory, 'rdf/isdb_pos.ttl')
-    isdb_neg_path = os.path.join(path, directory, 'rdf/isdb_neg.ttl')
-    sirius_pos_path = os.path.join(path, directory, 'rdf/sirius_pos.ttl')
-    sirius_neg_path = os.path.join(path, directory, 'rdf/sirius_neg.ttl')
-
-    paths = [isdb_pos_path, isdb_neg_path, sirius_pos_path, sirius_neg_path]
-    path_exist = []
-    for path_annot in paths:
-        if os.path.isfile(path_annot):
-            path_exist.append(path_annot)
-        else:
-            pass
-    if len(path_exist) == 0:
-        continue
-
-    merged_graph = Graph()
-    nm = merged_graph.namespace_manager
-    nm.bind(prefix, ns_kg)
-    for path_annot in path_exist:
-        with open(path_annot, "r") as f:
-            file_content = f.read()
-            merged_graph.parse(data=file_content, format="ttl")
-    
-    sample_short_ik = []
-    for s, p, o in merged_graph.triples((None,  RDF.type, ns_kg.InChIkey2D)):
-        sample_short_ik.append(s[-14:])
-
-    sample_specific_db = df_metadata[df_metadata['short_inchikey'].isin(sample_short_ik)]
-
-    g = Graph()
-    nm = g.namespace_manager
-    nm.bind(prefix, ns_kg)   
-    for _, row in sample_specific_db.iterrows():
-        short_ik = rdflib.term.URIRef(kg_uri + row['short_inchikey'])
-        npc_pathway_list = row['npc_pathway'].replace(" ", "_").replace("(", "").replace(")", "").replace("-", "_").split('|')
-        npc_superclass_list = row['npc_superclass'].replace(" ", "_").replace("(", "").replace(")", "").replace("-", "_").split('|')
-        npc_class_list = row['npc_class'].replace(" ", "_").replace("(", "").replace(")", "").replace("-", "_").split('|')
-
-        npc_pathway_urilist = []
-        npc_superclass_urilist = []
-        npc_class_urilist = []
-
-        for list, uri_list in zip([npc_pathway_list, npc_superclass_list, npc_class_list],
-                                [npc_pathway_urilist, npc_superclass_urilist, npc_class_urilist]):
-            for item in list:
-                uri_list.append(rdflib.term.URIRef(kg_uri + "npc_" + item))
-                    
-        g.add((short_ik, ns_kg.has_smiles, rdflib.term.Literal(row['smiles'])))
-
-        all_npc_pathway = []
-        all_npc_superclass = []
-        all_npc_class = []
-        
-        for uri in npc_pathway_urilist:
-            g.add((short_ik, ns_kg.has_npc_pathway, uri))
-            if uri not in all_npc_pathway:
-                g.add((uri, RDF.type, ns_kg.NPCPathway))
-                all_npc_pathway.append(uri)
-        for uri in npc_superclass_urilist:
-            g.add((short_ik, ns_kg.has_npc_superclass, uri))
-            if uri not in all_npc_superclass:
-                g.add((uri, RDF.type, ns_kg.NPCSuperclass))
-                all_npc_superclass.append(uri)
-        for uri in npc_class_urilist:
-            g.add((short_ik, ns_kg.has_npc_class, uri))
-            if uri not in all_npc_class:
-                g.add((uri, RDF.type, ns_kg.NPCClass))
-                all_npc_class.append(uri)
-        
-        if (row['wikidata_id'] != 'no_wikidata_match') & (row['wikidata_id'] != None):
-            g.add((short_ik, ns_kg.is_InChIkey2D_of, rdflib.term.URIRef(kg_uri + row['inchikey'])))
-            g.add((rdflib.term.URIRef(kg_uri + row['inchikey']), ns_kg.has_wd_id, rdflib.term.URIRef(row['wikidata_id'])))
-            g.add((rdflib.term.URIRef(kg_uri + row['inchikey']), RDF.type, ns_kg.InChIkey))
-
-            for uri in npc_pathway_urilist:
-                g.add((rdflib.term.URIRef(kg_uri + row['inchikey']), ns_kg.has_npc_pathway, uri))
-            for uri in npc_superclass_urilist:
-                g.add((rdflib.term.URIRef(kg_uri + row['inchikey']), ns_kg.has_npc_superclass, uri))
-            for uri in npc_class_urilist:
-                g.add((rdflib.term.URIRef(kg_uri + row['inchikey']), ns_kg.has_npc_class, uri))
-                
-            g.add((rdflib.term.URIRef(kg_uri + row['inchikey']), ns_kg.has_smiles, rdflib.term.Literal(row['isomeric_smiles'])))
-            g.add((rdflib.term.URIRef(row['wikidata_id']), RDF.type, ns_kg.WDChemical))
-                
-    pathout = os.path.join(sample_dir_path, directory, "rdf/")
-    os.makedirs(pathout, exist_ok=True)
-    pathout = os.path.normpath(os.path.join(pathout, 'structures_metadata.ttl'))
-    g.serialize(destination=pathout, format="ttl", encoding="utf-8")
-    print(f'Results are in : {pathout}')  
+# These lines allows to import the functions shared between the stages
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from rdf_functions import kg_uri, ns_kg, TripleWriter, nt_uris, nt_literals
+from manifest_functions import load_manifest, get_input
+from sirius_functions import detect_sirius_polarity, get_polarity_input
+
+# SQLite limits the number of parameters of a query (999 in older versions)
+QUERY_BATCH_SIZE = 900
+
+def ensure_short_inchikey_index(connection):
+    """Create the index on structures_metadata.short_inchikey if the DB does not have it yet."""
+    try:
+        connection.execute("CREATE INDEX IF NOT EXISTS structures_metadata_short_inchikey ON structures_metadata (short_inchikey)")
+        connection.commit()
+    except sqlite3.OperationalError as e:
+        # A read-only DB is still queried, only without the index
+        print(f"Unable to index short_inchikey in the structures metadata DB: {e}")
+
+def query_structures_metadata(connection, short_inchikeys):
+    """Return the structures_metadata rows of the given short InChIKeys, queried in batches."""
+    short_inchikeys = sorted(short_inchikeys)
+    records, cols = [], None
+    for start in range(0, len(short_inchikeys), QUERY_BATCH_SIZE):
+        batch = short_inchikeys[start:start + QUERY_BATCH_SIZE]
+        query = connection.execute(
+            f"SELECT * FROM structures_metadata WHERE short_inchikey IN ({','.join('?' * len(batch))})", batch)
+        cols = [column[0] for column in query.description]
+        records.extend(query.fetchall())
+    return pd.DataFrame.from_records(data=records, columns=cols)
+
+def get_sample_short_inchikeys(sample):
+    """Collect the short InChIKeys annotated in a sample manifest, from the Sirius and ISDB annotation tables."""
+    annotation_tables = []
+    try:
+        ionization_mode, sirius_inputs = detect_sirius_polarity(sample)
+    except ValueError:
+        ionization_mode = None
+    if ionization_mode is not None and get_input(sample, sirius_inputs, 'csi_adducts') is not None:
+        annotation_tables.append((get_input(sample, sirius_inputs, 'csi_adducts'), 'InChIkey2D'))
+    for polarity in sample['polarities']:
+        if get_polarity_input(sample, polarity, 'isdb') is not None:
+            annotation_tables.append((get_polarity_input(sample, polarity, 'isdb'), 'short_inchikey'))
+
+    short_inchikeys = set()
+    for table_path, column in annotation_tables:
+        keys = pd.read_csv(table_path, sep='\t', usecols=[column])[column].dropna()
+        short_inchikeys.update(key[-14:] for key in keys.astype(str))
+    return short_inchikeys
+
+# NPClassifier columns of structures_metadata, with their predicate and the class of their values
+NPC_LEVELS = [
+    ('npc_pathway', ns_kg.has_npc_pathway, ns_kg.NPCPathway),
+    ('npc_superclass', ns_kg.has_npc_superclass, ns_kg.NPCSuperclass),
+    ('npc_class', ns_kg.has_npc_class, ns_kg.NPCClass),
+]
+
+def write_structure_triples(g, structures):
+    """Write the metadata of the structures_metadata rows to the TripleWriter g, column by column."""
+    if len(structures) == 0:
+        return
+    structures = structures.reset_index(drop=True)
+    short_ik = nt_uris(kg_uri + structures['short_inchikey'])
+    inchikey = nt_uris(kg_uri + structures['inchikey'].astype(str))
+    # Only the structures matched in Wikidata are described by their full InChIKey
+    wd = (structures['wikidata_id'] != 'no_wikidata_match') & structures['wikidata_id'].notna()
+
+    g.add_columns(short_ik, ns_kg.has_smiles, nt_literals(structures['smiles']))
+    for col, predicate, rdf_class in NPC_LEVELS:
+        # One row per class of each structure, the classes of a structure being separated by |
+        names = structures[col].str.replace(" ", "_").str.replace("(", "").str.replace(")", "").str.replace("-", "_")
+        classes = pd.DataFrame({'short_ik': short_ik, 'inchikey': inchikey, 'wd': wd, 'npc': names.str.split('|')})
+        classes = classes.explode('npc').dropna(subset=['npc']).drop_duplicates(['short_ik', 'inchikey', 'npc'], ignore_index=True)
+        npc_uri = nt_uris(kg_uri + 'npc_' + classes['npc'])
+        g.add_columns(classes['short_ik'], predicate, npc_uri)
+        g.add_columns(npc_uri.drop_duplicates(), RDF.type, rdf_class)
+        g.add_columns(classes.loc[classes['wd'], 'inchikey'], predicate, npc_uri[classes['wd']])
+
+    g.add_columns(short_ik[wd], ns_kg.is_InChIkey2D_of, inchikey[wd])
+    g.add_columns(inchikey[wd], ns_kg.has_wd_id, nt_uris(structures.loc[wd, 'wikidata_id']))
+    g.add_columns(inchikey[wd], RDF.type, ns_kg.InChIkey)
+    g.add_columns(inchikey[wd], ns_kg.has_smiles, nt_literals(structures.loc[wd, 'isomeric_smiles']))
+    g.add_columns(nt_uris(structures.loc[wd, 'wikidata_id']).drop_duplicates(), RDF.type, ns_kg.WDChemical)
+
+def get_global_graph_state_path(global_graph_path):
+    return global_graph_path + '.state.json'
+
+def update_global_structures_graph(connection, db_path, manifest, samples_dir, global_graph_path, sample_dir_path, manifest_path=None):
+    """Add to the global structures graph the metadata of the structures annotated in the samples that
+    it does not hold yet, so that each structure is described once for all the samples.
+    The short InChIKeys it holds are recorded in a state file next to it, along with the size and
+    modification time of the DB. When the DB changes, the graph is built again from scratch, from
+    all the samples of sample_dir_path and not only samples_dir.
+    """
+    stat = os.stat(db_path)
+    db = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    state_path = get_global_graph_state_path(global_graph_path)
+    known_keys = None
+    try:
+        with open(state_path, 'r') as file:
+            state = json.load(file)
+        if state['db'] == db and os.path.isfile(global_graph_path):
+            known_keys = set(state['short_inchikeys'])
+    except (OSError, ValueError, KeyError):
+        pass
+    append = known_keys is not None
+    known_keys = known_keys or set()
+    if not append:
+        # The other samples have no structures_metadata.ttl left, their structures must stay in the graph
+        manifest = load_manifest(sample_dir_path, manifest_path)
+        samples_dir = list(manifest)
+
+    new_keys = set()
+    for directory in tqdm(samples_dir):
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is None:
+            continue
+        new_keys.update(get_sample_short_inchikeys(sample_manifest) - known_keys)
+
+        # The sample annotations reference the structures, their metadata is in the global graph only
+        sample_graph_path = os.path.join(sample_manifest['path'], 'rdf', 'structures_metadata.ttl')
+        if os.path.isfile(sample_graph_path):
+            os.remove(sample_graph_path)
+            print(f'Removed {sample_graph_path}, replaced by {global_graph_path}')
+
+    new_structures = query_structures_metadata(connection, new_keys)
+    with TripleWriter(global_graph_path, append=append) as g:
+        write_structure_triples(g, new_structures)
+
+    # Keys missing from the DB are looked for again on the next run
+    added_keys = set(new_structures['short_inchikey']) if len(new_structures) else set()
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'db': db, 'short_inchikeys': sorted(known_keys | added_keys)}, file)
+    os.replace(tmp_path, state_path)
+    print(f'{len(added_keys)} structures added to {global_graph_path} ({len(known_keys)} already in it)')
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script generate a RDF graph (.ttl format) from chemical structures metadata
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - Path to the SQL metadata DB with compounds' metadata
+            '''))
+
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-db', '--metadata_path', required=True,
+                        help='The path to the structures metadata SQL DB')
+
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only process these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+    parser.add_argument('-g', '--global_graph', default=None,
+                        help='Describe each structure once in this global graph instead of in every sample folder, '
+                             'only the structures it does not hold yet are added to it')
+
+    args = parser.parse_args(argv)
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    metadata_path = os.path.normpath(args.metadata_path)
+
+    # Connect to structures DB, only the structures annotated in a sample are read from it
+    dat = sqlite3.connect(metadata_path)
+    ensure_short_inchikey_index(dat)
+
+    path = os.path.normpath(sample_dir_path)
+    manifest = load_manifest(path, args.manifest, args.samples)
+    if args.samples:
+        samples_dir = args.samples
+    else:
+        samples_dir = list(manifest)
+
+    if args.global_graph:
+        update_global_structures_graph(dat, metadata_path, manifest, samples_dir, os.path.normpath(args.global_graph),
+                                       path, args.manifest)
+        return
+
+    for directory in tqdm(samples_dir):    
+        sample_manifest = manifest.get(directory)
+        if sample_manifest is None:
+            continue
+
+        # The short InChIKeys are read from the Sirius and ISDB annotation tables, not from their .ttl
+        sample_short_ik = get_sample_short_inchikeys(sample_manifest)
+        if len(sample_short_ik) == 0:
+            continue
+
+        sample_specific_db = query_structures_metadata(dat, sample_short_ik)
+
+        pathout = os.path.normpath(os.path.join(sample_dir_path, directory, "rdf", 'structures_metadata.ttl'))
+        with TripleWriter(pathout) as g:
+            write_structure_triples(g, sample_specific_db)
+        print(f'Results are in : {pathout}')
+
+if __name__ == "__main__":
+    main()
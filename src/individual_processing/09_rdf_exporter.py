@@ -4,72 +4,291 @@ import shutil
 import argparse
 import textwrap
 from tqdm import tqdm
-import gzip
 import glob
+import sys
+import re
+import json
+
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from manifest_functions import load_manifest, scan_folder, save_manifest, get_metadata
+from hash_functions import get_hash, HashingWriter
+from rdf_functions import kg_uri, iter_triple_lines
+from compression_functions import compress_files, print_compression_stats, EXTENSIONS, zstd_available
 
 # These lines allows to make sure that we are placed at the repo directory level 
 p = Path(__file__).parents[2]
 os.chdir(p)
 
-""" Argument parser """
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description=textwrap.dedent('''\
-        This script copy individual sample-specific RDF graphs(.ttl format) from the ENPKG file-architecture into a single specified folder.
-         --------------------------------
-            Arguments:
-            - (--source/-s) Path to the directory where samples folders are located.
-            - (--target/-t) Path to the directory where individual ttl files are copied.
-            - (--compress/-c) Compress files to .gz while when copying.
-        '''))
-
-parser.add_argument('-s', '--source_path', required=True,
-                    help='The path to the directory where samples folders to process are located')
-parser.add_argument('-t', '--target_path', required=True,
-                    help='The path to the directory into wich the .ttl files are copied')
-parser.add_argument('--ion_exporter', required=True, help='Ionization mode argument',
-                    help='Ionisation mode')
-parser.add_argument('-c', '--compress', action='store_true',
-                    help='Compress files to .gz')
-parser.add_argument('-d', '--delete_ttl_gz', action='store_true',
-                    help='Delete ttl.gz files')
-
-args = parser.parse_args()
-source_path = os.path.normpath(args.source_path)
-target_path = os.path.normpath(args.target_path)
-compress = args.compress
-ion_mode = args.ionization_mode
-
-os.makedirs(target_path, exist_ok=True)
-
-# Delete existing .ttl.gz files in the target directory if -d/--delete_ttl_gz is specified
-if args.delete_ttl_gz:
-    ttl_gz_files = glob.glob(os.path.join(target_path, f'*{ion_mode}*.ttl.gz'))
-    for file in ttl_gz_files:
-        os.remove(file)
-        print(f"Deleted: {file}")
-
-samples_dir = [directory for directory in os.listdir(source_path)
-               if os.path.isdir(os.path.join(source_path, directory))]
-
-df_list = []
-for directory in tqdm(samples_dir):
-    if directory == ".DS_Store" or not os.path.isdir(os.path.join(source_path, directory)):
-        continue
-    rdf_dir = os.path.join(source_path, directory, "rdf")
-    if os.path.isdir(rdf_dir):
-        for file_name in os.listdir(rdf_dir):
-            if ion_mode in file_name and 'merged_graph' in file_name:
-                src = os.path.join(rdf_dir, file_name)
+# The md5 of a merged graph is in its file name (see 08_rdf_merger.py)
+MERGED_GRAPH_HASH = re.compile(r'_merged_graph_([0-9a-f]{32})\.ttl(\.gz)?$')
+
+def get_export_state_path(target_path, sample, ion_mode):
+    # One state file per sample: the exporters of different samples run at the same time
+    return os.path.join(target_path, '.enpkg_export', f'{sample}_{ion_mode}.json')
+
+def load_export_manifest(target_path, ion_mode, samples=None):
+    """The files of the given samples (of all the samples if None) exported to target_path:
+    {exported file name: {'sample', 'ion', 'md5', 'size'}}
+    """
+    if samples is None:
+        state_paths = glob.glob(get_export_state_path(glob.escape(target_path), '*', ion_mode))
+    else:
+        state_paths = [get_export_state_path(target_path, sample, ion_mode) for sample in samples]
+    export_manifest = {}
+    for state_path in state_paths:
+        try:
+            with open(state_path, 'r') as file:
+                export_manifest.update(json.load(file))
+        except (OSError, ValueError):
+            pass
+    return {name: known for name, known in export_manifest.items() if known['ion'] == ion_mode}
+
+def save_export_manifest(export_manifest, target_path, ion_mode, samples):
+    """Write the state file of each of the samples, removing it when nothing of the sample is exported."""
+    os.makedirs(os.path.dirname(get_export_state_path(target_path, '', ion_mode)), exist_ok=True)
+    for sample in samples:
+        state_path = get_export_state_path(target_path, sample, ion_mode)
+        state = {name: known for name, known in export_manifest.items() if known['sample'] == sample}
+        if state:
+            save_manifest(state, state_path)
+        elif os.path.isfile(state_path):
+            os.remove(state_path)
+
+def get_source_hash(src):
+    match = MERGED_GRAPH_HASH.search(os.path.basename(src))
+    return match.group(1) if match else get_hash(src)
+
+def list_merged_graphs(rdf_dir, ion_mode):
+    return sorted(file_name for file_name in os.listdir(rdf_dir)
+                  if ion_mode in file_name and 'merged_graph' in file_name and file_name.endswith(('.ttl', '.ttl.gz'))
+                  and os.path.isfile(os.path.join(rdf_dir, file_name)))
+
+def get_sample_graph_uri(sample_manifest, directory):
+    """The named graph of a sample: its URI in the graph (see 01_a_rdf_enpkg_metadata_indi.py), or its folder name without metadata."""
+    metadata = get_metadata(sample_manifest) if sample_manifest else None
+    if metadata is not None and 'sample_id' in metadata.columns:
+        return kg_uri + str(metadata.sample_id[0])
+    return kg_uri + directory
+
+def get_shard_index_path(target_path, ion_mode):
+    return os.path.join(target_path, f'enpkg_{ion_mode}_shards.json')
+
+def write_nquads_shards(graphs, target_path, ion_mode, shard_size, compress):
+    """Stream the merged graphs into N-Quads shards of about shard_size bytes (uncompressed), gzipped while
+    written if compress. graphs is a list of (sample, named graph URI, merged graph paths); a sample is never
+    split between shards, so a sample larger than shard_size gets a shard of its own.
+    Returns the description of each shard, for the shard index.
+    """
+    shards = []
+    extension = '.nq.gz' if compress else '.nq'
+    out = None
+    try:
+        for sample, graph_uri, paths in graphs:
+            if out is None or size >= shard_size:
+                if out is not None:
+                    shards[-1]['md5'] = out.hexdigest()
+                    out.commit(lambda _: shard_path)
+                shard_path = os.path.join(target_path, f'enpkg_{ion_mode}_{len(shards):04d}{extension}')
+                out = HashingWriter(shard_path + '.tmp', compress=compress)
+                shards.append({'file': os.path.basename(shard_path), 'graphs': [], 'quads': 0})
+                size = 0
+            graph_suffix = f' <{graph_uri}> .\n'
+            for path in paths:
+                for line in iter_triple_lines(path):
+                    # 'S P O .' -> 'S P O <graph> .'
+                    data = (line.rstrip()[:-1].rstrip() + graph_suffix).encode('utf-8')
+                    out.write(data)
+                    size += len(data)
+                    shards[-1]['quads'] += 1
+            shards[-1]['graphs'].append({'sample': sample, 'graph': graph_uri})
+    except BaseException:
+        # No partly written shard is left behind
+        if out is not None and out.path is None:
+            out.discard()
+        raise
+    if out is not None:
+        shards[-1]['md5'] = out.hexdigest()
+        out.commit(lambda _: shard_path)
+    for shard in shards:
+        shard['size'] = os.path.getsize(os.path.join(target_path, shard['file']))
+    return shards
+
+def export_nquads(args, samples_dir, source_path, target_path, ion_mode):
+    """Bundle the merged graphs into N-Quads shards with one named graph per sample, listed in a shard index.
+    The shards are written again only when the merged graphs changed.
+    """
+    manifest = load_manifest(source_path, args.manifest, args.samples)
+    graphs, sources = [], {}
+    for directory in samples_dir:
+        rdf_dir = os.path.join(source_path, directory, "rdf")
+        if not os.path.isdir(rdf_dir):
+            print(f"Directory not found: {rdf_dir}")  # Debug print
+            continue
+        file_names = list_merged_graphs(rdf_dir, ion_mode)
+        if file_names:
+            paths = [os.path.join(rdf_dir, file_name) for file_name in file_names]
+            graphs.append((directory, get_sample_graph_uri(manifest.get(directory), directory), paths))
+            sources[directory] = [get_source_hash(path) for path in paths]
+
+    compress = args.compress
+    params = {'shard_size': args.shard_size, 'compress': compress, 'method': args.method if compress else None}
+    index_path = get_shard_index_path(target_path, ion_mode)
+    try:
+        with open(index_path, 'r') as file:
+            previous = json.load(file)
+    except (OSError, ValueError):
+        previous = {'shards': []}
+    if (not args.recompute and previous.get('sources') == sources and previous.get('params') == params
+            and all(os.path.isfile(os.path.join(target_path, shard['file'])) for shard in previous['shards'])):
+        print(f'{index_path} is up to date, skipping')
+        return
 
-                if os.path.isfile(src):
-                    dst = os.path.join(target_path, file_name)
+    shards = write_nquads_shards(graphs, target_path, ion_mode, args.shard_size * 1e6, compress and args.method == 'gzip')
+    if compress and args.method != 'gzip':
+        # Other methods than gzip compress the written shards
+        jobs = [(os.path.join(target_path, shard['file']), os.path.join(target_path, shard['file'] + EXTENSIONS[args.method]))
+                for shard in shards]
+        for shard, stats in zip(shards, compress_files(jobs, method=args.method, level=args.level, workers=args.workers)):
+            print_compression_stats(stats)
+            os.remove(stats['source'])
+            shard['file'], shard['size'] = os.path.basename(stats['target']), stats['compressed_size']
 
-                    if compress:
-                        file_out = dst + '.gz'
-                        with open(src, 'rb') as f_in, gzip.open(file_out, 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                    else:
-                        shutil.copyfile(src, dst)
+    current = {shard['file'] for shard in shards}
+    for shard in previous['shards']:
+        shard_path = os.path.join(target_path, shard['file'])
+        if shard['file'] not in current and os.path.isfile(shard_path):
+            os.remove(shard_path)
+            print(f"Deleted: {shard_path}")
+    save_manifest({'ion': ion_mode, 'params': params, 'sources': sources, 'shards': shards}, index_path)
+    print(f"{len(graphs)} sample graphs, {sum(shard['quads'] for shard in shards)} quads in {len(shards)} shards, index in {index_path}")
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script copy individual sample-specific RDF graphs(.ttl format) from the ENPKG file-architecture into a single specified folder.
+             --------------------------------
+                Arguments:
+                - (--source/-s) Path to the directory where samples folders are located.
+                - (--target/-t) Path to the directory where individual ttl files are copied.
+                - (--compress/-c) Compress files to .gz while when copying.
+                - (--delete_ttl_gz/-d) Delete the exported files that are not exported again.
+                - (--method/-m) Compression method, gzip or zstd (.zst).
+                - (--workers/-w) Number of files, and of pieces of large files, compressed in parallel.
+                - (--nquads/-q) Bundle the graphs into N-Quads shards, one named graph per sample, instead of copying them.
+            '''))
+
+    parser.add_argument('-s', '--source_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('-t', '--target_path', required=True,
+                        help='The path to the directory into wich the .ttl files are copied')
+    parser.add_argument('--ion_exporter', required=True,
+                        help='Ionisation mode')
+    parser.add_argument('-c', '--compress', action='store_true',
+                        help='Compress files to .gz')
+    parser.add_argument('-m', '--method', default='gzip', choices=list(EXTENSIONS),
+                        help='The compression method, zstd needs the zstandard package (default: gzip)')
+    parser.add_argument('-l', '--level', type=int, default=None,
+                        help='The compression level (default: 9 for gzip, 3 for zstd)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='The number of files, and of pieces of large files, compressed in parallel (default: number of CPUs)')
+    parser.add_argument('-d', '--delete_ttl_gz', action='store_true',
+                        help='Delete the ttl.gz files of the target that are not exported again')
+    parser.add_argument('-r', '--recompute', action='store_true',
+                        help='Export every graph again, even those already exported')
+    parser.add_argument('-q', '--nquads', action='store_true',
+                        help='Bundle the merged graphs into N-Quads shards with one named graph per sample, listed in enpkg_{ion}_shards.json')
+    parser.add_argument('--shard_size', type=float, default=1000,
+                        help='The size in MB (uncompressed) after which a new N-Quads shard is started (default: 1000)')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only export these sample folders (default: all the folders in source_path)')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+
+    args = parser.parse_args(argv)
+    if args.compress and args.method == 'zstd' and not zstd_available:
+        parser.error('zstd compression needs the zstandard package (pip install zstandard)')
+    source_path = os.path.normpath(args.source_path)
+    target_path = os.path.normpath(args.target_path)
+    compress = args.compress
+    ion_mode = args.ion_exporter
+
+    os.makedirs(target_path, exist_ok=True)
+
+    if args.samples:
+        samples_dir = args.samples
+    elif args.manifest:
+        samples_dir = list(load_manifest(source_path, args.manifest))
     else:
-        print(f"Directory not found: {rdf_dir}")  # Debug print
+        # Only the folder names are needed, the samples are not described
+        samples_dir = sorted(folder for folder in scan_folder(source_path)[1] if not folder.startswith('.'))
+
+    if args.nquads:
+        export_nquads(args, samples_dir, source_path, target_path, ion_mode)
+        return
+
+    # The state files of the samples record the md5 of the source of each exported file: a graph
+    # already exported with the same hash is neither copied nor compressed again
+    export_manifest = load_export_manifest(target_path, ion_mode, args.samples)
+    # Only the state files of these samples are written again, those of the samples exported at the same time are left alone
+    state_samples = set(samples_dir) | {known['sample'] for known in export_manifest.values()}
+    exported = {}
+    copy_jobs, compress_jobs = [], []
+    up_to_date = 0
+    for directory in tqdm(samples_dir):
+        rdf_dir = os.path.join(source_path, directory, "rdf")
+        if os.path.isdir(rdf_dir):
+            for file_name in list_merged_graphs(rdf_dir, ion_mode):
+                src = os.path.join(rdf_dir, file_name)
+                # Merged graphs already gzipped by 08_rdf_merger.py are copied as they are
+                dst_name = file_name + EXTENSIONS[args.method] if compress and not file_name.endswith('.gz') else file_name
+                dst = os.path.join(target_path, dst_name)
+                entry = {'sample': directory, 'ion': ion_mode, 'md5': get_source_hash(src)}
+                exported[dst_name] = entry
+
+                known = export_manifest.get(dst_name)
+                if (not args.recompute and known and known['md5'] == entry['md5']
+                        and os.path.isfile(dst) and os.path.getsize(dst) == known['size']):
+                    entry['size'] = known['size']
+                    up_to_date += 1
+                elif dst_name == file_name:
+                    copy_jobs.append((src, dst))
+                else:
+                    compress_jobs.append((src, dst))
+        else:
+            print(f"Directory not found: {rdf_dir}")  # Debug print
+
+    # Delete the exported files of the target directory that are not exported again if -d/--delete_ttl_gz is specified
+    # When only some samples are exported, only their own files are deleted
+    if args.delete_ttl_gz:
+        if args.samples:
+            ttl_gz_files = [file for directory in samples_dir for extension in EXTENSIONS.values()
+                            for file in glob.glob(os.path.join(target_path, f'*_{glob.escape(directory)}_merged_graph*.ttl{extension}'))
+                            if ion_mode in os.path.basename(file)]
+        else:
+            ttl_gz_files = [file for extension in EXTENSIONS.values()
+                            for file in glob.glob(os.path.join(target_path, f'*{ion_mode}*.ttl{extension}'))]
+        stale_files = {os.path.basename(file) for file in ttl_gz_files} | set(export_manifest)
+        for file_name in sorted(stale_files - set(exported)):
+            file = os.path.join(target_path, file_name)
+            if os.path.isfile(file):
+                os.remove(file)
+                print(f"Deleted: {file}")
+            export_manifest.pop(file_name, None)
+
+    for src, dst in copy_jobs:
+        shutil.copyfile(src, dst)
+        exported[os.path.basename(dst)]['size'] = os.path.getsize(dst)
+    for stats in compress_files(compress_jobs, method=args.method, level=args.level, workers=args.workers):
+        print_compression_stats(stats)
+        exported[os.path.basename(stats['target'])]['size'] = stats['compressed_size']
+
+    export_manifest.update(exported)
+    # Forget the files that are no longer in the target directory
+    export_manifest = {name: known for name, known in export_manifest.items() if os.path.isfile(os.path.join(target_path, name))}
+    save_export_manifest(export_manifest, target_path, ion_mode, sorted(state_samples))
+    print(f'{len(copy_jobs) + len(compress_jobs)} files exported, {up_to_date} already up to date')
+
+if __name__ == "__main__":
+    main()
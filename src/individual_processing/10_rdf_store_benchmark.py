@@ -0,0 +1,227 @@
+from pathlib import Path
+import os
+import sys
+import time
+import json
+import glob
+import statistics
+import argparse
+import textwrap
+from string import Template
+import rdflib
+
+try:
+    import pyoxigraph
+    oxigraph_available = True
+except ImportError:
+    oxigraph_available = False
+
+sys.path.append(os.path.join(Path(__file__).parents[1], 'functions'))
+from manifest_functions import load_manifest, scan_folder
+from rdf_functions import kg_uri, open_rdf, is_ntriples
+
+# These lines allows to make sure that we are placed at the repo directory level
+p = Path(__file__).parents[2]
+os.chdir(p)
+
+PREFIXES = f'PREFIX enpkg: <{kg_uri}>\n'
+
+# Queries used to pick the InChIKey2D and the feature of the benchmark queries, unless they are given
+# They are ordered, so that every backend runs the benchmark queries with the same values
+PROBE_QUERIES = {
+    'inchikey2d': 'SELECT ?value WHERE { ?annotation enpkg:has_InChIkey2D ?value } ORDER BY ?value LIMIT 1',
+    'feature': 'SELECT ?value WHERE { ?pair enpkg:has_member_1 ?value } ORDER BY ?value LIMIT 1',
+}
+
+# Representative queries of the knowledge graph
+QUERIES = {
+    # The features annotated (by Sirius or ISDB) with a structure
+    'features_by_inchikey2d': '''
+        SELECT ?feature ?annotation WHERE {
+            VALUES ?ik2d { <$inchikey2d> }
+            ?annotation enpkg:has_InChIkey2D ?ik2d .
+            { ?feature enpkg:has_sirius_annotation ?annotation } UNION { ?feature enpkg:has_isdb_annotation ?annotation }
+        }''',
+    # The rank 1 TIMA annotation of each feature of each sample, best first
+    'top_tima_annotations_per_sample': '''
+        SELECT ?sample ?feature ?annotation ?score WHERE {
+            ?sample enpkg:has_LCMS ?lcms .
+            ?lcms enpkg:has_lcms_feature_list/enpkg:has_lcms_feature ?feature .
+            ?feature enpkg:has_tima_annotation ?annotation .
+            ?annotation enpkg:has_rank_final 1 ;
+                        enpkg:has_final_score ?score .
+        }
+        ORDER BY ?sample DESC(?score)''',
+    # The molecular network neighbours of a feature, most similar first
+    'mn_neighbours': '''
+        SELECT ?neighbour ?cosine WHERE {
+            VALUES ?feature { <$feature> }
+            { ?pair enpkg:has_member_1 ?feature ; enpkg:has_member_2 ?neighbour }
+            UNION
+            { ?pair enpkg:has_member_2 ?feature ; enpkg:has_member_1 ?neighbour }
+            ?pair enpkg:has_cosine ?cosine .
+        }
+        ORDER BY DESC(?cosine)''',
+}
+
+def open_store(backend, store_path):
+    """Open (or create) the on-disk store and empty it, so that every run loads the same graphs.
+    Returns the store and whether it is on disk: without the berkeleydb package, rdflib can only load the graphs in memory.
+    """
+    if backend == 'oxigraph':
+        os.makedirs(store_path, exist_ok=True)
+        store = pyoxigraph.Store(store_path)
+        store.clear()
+        return store, True
+    try:
+        store = rdflib.Graph(store='BerkeleyDB')
+        os.makedirs(store_path, exist_ok=True)
+        store.open(store_path, create=True)
+        persistent = True
+    except Exception as e:
+        print(f'WARNING: no persistent rdflib store ({e}). The graphs are loaded in an in-memory rdflib Graph, '
+              'the results do not measure an on-disk store (install pyoxigraph, or berkeleydb for rdflib)', file=sys.stderr)
+        store = rdflib.Graph()
+        persistent = False
+    store.remove((None, None, None))
+    return store, persistent
+
+def close_store(backend, store):
+    if backend == 'oxigraph':
+        store.flush()
+    else:
+        store.close()
+
+def load_graph(backend, store, file_path):
+    ntriples = is_ntriples(file_path)
+    with open_rdf(file_path, 'rb') as file:
+        if backend == 'oxigraph':
+            rdf_format = pyoxigraph.RdfFormat.N_TRIPLES if ntriples else pyoxigraph.RdfFormat.TURTLE
+            store.bulk_load(file, format=rdf_format)
+        else:
+            store.parse(file, format='nt' if ntriples else 'turtle')
+
+def run_query(backend, store, query):
+    """Run a query and return its rows, as lists of strings."""
+    if backend == 'oxigraph':
+        return [[term.value if term is not None else None for term in solution] for solution in store.query(PREFIXES + query)]
+    return [[str(term) if term is not None else None for term in row] for row in store.query(PREFIXES + query)]
+
+def list_merged_graphs(source_path, samples_dir):
+    paths = []
+    for directory in samples_dir:
+        rdf_dir = os.path.join(source_path, directory, 'rdf')
+        paths += sorted(glob.glob(os.path.join(glob.escape(rdf_dir), '*_merged_graph_*.ttl'))
+                        + glob.glob(os.path.join(glob.escape(rdf_dir), '*_merged_graph_*.ttl.gz')))
+    return paths
+
+def benchmark(backend, store_path, graph_paths, repeat=5, parameters=None):
+    """Load graph_paths in the store, then run each query of QUERIES repeat times.
+    Returns the report: load throughput and, for each query, its rows and latencies in ms.
+    """
+    store, persistent = open_store(backend, store_path)
+    start = time.perf_counter()
+    for path in graph_paths:
+        load_graph(backend, store, path)
+    load_seconds = time.perf_counter() - start
+    triples = len(store)
+    size = sum(os.path.getsize(path) for path in graph_paths)
+    # Results of an in-memory graph are labelled as such, not to be compared with those of an on-disk store
+    report = {'backend': backend if persistent else f'{backend} (in-memory)', 'persistent': persistent,
+              'store': store_path if persistent else None,
+              'load': {'files': len(graph_paths), 'triples': triples, 'size': size, 'seconds': load_seconds,
+                       'triples_per_s': triples / load_seconds if load_seconds else 0.0,
+                       'mb_per_s': size / 1e6 / load_seconds if load_seconds else 0.0},
+              'parameters': {}, 'queries': {}}
+
+    parameters = dict(parameters or {})
+    for name, probe in PROBE_QUERIES.items():
+        if not parameters.get(name):
+            rows = run_query(backend, store, probe)
+            parameters[name] = rows[0][0] if rows else kg_uri + 'none'
+    report['parameters'] = parameters
+
+    for name, query in QUERIES.items():
+        query = Template(query).safe_substitute(parameters)
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = run_query(backend, store, query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        report['queries'][name] = {'rows': len(rows), 'first_ms': latencies[0], 'min_ms': min(latencies),
+                                   'median_ms': statistics.median(latencies), 'max_ms': max(latencies)}
+    close_store(backend, store)
+    return report
+
+def print_report(report):
+    load = report['load']
+    print(f"{report['backend']}: {load['triples']} triples from {load['files']} files ({load['size'] / 1e6:.1f} MB) "
+          f"loaded in {load['seconds']:.2f} s, {load['triples_per_s']:.0f} triples/s, {load['mb_per_s']:.1f} MB/s")
+    for name, stats in report['queries'].items():
+        print(f"{name}: {stats['rows']} rows, first run {stats['first_ms']:.1f} ms, "
+              f"median {stats['median_ms']:.1f} ms (min {stats['min_ms']:.1f}, max {stats['max_ms']:.1f})")
+
+def main(argv=None):
+    """ Argument parser """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            This script loads the merged graphs of the samples in an embedded on-disk store (pyoxigraph, or rdflib)
+            and runs a fixed set of SPARQL queries on it, to measure what the graphs cost at query time.
+             --------------------------------
+                Arguments:
+                - Path to the directory where samples folders are located
+                - (--backend) Store to load the graphs in: oxigraph (needs pyoxigraph) or rdflib
+                - (--store_path) Folder of the on-disk store, emptied at each run
+                - (--repeat) Number of runs of each query
+            '''))
+
+    parser.add_argument('-p', '--sample_dir_path', required=True,
+                        help='The path to the directory where samples folders to process are located')
+    parser.add_argument('--backend', choices=['oxigraph', 'rdflib'], default='oxigraph' if oxigraph_available else 'rdflib',
+                        help='The store to load the graphs in (default: oxigraph if pyoxigraph is installed, else rdflib)')
+    parser.add_argument('--store_path', default=None,
+                        help='The folder of the on-disk store, emptied at each run (default: .enpkg_store in sample_dir_path)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='The number of runs of each query (default: 5)')
+    parser.add_argument('--inchikey2d', default=None,
+                        help='The InChIKey2D URI of the features_by_inchikey2d query (default: the first one in the store)')
+    parser.add_argument('--feature', default=None,
+                        help='The feature URI of the mn_neighbours query (default: the first feature of a MN pair in the store)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Also write the report to this .json file')
+    parser.add_argument('--samples', nargs='+', default=None,
+                        help='Only load these sample folders (default: all the folders in sample_dir_path)')
+    parser.add_argument('--manifest', default=None,
+                        help='The sample manifest written by rdf_builder.py (default: list the sample folders again)')
+
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error('The number of runs of each query must be at least 1')
+    if args.backend == 'oxigraph' and not oxigraph_available:
+        parser.error('The oxigraph backend needs the pyoxigraph package (pip install pyoxigraph)')
+    sample_dir_path = os.path.normpath(args.sample_dir_path)
+    store_path = os.path.normpath(args.store_path or os.path.join(sample_dir_path, '.enpkg_store'))
+
+    if args.samples:
+        samples_dir = args.samples
+    elif args.manifest:
+        samples_dir = list(load_manifest(sample_dir_path, args.manifest))
+    else:
+        samples_dir = sorted(folder for folder in scan_folder(sample_dir_path)[1] if not folder.startswith('.'))
+
+    graph_paths = list_merged_graphs(sample_dir_path, samples_dir)
+    if not graph_paths:
+        print(f'No merged graph found in {sample_dir_path}, run 08_rdf_merger.py first')
+        return
+
+    report = benchmark(args.backend, store_path, graph_paths, args.repeat,
+                       {'inchikey2d': args.inchikey2d, 'feature': args.feature})
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+        print(f'Report is in : {args.output}')
+
+if __name__ == "__main__":
+    main()
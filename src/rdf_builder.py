@@ -1,20 +1,123 @@
-import subprocess
 import concurrent.futures
 import argparse
 import os
 import math
-
-def run_script(base_path, script_path, params):
-    # Build the command
-    full_path = base_path + script_path
-    command = ["python", full_path] + params.split()
-
-    # Run the command and capture output
-    try:
-        output = subprocess.run(command, capture_output=True, text=True, check=True)
-        return {"script": script_path, "output": output.stdout, "error": output.stderr}
-    except subprocess.CalledProcessError as e:
-        return {"script": script_path, "output": e.stdout, "error": e.stderr}
+import io
+import contextlib
+import traceback
+import sys
+import importlib.util
+from pathlib import Path
+from tqdm import tqdm
+
+sys.path.append(os.path.join(Path(__file__).parent, 'functions'))
+from manifest_functions import build_manifest, save_manifest
+
+# Stage modules already imported by this process, so that pandas, rdflib, networkx
+# and the shared namespaces / adducts dictionary stay loaded between two stages.
+_stage_modules = {}
+
+def load_stage(base_path, script_path):
+    """Import a stage script once per worker process and return the cached module."""
+    if script_path not in _stage_modules:
+        full_path = os.path.join(base_path, script_path)
+        module_name = 'stage_' + os.path.splitext(script_path)[0].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(module_name, full_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _stage_modules[script_path] = module
+    return _stage_modules[script_path]
+
+def run_script(base_path, script_path, params, sample=None):
+    # Run the stage main() in the current process and capture its output
+    argv = params.split()
+    if sample is not None:
+        argv += ['--samples', sample]
+    stdout, stderr = io.StringIO(), io.StringIO()
+    failed = False
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            module = load_stage(base_path, script_path)
+            module.main(argv)
+        except SystemExit as e:
+            if e.code:
+                failed = True
+                print(f"{script_path} exited with status {e.code}", file=sys.stderr)
+        except Exception:
+            failed = True
+            traceback.print_exc()
+    return {"script": script_path, "sample": sample, "failed": failed,
+            "output": stdout.getvalue(), "error": stderr.getvalue()}
+
+def print_result(result, verbose=False):
+    # Only report failed stages unless the verbose mode is on
+    if not (verbose or result['failed']):
+        return
+    if result['sample'] is not None:
+        print(f"Script: {result['script']} on sample: {result['sample']}")
+    else:
+        print(f"Script: {result['script']}")
+    if result['output']:
+        print("Output:\n", result['output'])
+    if result['error']:
+        print("Errors:\n", result['error'])
+
+def run_sample_dag(executor, base_path, samples_dir, first_wave, chained, verbose=False):
+    """Run the pipeline as one dependency chain per sample.
+    The first wave scripts of a sample run in parallel as (script, sample) tasks. As soon as they
+    are all done for this sample, the chained scripts (merger, then exporter) run one after the
+    other on it, without waiting for the other samples.
+    Once a task of a sample failed, the rest of its chain is skipped: a merged graph is never
+    built (or exported) from partial stage outputs.
+    """
+    remaining = {directory: len(first_wave) for directory in samples_dir}
+    failed_samples = set()
+    futures = {}
+    total = len(samples_dir) * (len(first_wave) + len(chained))
+    failed = skipped = 0
+
+    def submit_chained(directory, step):
+        if step < len(chained):
+            script, params = chained[step]
+            futures[executor.submit(run_script, base_path, script, params, directory)] = (directory, step)
+
+    for directory in samples_dir:
+        if first_wave:
+            for script, params in first_wave:
+                futures[executor.submit(run_script, base_path, script, params, directory)] = (directory, None)
+        else:
+            submit_chained(directory, 0)
+
+    with tqdm(total=total) as progress:
+        def skip_chained(directory, step):
+            nonlocal skipped
+            if step < len(chained):
+                names = ', '.join(script for script, _ in chained[step:])
+                print(f'Skipping {names} on sample: {directory}, a previous stage failed')
+                skipped += len(chained) - step
+                progress.update(len(chained) - step)
+
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                directory, step = futures.pop(future)
+                result = future.result()
+                failed += result['failed']
+                if result['failed']:
+                    failed_samples.add(directory)
+                print_result(result, verbose)
+                progress.update(1)
+                next_step = 0 if step is None else step + 1
+                if step is None:
+                    remaining[directory] -= 1
+                    if remaining[directory] > 0:
+                        continue
+                if directory in failed_samples:
+                    skip_chained(directory, next_step)
+                else:
+                    submit_chained(directory, next_step)
+
+    print(f'{total - failed - skipped} tasks done, {failed} failed, {skipped} skipped')
 
 def main():
     parser = argparse.ArgumentParser(description='Run scripts in parallel.')
@@ -39,12 +142,15 @@ def main():
     # Adding script activation flags for the new scripts
     parser.add_argument('--rdf_merger', action='store_true', help='Run script 08_rdf_merger.py')
     parser.add_argument('--rdf_exporter', action='store_true', help='Run script 09_rdf_exporter.py')
+    parser.add_argument('--store_benchmark', action='store_true', help='Run script 10_rdf_store_benchmark.py on the merged graphs, once all the samples are done')
     parser.add_argument('--rdf_merger_compress', action='store_true', help='Compress the output of script 08_rdf_merger.py')
     parser.add_argument('--merged_graph_only', action='store_true', help='Use only the merged graph for the gz file')
+    parser.add_argument('-r', '--recompute', action='store_true', help='Recompute even if the outputs are already present and up to date with their inputs')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the output of every stage, not only of the failed ones')
 
     args = parser.parse_args()
 
-    if not any([args.metadata, args.featuretable, args.sirius_structure, args.sirius_class, args.tima, args.molecularnetworking, args.rdf_merger, args.rdf_exporter]):
+    if not any([args.metadata, args.featuretable, args.sirius_structure, args.sirius_class, args.tima, args.molecularnetworking, args.rdf_merger, args.rdf_exporter, args.store_benchmark]):
         print("No scripts selected to run. Please use the flags to select scripts.")
         return
     
@@ -77,6 +183,8 @@ def main():
 
     if args.rdf_exporter:
         print("Running rdf export: 09_rdf_exporter.py")
+    if args.store_benchmark:
+        print("Running store benchmark: 10_rdf_store_benchmark.py")
     total_cpus = os.cpu_count()
     print('Total number of cpus: ',  total_cpus)
     user_cpus = args.cpu
@@ -87,10 +195,24 @@ def main():
     script_dir = os.path.dirname(os.path.realpath(__file__))
     base_path = os.path.join(script_dir, "individual_processing/")
 
-    params_wrapper_folder = "-p " + args.sample_dir_path
+    # The stages resolve relative paths from the repo directory level, do the same here
+    os.chdir(Path(script_dir).parent)
+    path = os.path.normpath(args.sample_dir_path)
+    # The sample folders are described once, every stage reads this manifest instead of listing them again
+    manifest = build_manifest(path)
+    manifest_path = os.path.join(path, '.enpkg_manifest.json')
+    save_manifest(manifest, manifest_path)
+    samples_dir = list(manifest)
+    print(f'Number of samples: {len(samples_dir)}')
+
+    params_wrapper_folder = "-p " + args.sample_dir_path + " --manifest " + manifest_path
+    if args.recompute:
+        params_wrapper_folder += " -r"
     params_wrapper_ion = "-ion " + args.ionization_mode
     params_wrapper_ion_sirius = "-ion " + args.ion_sirius if args.ion_sirius else params_wrapper_ion
-    params_wrapper_exporter = "-s " + args.sample_dir_path + " -t "+ args.sample_dir_path + " --ion_exporter "+args.ionization_mode+" -c -d"
+    params_wrapper_exporter = "-s " + args.sample_dir_path + " -t "+ args.sample_dir_path + " --ion_exporter "+args.ionization_mode+" -c -d --manifest " + manifest_path
+    # The exporters of the samples run in the pool processes, each one compresses with its share of the CPUs
+    params_wrapper_exporter += " -w " + str(max(1, total_cpus // num_cpus_to_use))
 
     # Define scripts and their parameters
     scripts = {
@@ -111,36 +233,23 @@ def main():
     print('Third wave scripts')
     third_wave_scripts = {k: v for k, v in scripts.items() if k.startswith("09_")}
 
-    # Run only selected scripts in parallel
+    first_wave = [(script, params) for script, (params, run_flag) in first_wave_scripts.items() if run_flag]
+    second_wave = [(script, params) for script, (params, run_flag) in second_wave_scripts.items() if run_flag]
+    third_wave = [(script, params) for script, (params, run_flag) in third_wave_scripts.items() if run_flag]
+
     with concurrent.futures.ProcessPoolExecutor(max_workers=num_cpus_to_use) as executor:
-        futures = {executor.submit(run_script, base_path, script, params): script for script, (params, run_flag) in first_wave_scripts.items() if run_flag}
-
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            script = futures[future]
-            print(f"Script: {script}")
-            if result['output']:
-                print("Output:\n", result['output'])
-            if result['error']:
-                print("Errors:\n", result['error'])
-
-        for script, (params, run_flag) in second_wave_scripts.items():
-            if run_flag:
-                result = run_script(base_path, script, params)
-                print(f"Script: {script}")
-                if result['output']:
-                    print("Output:\n", result['output'])
-                if result['error']:
-                    print("Errors:\n", result['error'])
-
-        for script, (params, run_flag) in third_wave_scripts.items():
-            if run_flag:
-                result = run_script(base_path, script, params)
-                print(f"Script: {script}")
-                if result['output']:
-                    print("Output:\n", result['output'])
-                if result['error']:
-                    print("Errors:\n", result['error'])
+        run_sample_dag(executor, base_path, samples_dir, first_wave, second_wave + third_wave, args.verbose)
+
+    # The exporter of a sample only deletes the files of that sample: one last export of all the samples
+    # removes those of the samples no longer in the folder (the other graphs are already exported)
+    if args.rdf_exporter:
+        result = run_script(base_path, "09_rdf_exporter.py", params_wrapper_exporter)
+        print_result(result, args.verbose)
+
+    # The benchmark loads the merged graphs of all the samples together, once they are all written
+    if args.store_benchmark:
+        result = run_script(base_path, "10_rdf_store_benchmark.py", "-p " + args.sample_dir_path + " --manifest " + manifest_path)
+        print_result(result, verbose=True)
 
 if __name__ == "__main__":
     main()